@@ -0,0 +1,95 @@
+# ---------------------------------------------------------------------------
+# Analysis Follow-up — a second, targeted analysis pass for weak fields only.
+#
+# analyze_image does one comprehensive pass to fit the request timeout. The
+# fields that pass leaves missing, null-like or vague (analysis_model
+# .weak_fields) are asked for again in a much shorter follow-up request on
+# the same image, and the answers are merged into the first pass. The
+# follow-up runs only if the request still has time for an analysis call;
+# /api/analyze streams the first pass to the UI while it runs (see the
+# route).
+#
+# ANALYSIS_FOLLOWUP             1 = follow up on weak fields (default 1)
+# ANALYSIS_FOLLOWUP_MAX_FIELDS  most fields asked for in one follow-up (default 12)
+# ---------------------------------------------------------------------------
+
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import logs
+from analysis_model import Analysis, completeness, weak_fields
+from deadline import Deadline
+from metrics import Counter
+from prompts import get_prompt
+
+ANALYSIS_FOLLOWUP = os.getenv("ANALYSIS_FOLLOWUP", "1") == "1"
+ANALYSIS_FOLLOWUP_MAX_FIELDS = int(os.getenv("ANALYSIS_FOLLOWUP_MAX_FIELDS", "12"))
+
+log = logs.get_logger("followup")
+
+FOLLOWUPS = Counter(
+    "tryon_analysis_followups_total", "Analysis follow-ups, by outcome "
+    "(filled/unchanged/skipped/failed).", ("outcome",),
+)
+FOLLOWUP_FIELDS = Counter(
+    "tryon_analysis_followup_fields_total", "Weak fields asked for in follow-ups, and how many got filled.",
+    ("result",),
+)
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("ANALYSIS_FOLLOWUP_THREADS", "8")),
+                               thread_name_prefix="followup")
+
+
+def plan(analysis: Analysis) -> list[str]:
+    """Weak fields worth a follow-up (empty when disabled or complete)."""
+    if not ANALYSIS_FOLLOWUP:
+        return []
+    return weak_fields(analysis)[:ANALYSIS_FOLLOWUP_MAX_FIELDS]
+
+
+def prompt_text(fields: list[str]) -> str:
+    return get_prompt("followup").text.replace("{fields}", "\n".join(f"- {name}" for name in fields))
+
+
+def run(analysis: Analysis, fields: list[str], ask, merge, deadline: Deadline) -> dict:
+    """Ask for `fields` again and merge the answers into `analysis`.
+
+    ask(prompt_text, deadline) -> answer dict
+    merge(base_dict, answer_dict, replace=fields) -> merged dict
+
+    Returns {status, details, filled, weak_fields, completeness, error};
+    status is done, skipped (no time) or failed, and `details` is the first
+    pass unchanged unless it is done.
+    """
+    result = {"status": "skipped", "details": analysis.to_dict(), "filled": [], "weak_fields": fields,
+              "completeness": completeness(analysis), "error": None}
+    if not deadline.has_time_for("analysis_followup"):
+        deadline.skip("analysis_followup")
+        FOLLOWUPS.inc(outcome="skipped")
+        return result
+    FOLLOWUP_FIELDS.inc(len(fields), result="asked")
+    log.info("Following up on %d weak field(s)", len(fields), extra={"fields": fields})
+    try:
+        answer = ask(prompt_text(fields), deadline)
+        if not isinstance(answer, dict):
+            raise ValueError(f"Follow-up answer is not a JSON object: {type(answer).__name__}")
+        merged = Analysis.from_dict(merge(analysis.to_dict(), answer, replace=frozenset(fields)))
+    except Exception as e:
+        log.warning("Follow-up failed: %s", e)
+        FOLLOWUPS.inc(outcome="failed")
+        result.update(status="failed", error=str(e)[:200])
+        return result
+    still_weak = weak_fields(merged)
+    filled = [name for name in fields if name not in still_weak]
+    FOLLOWUP_FIELDS.inc(len(filled), result="filled")
+    FOLLOWUPS.inc(outcome="filled" if filled else "unchanged")
+    log.info("Follow-up filled %d/%d field(s)", len(filled), len(fields), extra={"filled": filled})
+    return {"status": "done", "details": merged.to_dict(), "filled": filled, "weak_fields": still_weak,
+            "completeness": completeness(merged), "error": None}
+
+
+def start(analysis: Analysis, fields: list[str], ask, merge, deadline: Deadline) -> Future:
+    """run() in the background, so the caller can return the first pass meanwhile."""
+    # Carry the request context (log request ID, prompt variant) into the worker.
+    return _executor.submit(contextvars.copy_context().run, run, analysis, fields, ask, merge, deadline)
@@ -0,0 +1,245 @@
+# ---------------------------------------------------------------------------
+# Analysis Model — the vision model's JSON normalized once at ingest
+# (api_analyze / parsed analysis_json): null-like values stripped, hex codes
+# validated to #RRGGBB, jewelry pieces indexed by type. Prompt builders read
+# the typed fields instead of re-checking raw dict values.
+# ---------------------------------------------------------------------------
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+
+_NULLS = frozenset(("null", "none", "n/a", ""))
+_HEX_RE = re.compile(r"#([0-9A-Fa-f]{6}|[0-9A-Fa-f]{3})(?![0-9A-Fa-f])|^([0-9A-Fa-f]{6})$")
+
+_TEXT_FIELDS = (
+    "dress_type", "primary_color", "primary_color_hex", "neckline", "sleeves", "embroidery",
+    "border_design", "embellishments", "latkan_tassels", "special_design_features",
+    "dupatta_draping", "dupatta_details",
+)
+_PIECE_FIELDS = (
+    "type", "design_pattern", "material_color_hex", "stones", "pearls", "enamel_meenakari",
+    "dangling_elements", "dimensions", "visual_weight", "description",
+)
+
+
+def normalize_hex(value) -> str | None:
+    """'#d4af37', 'D4AF37', '#fa0 (orange)' -> '#D4AF37' / '#FFAA00'; None if no hex code."""
+    if not isinstance(value, str):
+        return None
+    match = _HEX_RE.search(value.strip())
+    if match is None:
+        return None
+    digits = match.group(1) or match.group(2)
+    if len(digits) == 3:
+        digits = "".join(c * 2 for c in digits)
+    return "#" + digits.upper()
+
+
+def _clean_text(value: str) -> str | None:
+    value = value.strip()
+    # Null markers are at most 4 characters; skip lower() for real text.
+    if len(value) <= 4 and value.lower() in _NULLS:
+        return None
+    return value
+
+
+def _clean_dict(data: dict) -> dict | None:
+    """Strip null-like values (recursively); validate *hex fields."""
+    cleaned = {}
+    for key, value in data.items():
+        if key.endswith("hex"):
+            value = normalize_hex(value)
+        elif type(value) is str:
+            value = _clean_text(value)
+        elif value is not None:
+            value = _clean(value)
+        if value is not None:
+            cleaned[key] = value
+    return cleaned or None
+
+
+def _clean_list(items) -> list | None:
+    cleaned = []
+    for value in items:
+        value = _clean_text(value) if type(value) is str else _clean(value)
+        if value is not None:
+            cleaned.append(value)
+    return cleaned or None
+
+
+def _clean(value):
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return _clean_text(value)
+    if isinstance(value, dict):
+        return _clean_dict(value)
+    if isinstance(value, (list, tuple)):
+        return _clean_list(value)
+    return None if str(value).lower() in _NULLS else value
+
+
+def _join_checklist(value) -> str | None:
+    if isinstance(value, list):
+        return "\n".join(str(v) for v in value)
+    return None if value is None else str(value)
+
+
+@dataclass(slots=True)
+class SecondaryColor:
+    name: str | None = None
+    hex: str | None = None
+    location: str | None = None
+
+
+@dataclass(slots=True)
+class JewelryPiece:
+    type: str | None = None
+    design_pattern: str | None = None
+    material_color_hex: str | None = None
+    stones: str | None = None
+    pearls: str | None = None
+    enamel_meenakari: str | None = None
+    dangling_elements: str | None = None
+    dimensions: str | None = None
+    visual_weight: str | None = None
+    description: str | None = None
+
+
+@dataclass(slots=True)
+class Analysis:
+    """Normalized analysis. `fields` keeps every cleaned top-level field in the
+    model's order (used for JSON responses and the standalone prompt)."""
+
+    fields: dict
+    dress_type: str | None = None
+    primary_color: str | None = None
+    primary_color_hex: str | None = None
+    neckline: str | None = None
+    sleeves: str | None = None
+    embroidery: str | None = None
+    border_design: str | None = None
+    embellishments: str | None = None
+    latkan_tassels: str | None = None
+    special_design_features: str | None = None
+    dupatta_draping: str | None = None
+    dupatta_details: str | None = None
+    secondary_colors: tuple = ()
+    jewelry: tuple = ()
+    jewelry_by_type: dict = field(default_factory=dict)
+    dress_checklist: str | None = None
+    jewelry_checklist: str | None = None
+    _digest: str | None = field(default=None, repr=False, compare=False)
+    _flat: str | None = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Analysis":
+        if not isinstance(data, dict):
+            raise ValueError(f"Analysis must be a JSON object, got {type(data).__name__}")
+        fields = _clean_dict(data) or {}
+        text = {name: fields.get(name) for name in _TEXT_FIELDS}
+        for name, value in text.items():
+            if value is not None and not isinstance(value, str):
+                text[name] = json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else str(value)
+
+        secondary = tuple(
+            SecondaryColor(c.get("name"), c.get("hex"), c.get("location"))
+            for c in fields.get("secondary_colors") or () if isinstance(c, dict)
+        )
+        jewelry = []
+        by_type = {}
+        for piece in fields.get("jewelry_pieces") or ():
+            if not isinstance(piece, dict):
+                continue
+            values = [piece.get(name) for name in _PIECE_FIELDS]
+            jp = JewelryPiece(*[v if v is None or type(v) is str else str(v) for v in values])
+            jewelry.append(jp)
+            if jp.type:
+                by_type.setdefault(jp.type.lower(), jp)
+
+        return cls(
+            fields=fields,
+            secondary_colors=secondary,
+            jewelry=tuple(jewelry),
+            jewelry_by_type=by_type,
+            dress_checklist=_join_checklist(fields.get("dress_reproduction_checklist")),
+            jewelry_checklist=_join_checklist(fields.get("jewelry_reproduction_checklist")),
+            **text,
+        )
+
+    def to_dict(self) -> dict:
+        """The cleaned analysis as plain JSON-able data (shared — do not mutate)."""
+        return self.fields
+
+    @property
+    def digest(self) -> str:
+        """Stable hash of the normalized content, for cache keys."""
+        if self._digest is None:
+            canonical = json.dumps(self.fields, sort_keys=True, ensure_ascii=False, default=str)
+            self._digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+        return self._digest
+
+
+# Fields the generation prompt and checklists depend on.
+KEY_FIELDS = (
+    "dress_type", "primary_color", "primary_color_hex", "neckline", "sleeves", "embroidery",
+    "border_design", "embellishments", "dress_reproduction_checklist", "jewelry_reproduction_checklist",
+)
+KEY_PIECE_FIELDS = ("type", "design_pattern", "material_color_hex", "stones", "dimensions")
+
+
+# Descriptive fields shorter than this many characters are too vague to
+# reproduce from (short answers are fine for e.g. dress_type or neckline).
+DETAIL_MIN_CHARS = {
+    "embroidery": 40, "border_design": 25, "embellishments": 25,
+    "dress_reproduction_checklist": 60, "jewelry_reproduction_checklist": 40,
+    "design_pattern": 15, "stones": 10,
+}
+# Hedges that make a short value useless ("unknown", "not clearly visible").
+_VAGUE_RE = re.compile(
+    r"\b(unknown|unclear|unsure|not (?:clearly |fully )?(?:visible|determinable)|can(?:no|')t (?:be )?"
+    r"(?:seen|determined|tell)|hard to (?:see|tell)|various|some kind|generic|etc)\b",
+    re.IGNORECASE,
+)
+_VAGUE_MAX_CHARS = 60
+
+
+def is_weak(name: str, value) -> bool:
+    """True if `value` is missing, null-like or too vague for field `name`."""
+    if not value:
+        return True
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    if len(text) < DETAIL_MIN_CHARS.get(name, 0):
+        return True
+    return len(text) <= _VAGUE_MAX_CHARS and _VAGUE_RE.search(text) is not None
+
+
+def weak_fields(analysis: Analysis) -> list[str]:
+    """KEY_FIELDS and jewelry KEY_PIECE_FIELDS that are missing or vague, as
+    paths: "embroidery", "jewelry_pieces[necklace].stones" (lower-case type;
+    untyped pieces are skipped). An outfit without jewelry is not a gap."""
+    weak = [name for name in KEY_FIELDS if is_weak(name, analysis.fields.get(name))]
+    for piece_type, piece in analysis.jewelry_by_type.items():
+        weak += [f"jewelry_pieces[{piece_type}].{name}"
+                 for name in KEY_PIECE_FIELDS[1:] if is_weak(name, getattr(piece, name))]
+    return weak
+
+
+def completeness(analysis: Analysis) -> float:
+    """Share of KEY_FIELDS present and specific (see is_weak), with
+    jewelry_pieces counted as one more field scored by the average share of
+    KEY_PIECE_FIELDS per piece."""
+    present = sum(1 for name in KEY_FIELDS if not is_weak(name, analysis.fields.get(name)))
+    if analysis.jewelry:
+        present += sum(
+            sum(1 for name in KEY_PIECE_FIELDS if not is_weak(name, getattr(piece, name))) / len(KEY_PIECE_FIELDS)
+            for piece in analysis.jewelry
+        ) / len(analysis.jewelry)
+    return round(present / (len(KEY_FIELDS) + 1), 3)
+
+
+def as_analysis(details) -> Analysis:
+    """Accept an Analysis or a raw analysis dict."""
+    return details if isinstance(details, Analysis) else Analysis.from_dict(details or {})
@@ -0,0 +1,265 @@
+# ---------------------------------------------------------------------------
+# Analysis Store — every analysis persisted in SQLite, keyed by the SHA-256 of
+# the analyzed image, so an outfit is only paid for once and the catalog can
+# be searched without the model.
+#
+# Searchable columns are normalized at write time and indexed:
+#   dress_kind         lehenga / saree / anarkali / gown / ... (from dress_type)
+#   primary_color_hex  #RRGGBB
+#   fabric_kind        silk / velvet / net / ... (from fabric)
+#   jewelry kinds      necklace / earrings / bangles / ... (analysis_jewelry table)
+# Every extracted hex code is also appended to analysis_colors, which the
+# in-memory color index (color_index.py) tails by id; image_descriptors maps
+# rows of the visual index matrix (visual_index.py) to image hashes.
+# Listing uses keyset pagination on (created_at, image_hash), so deep pages
+# cost the same as the first.
+#
+# ANALYSIS_STORE_PATH  SQLite file (default data/analyses.sqlite3; empty disables)
+# ---------------------------------------------------------------------------
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import logs
+from analysis_model import Analysis, completeness
+from color_index import analysis_colors
+
+ANALYSIS_STORE_PATH = os.getenv("ANALYSIS_STORE_PATH", os.path.join("data", "analyses.sqlite3"))
+
+log = logs.get_logger("store")
+
+# Keyword -> normalized kind; the first keyword found in the text wins, so
+# more specific keywords come first.
+DRESS_KINDS = (
+    ("lehenga", "lehenga"), ("ghagra", "lehenga"), ("saree", "saree"), ("sari", "saree"),
+    ("anarkali", "anarkali"), ("sharara", "sharara"), ("gharara", "gharara"),
+    ("salwar", "salwar kameez"), ("kurta", "kurta"), ("kaftan", "kaftan"), ("gown", "gown"),
+    ("jumpsuit", "jumpsuit"), ("suit", "suit"), ("dress", "dress"),
+)
+FABRIC_KINDS = (
+    ("silk", "silk"), ("velvet", "velvet"), ("georgette", "georgette"),
+    ("chiffon", "chiffon"), ("organza", "organza"), ("tulle", "net"), ("net", "net"),
+    ("brocade", "brocade"), ("banarasi", "brocade"), ("satin", "satin"), ("crepe", "crepe"),
+    ("chanderi", "chanderi"), ("linen", "linen"), ("cotton", "cotton"), ("lace", "lace"),
+)
+JEWELRY_KINDS = (
+    ("maang tikka", "maang tikka"), ("tikka", "maang tikka"), ("matha patti", "maang tikka"),
+    ("nose", "nose ring"), ("nath", "nose ring"), ("necklace", "necklace"), ("choker", "necklace"),
+    ("haar", "necklace"), ("mangalsutra", "necklace"), ("earring", "earrings"), ("jhumka", "earrings"),
+    ("chandbali", "earrings"), ("bangle", "bangles"), ("kada", "bangles"), ("bracelet", "bangles"),
+    ("ring", "ring"), ("anklet", "anklet"), ("payal", "anklet"), ("waist", "waist chain"),
+    ("kamarband", "waist chain"), ("hair", "hair accessory"), ("brooch", "brooch"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    image_hash        TEXT PRIMARY KEY,
+    created_at        REAL NOT NULL,
+    prompt_version    TEXT,
+    dress_type        TEXT,
+    dress_kind        TEXT,
+    primary_color     TEXT,
+    primary_color_hex TEXT,
+    fabric            TEXT,
+    fabric_kind       TEXT,
+    completeness      REAL,
+    analysis_json     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created_at DESC, image_hash DESC);
+CREATE INDEX IF NOT EXISTS analyses_dress ON analyses (dress_kind, created_at DESC);
+CREATE INDEX IF NOT EXISTS analyses_color ON analyses (primary_color_hex, created_at DESC);
+CREATE INDEX IF NOT EXISTS analyses_fabric ON analyses (fabric_kind, created_at DESC);
+CREATE TABLE IF NOT EXISTS analysis_jewelry (
+    kind       TEXT NOT NULL,
+    image_hash TEXT NOT NULL REFERENCES analyses (image_hash) ON DELETE CASCADE,
+    PRIMARY KEY (kind, image_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS analysis_jewelry_hash ON analysis_jewelry (image_hash);
+CREATE TABLE IF NOT EXISTS analysis_colors (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_hash TEXT NOT NULL REFERENCES analyses (image_hash) ON DELETE CASCADE,
+    role       TEXT NOT NULL,
+    hex        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysis_colors_hash ON analysis_colors (image_hash);
+CREATE TABLE IF NOT EXISTS image_descriptors (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_hash TEXT NOT NULL UNIQUE
+);
+"""
+
+_LIST_COLUMNS = ("image_hash", "created_at", "dress_type", "dress_kind", "primary_color",
+                 "primary_color_hex", "fabric", "fabric_kind", "completeness", "prompt_version")
+
+
+def image_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def kind_of(text, kinds: tuple) -> str | None:
+    """First normalized kind whose keyword appears in `text`."""
+    if not isinstance(text, str):
+        return None
+    text = text.lower()
+    for keyword, kind in kinds:
+        if keyword in text:
+            return kind
+    return None
+
+
+def jewelry_kinds(analysis: Analysis) -> set[str]:
+    return {kind for kind in (kind_of(piece.type, JEWELRY_KINDS) for piece in analysis.jewelry) if kind}
+
+
+def _encode_cursor(created_at: float, key: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, key]).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        created_at, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(created_at), str(key)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class AnalysisStore:
+    """SQLite-backed analysis store; one connection per thread (WAL mode)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> dict | None:
+        """Stored analysis JSON for an image hash, or None."""
+        row = self._connect().execute(
+            "SELECT analysis_json FROM analyses WHERE image_hash = ?", (key,)).fetchone()
+        return json.loads(row["analysis_json"]) if row else None
+
+    def put(self, key: str, analysis: Analysis, prompt_version: str = None):
+        """Insert or replace the analysis for an image hash."""
+        fields = analysis.fields
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (image_hash, created_at, prompt_version, dress_type, dress_kind,"
+                " primary_color, primary_color_hex, fabric, fabric_kind, completeness, analysis_json)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, time.time(), prompt_version, analysis.dress_type, kind_of(analysis.dress_type, DRESS_KINDS),
+                 analysis.primary_color, analysis.primary_color_hex, _text(fields.get("fabric")),
+                 kind_of(_text(fields.get("fabric")), FABRIC_KINDS), completeness(analysis),
+                 json.dumps(fields, ensure_ascii=False)),
+            )
+            conn.execute("DELETE FROM analysis_jewelry WHERE image_hash = ?", (key,))
+            conn.executemany("INSERT INTO analysis_jewelry (kind, image_hash) VALUES (?, ?)",
+                             [(kind, key) for kind in sorted(jewelry_kinds(analysis))])
+            conn.execute("DELETE FROM analysis_colors WHERE image_hash = ?", (key,))
+            conn.executemany("INSERT INTO analysis_colors (image_hash, role, hex) VALUES (?, ?, ?)",
+                             [(key, role, hex_code) for role, hex_code in analysis_colors(analysis)])
+
+    def query(self, dress_kind: str = None, color_hex: str = None, fabric_kind: str = None,
+              jewelry: list = None, limit: int = 50, cursor: str = None) -> tuple[list[dict], str | None]:
+        """Newest-first page of summaries matching every given filter.
+        Returns (items, next_cursor); next_cursor is None on the last page."""
+        where, params = [], []
+        if dress_kind:
+            where.append("a.dress_kind = ?")
+            params.append(dress_kind)
+        if color_hex:
+            where.append("a.primary_color_hex = ?")
+            params.append(color_hex)
+        if fabric_kind:
+            where.append("a.fabric_kind = ?")
+            params.append(fabric_kind)
+        for kind in jewelry or ():
+            where.append("EXISTS (SELECT 1 FROM analysis_jewelry j WHERE j.kind = ? AND j.image_hash = a.image_hash)")
+            params.append(kind)
+        if cursor:
+            created_at, key = _decode_cursor(cursor)
+            where.append("(a.created_at < ? OR (a.created_at = ? AND a.image_hash < ?))")
+            params += [created_at, created_at, key]
+        sql = (f"SELECT {', '.join('a.' + c for c in _LIST_COLUMNS)},"
+               " (SELECT group_concat(kind) FROM analysis_jewelry j WHERE j.image_hash = a.image_hash) AS jewelry"
+               " FROM analyses a"
+               + (" WHERE " + " AND ".join(where) if where else "")
+               + " ORDER BY a.created_at DESC, a.image_hash DESC LIMIT ?")
+        rows = self._connect().execute(sql, params + [limit + 1]).fetchall()
+        items = []
+        for row in rows[:limit]:
+            item = {c: row[c] for c in _LIST_COLUMNS}
+            item["jewelry_kinds"] = sorted(row["jewelry"].split(",")) if row["jewelry"] else []
+            items.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = _encode_cursor(last["created_at"], last["image_hash"])
+        return items, next_cursor
+
+    def summaries(self, keys: list) -> dict:
+        """image_hash -> listing summary for the given hashes."""
+        if not keys:
+            return {}
+        rows = self._connect().execute(
+            f"SELECT {', '.join(_LIST_COLUMNS)} FROM analyses WHERE image_hash IN ({', '.join('?' * len(keys))})",
+            list(keys)).fetchall()
+        return {row["image_hash"]: {c: row[c] for c in _LIST_COLUMNS} for row in rows}
+
+    def colors_since(self, last_id: int) -> list[tuple]:
+        """(id, image_hash, role, hex) rows with id > last_id, oldest first."""
+        return self._connect().execute(
+            "SELECT id, image_hash, role, hex FROM analysis_colors WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+
+    def descriptor_row(self, key: str) -> int:
+        """Visual-index matrix row of an image hash, allocated on first use."""
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO image_descriptors (image_hash) VALUES (?)", (key,))
+            return conn.execute("SELECT id FROM image_descriptors WHERE image_hash = ?", (key,)).fetchone()[0] - 1
+
+    def descriptors_since(self, last_id: int) -> list[tuple]:
+        """(id, image_hash) rows with id > last_id, oldest first."""
+        return self._connect().execute(
+            "SELECT id, image_hash FROM image_descriptors WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT count(*) FROM analyses").fetchone()[0]
+
+
+def _text(value) -> str | None:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> AnalysisStore | None:
+    """The process-wide store, or None when ANALYSIS_STORE_PATH is empty."""
+    global _store
+    if not ANALYSIS_STORE_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AnalysisStore(ANALYSIS_STORE_PATH)
+                log.info("Analysis store at %s (%d analyses)", ANALYSIS_STORE_PATH, _store.count())
+    return _store
@@ -1,45 +1,121 @@
 import os
 import json
 import base64
+import hashlib
 import io
 import re
-import traceback
+import threading
+import uuid
 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-from google import genai
-from google.genai import types
-from PIL import Image
+import gemini_replay
+import logs
+import metrics
+import profiling
+import shared_cache
+import prompt_budget
+import prompt_templates
+import usage
+import analysis_followup
+import analysis_store
+import best_of
+import refinement
+import color_index
+import content_store
+import jobs
+import multi_view
+import tiling
+import visual_index
+from analysis_model import Analysis, as_analysis, completeness, normalize_hex
+from lazy_imports import LazyModule
+from metrics import stage_timer
+from deadline import (
+    Deadline,
+    DeadlineExceeded,
+    RequestCancelled,
+    REQUEST_BUDGET_SECONDS,
+    CANCEL_STATS,
+    cancel_request,
+)
 from prompts import (
-    VISION_PROMPT,
     REFINEMENT_PROMPT,
-    VERIFICATION_PROMPT,
     GENERATION_SYSTEM_INSTRUCTION,
-    VISION_EXTRACT_PROMPT,
+    get_prompt,
+    reset_variant,
+    use_variant,
 )
 
+# google.genai takes ~0.5s to import — load it on first use (or in the
+# warm-up thread below) instead of before gunicorn can accept traffic.
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+
 load_dotenv()
 
+init_log = logs.get_logger("init")
+vision_log = logs.get_logger("vision")
+gen_log = logs.get_logger("gen")
+verify_log = logs.get_logger("verify")
+refine_log = logs.get_logger("refine")
+pipeline_log = logs.get_logger("pipeline")
+direct_log = logs.get_logger("direct")
+standalone_log = logs.get_logger("standalone")
+api_log = logs.get_logger("api")
+
 app = Flask(__name__)
 CORS(app)
 
-# --- Safe Gemini client initialization ---
+# --- Safe, deferred Gemini client initialization ---
 _api_key = os.getenv("GEMINI_API_KEY")
+# live | record | replay — see gemini_replay.py. Replay needs no API key.
+_backend = gemini_replay.GEMINI_BACKEND
+_client_configured = bool(_api_key) or _backend == "replay"
+# Alternate API endpoint, e.g. the fake server used by benchmarks/load_test.py.
+_base_url = os.getenv("GEMINI_BASE_URL")
 client = None
-if _api_key:
-    try:
-        client = genai.Client(api_key=_api_key)
-        print(f"[INIT] Gemini client initialized successfully.")
-    except Exception as e:
-        print(f"[INIT] WARNING: Failed to initialize Gemini client: {e}")
-else:
-    print("[INIT] WARNING: GEMINI_API_KEY not set. API routes will not work.")
+_client_lock = threading.Lock()
+_client_error = None
+
+
+def get_client():
+    """Return the Gemini client, building it on first use. None if unavailable."""
+    global client, _client_error
+    if client is None and _client_configured and _client_error is None:
+        with _client_lock:
+            if client is None and _client_error is None:
+                try:
+                    if _backend == "replay":
+                        client = gemini_replay.ReplayClient()
+                    else:
+                        http_options = types.HttpOptions(base_url=_base_url) if _base_url else None
+                        client = genai.Client(api_key=_api_key, http_options=http_options)
+                        if _backend == "record":
+                            client = gemini_replay.RecordingClient(client)
+                    init_log.info("Gemini client initialized successfully (%s backend).", _backend,
+                                  extra={"backend": _backend})
+                except Exception as e:
+                    _client_error = str(e)
+                    init_log.warning("Failed to initialize Gemini client: %s", e)
+    return client
+
+
+def _warm_up():
+    """Import the heavy modules and build the client off the request path."""
+    types.load()
+    get_client()
+
+
+if not _client_configured:
+    init_log.warning("GEMINI_API_KEY not set. API routes will not work.")
+elif os.getenv("CLIENT_WARMUP", "1") == "1":
+    threading.Thread(target=_warm_up, name="gemini-warmup", daemon=True).start()
 
 # ---------------------------------------------------------------------------
 # Agentic Vision Module — Extracts structured details from an image
 # ---------------------------------------------------------------------------
-# VISION_PROMPT — imported from prompts.py
+# VISION_PROMPT — prompts.get_prompt("analysis")
 
 
 
@@ -56,32 +132,61 @@ def _parse_json_response(raw_text: str) -> dict:
 
 
 
-def _deep_merge(base: dict, updates: dict) -> dict:
-    """Deep merge updates into base. For jewelry_pieces, append new entries."""
+def _is_empty(val) -> bool:
+    return val is None or (isinstance(val, str) and val.lower() in ("null", "none", ""))
+
+
+def _deep_merge(base: dict, updates: dict, replace: frozenset = frozenset()) -> dict:
+    """Deep merge updates into base (neither is modified). For jewelry_pieces,
+    append new entries and enrich existing ones matched by type.
+
+    Strings and lists keep the longer value, except for fields listed in
+    `replace` (paths as in analysis_model.weak_fields, e.g. "embroidery" or
+    "jewelry_pieces[necklace].stones"), whose update always wins. Existing
+    pieces are indexed by type once, so merging is linear in the piece count.
+    """
     merged = dict(base)
     for key, val in updates.items():
-        if val is None or (isinstance(val, str) and val.lower() in ("null", "none", "")):
+        if _is_empty(val):
             continue  # Skip empty updates
-        if key == "jewelry_pieces" and isinstance(val, list) and isinstance(merged.get(key), list):
+        if key in replace:
+            merged[key] = val
+        elif key == "jewelry_pieces" and isinstance(val, list) and isinstance(merged.get(key), list):
             # Merge jewelry: add new pieces, update existing by type
-            existing_types = {p.get("type", "").lower() for p in merged[key] if isinstance(p, dict)}
+            pieces = list(merged[key])
+            # Pieces at these indices are this merge's own copies; the others
+            # still belong to `base` and are copied on their first change.
+            owned = set()
+            by_type = {}
+            for i, existing in enumerate(pieces):
+                if isinstance(existing, dict):
+                    by_type.setdefault(str(existing.get("type", "")).lower(), i)
             for piece in val:
-                if isinstance(piece, dict):
-                    ptype = piece.get("type", "").lower()
-                    if ptype and ptype not in existing_types:
-                        merged[key].append(piece)
-                        existing_types.add(ptype)
-                    elif ptype:
-                        # Update existing piece with richer details
-                        for i, existing in enumerate(merged[key]):
-                            if isinstance(existing, dict) and existing.get("type", "").lower() == ptype:
-                                for pk, pv in piece.items():
-                                    if pv and str(pv).lower() not in ("null", "none", ""):
-                                        existing_len = len(str(existing.get(pk, "")))
-                                        update_len = len(str(pv))
-                                        if update_len > existing_len:
-                                            existing[pk] = pv
-                                break
+                if not isinstance(piece, dict):
+                    continue
+                ptype = str(piece.get("type", "")).lower()
+                if not ptype:
+                    continue
+                i = by_type.get(ptype)
+                if i is None:
+                    # A copy, so enriching it from a later piece of the same
+                    # type leaves the caller's update alone.
+                    owned.add(len(pieces))
+                    by_type[ptype] = len(pieces)
+                    pieces.append(dict(piece))
+                    continue
+                # Update existing piece with richer details (copied on first change)
+                existing = pieces[i]
+                for pk, pv in piece.items():
+                    if not pv or _is_empty(str(pv)):
+                        continue
+                    if (f"jewelry_pieces[{ptype}].{pk}" in replace
+                            or len(str(pv)) > len(str(existing.get(pk, "")))):
+                        if i not in owned:
+                            owned.add(i)
+                            existing = pieces[i] = dict(existing)
+                        existing[pk] = pv
+            merged[key] = pieces
         elif isinstance(val, str) and isinstance(merged.get(key), str):
             # Keep the longer/more detailed string
             if len(val) > len(merged.get(key, "")):
@@ -101,28 +206,91 @@ def _deep_merge(base: dict, updates: dict) -> dict:
     return merged
 
 
-def analyze_image(image_bytes: bytes, mime_type: str) -> dict:
+def _image_cache_key(image_bytes: bytes, prompt) -> str:
+    """Shared-cache key for a model result on an image: prompt version + image hash."""
+    return f"{prompt.version}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+def analyze_image(image_bytes: bytes, mime_type: str, deadline: Deadline = None,
+                  use_cache: bool = True) -> dict:
     """Single-pass comprehensive analysis for fast response (Render-compatible).
     
     Uses one detailed Gemini call to extract all dress & jewelry details.
-    Optimized to complete within Render's 30-second request timeout.
+    Optimized to complete within Render's 30-second request timeout; the
+    HTTP timeout of the call is capped at whatever is left of `deadline`.
+    Results are shared across workers through the shared cache (keyed by
+    image and prompt version) unless `use_cache` is False.
     """
-    image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
-
-    # ─── Single comprehensive pass ───
-    print("[VISION] Analyzing image (single comprehensive pass)...")
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[image_part, VISION_PROMPT],
-        config=types.GenerateContentConfig(
-            temperature=0.2,
-        ),
-    )
-    result = _parse_json_response(response.text)
-    print(f"[VISION] ✅ Analysis complete. Got {len(result)} fields.")
+    deadline = deadline or Deadline()
+    deadline.check("analysis")
+    prompt = get_prompt("analysis")
+
+    def _analyze():
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        # ─── Single comprehensive pass ───
+        vision_log.info("Analyzing image (single comprehensive pass)...", extra={"prompt": prompt.version})
+        with stage_timer("analysis", model="gemini-3-flash-preview"):
+            response = deadline.run(
+                "analysis", get_client().models.generate_content,
+                prompt_name=prompt.name,
+                model="gemini-3-flash-preview",
+                contents=[image_part, prompt.text],
+                config=types.GenerateContentConfig(
+                    temperature=0.2,
+                    http_options=deadline.http_options(),
+                ),
+            )
+            return _parse_json_response(response.text)
+
+    if use_cache:
+        result = shared_cache.get_or_compute("analysis", _image_cache_key(image_bytes, prompt), _analyze,
+                                             wait_timeout=deadline.remaining(),
+                                             cancelled=lambda: deadline.cancelled)
+    else:
+        result = _analyze()
+    vision_log.info("Analysis complete. Got %d fields.", len(result), extra={"fields": len(result)})
     return result
 
 
+def _followup_asker(image_bytes: bytes, mime_type: str):
+    """ask(prompt_text, deadline) for analysis_followup: one short analysis call."""
+    def ask(text: str, deadline: Deadline) -> dict:
+        prompt = get_prompt("followup")
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        with stage_timer("analysis_followup", model="gemini-3-flash-preview"):
+            response = deadline.run(
+                "analysis_followup", get_client().models.generate_content,
+                prompt_name=prompt.name,
+                model="gemini-3-flash-preview",
+                contents=[image_part, text],
+                config=types.GenerateContentConfig(
+                    temperature=0.2,
+                    http_options=deadline.http_options(),
+                ),
+            )
+        return _parse_json_response(response.text)
+
+    return ask
+
+
+def _analyze_tile(tile_bytes: bytes, deadline: Deadline) -> dict:
+    """Detail analysis of one full-resolution crop (tiling.analyze)."""
+    prompt = get_prompt("tile")
+    image_part = types.Part.from_bytes(data=tile_bytes, mime_type="image/jpeg")
+    with stage_timer("analysis_tile", model="gemini-3-flash-preview"):
+        response = deadline.run(
+            "analysis_tile", get_client().models.generate_content,
+            prompt_name=prompt.name,
+            model="gemini-3-flash-preview",
+            contents=[image_part, prompt.text],
+            config=types.GenerateContentConfig(
+                temperature=0.2,
+                http_options=deadline.http_options(),
+            ),
+        )
+    return _parse_json_response(response.text)
+
+
 
 # ---------------------------------------------------------------------------
 # Detail Mapping Layer — Converts structured JSON into a CONCISE visual prompt
@@ -130,125 +298,132 @@ def analyze_image(image_bytes: bytes, mime_type: str) -> dict:
 
 
 
-def build_generation_prompt(details: dict, user_instructions: str = "") -> str:
+def build_generation_prompt(details: "Analysis | dict", user_instructions: str = "") -> str:
     """Build a comprehensive generation prompt using BOTH source image AND JSON analysis.
     
     The SOURCE IMAGE is the visual truth, but the JSON analysis provides
     precise text details (colors, embroidery zones, jewelry stone colors)
     that help the model reproduce exact details it might otherwise miss.
+
+    Memoized per (analysis digest, user instructions) — see prompt_templates.
     """
-    dress = details.get("dress_type") or "clothing"
-    primary = details.get("primary_color") or "as shown in IMAGE 1"
-    
-    # ─── Build DRESS DETAILS block from JSON ───
-    dress_lines = []
-    
-    # Core dress identity
-    neckline = details.get("neckline", "")
-    if neckline and str(neckline).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Neckline: {neckline}")
-    
-    sleeves = details.get("sleeves", "")
-    if sleeves and str(sleeves).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Sleeves: {sleeves}")
-    
-    embroidery = details.get("embroidery", "")
-    if embroidery and str(embroidery).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Embroidery: {embroidery}")
-    
-    border_design = details.get("border_design", "")
-    if border_design and str(border_design).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Borders: {border_design}")
-    
-    embellishments = details.get("embellishments", "")
-    if embellishments and str(embellishments).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Embellishments: {embellishments}")
-    
-    latkan = details.get("latkan_tassels", "")
-    if latkan and str(latkan).lower() not in ('null', 'none', 'none'):
-        dress_lines.append(f"• Latkans/Tassels: {latkan}")
+    analysis = as_analysis(details)
+    instructions = (user_instructions or "").strip()
+    return prompt_templates.memo.get_or_render(
+        prompt_templates.GENERATION, (analysis.digest, instructions),
+        lambda: _render_generation_prompt(analysis, instructions),
+    )
+
+
+def budgeted_generation_prompt(details: "Analysis | dict", user_instructions: str = "",
+                               budget: int = None, deadline: Deadline = None) -> tuple[str, dict]:
+    """build_generation_prompt compacted to an input-token budget (default: the
+    current endpoint's, see prompt_budget). Returns (prompt, budget report).
+    With PROMPT_TOKEN_COUNTER=api the count_tokens calls run under `deadline`."""
+    analysis = as_analysis(details)
+    instructions = (user_instructions or "").strip()
+    route = metrics.route_label()
+    if budget is None:
+        budget = prompt_budget.budget_for(route)
+    if not budget:
+        prompt = build_generation_prompt(analysis, instructions)
+        return prompt, prompt_budget.measure(prompt, 0)
+    prompt, report = prompt_templates.memo.get_or_render(
+        prompt_templates.GENERATION, (analysis.digest, instructions, "budget", budget),
+        lambda: prompt_budget.fit(
+            analysis, lambda a, compact_rules: _render_generation_prompt(a, instructions, compact_rules),
+            budget, count=lambda text: _count_prompt_tokens(text, deadline),
+        ),
+    )
+    prompt_budget.count_compaction(report, route)
+    return prompt, report
+
+
+def _count_prompt_tokens(text: str, deadline: Deadline = None) -> int:
+    """Input tokens of a text prompt: count_tokens with PROMPT_TOKEN_COUNTER=api,
+    else the local estimate (also when the call fails or there is no time)."""
+    client = get_client() if prompt_budget.PROMPT_TOKEN_COUNTER == "api" else None
+    if client is not None:
+        deadline = deadline or Deadline()
+        try:
+            return deadline.run(
+                "prompt_count", client.models.count_tokens,
+                model=GENERATION_MODELS[0],
+                contents=text,
+                config=types.CountTokensConfig(http_options=deadline.http_options()),
+            ).total_tokens
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            gen_log.warning("count_tokens failed, using the local estimate: %s", e)
+    return prompt_budget.estimate_tokens(text)
+
+
+def _render_generation_prompt(analysis: Analysis, instructions: str, compact_rules: bool = False) -> str:
+    dress = analysis.dress_type or "clothing"
+    primary = analysis.primary_color or "as shown in IMAGE 1"
     
-    special = details.get("special_design_features", "")
-    if special and str(special).lower() not in ('null', 'none', ''):
-        dress_lines.append(f"• Special Features: {special}")
+    # ─── Build DRESS DETAILS block from the normalized analysis ───
+    dress_lines = [
+        f"• {label}: {value}"
+        for label, value in (
+            ("Neckline", analysis.neckline),
+            ("Sleeves", analysis.sleeves),
+            ("Embroidery", analysis.embroidery),
+            ("Borders", analysis.border_design),
+            ("Embellishments", analysis.embellishments),
+            ("Latkans/Tassels", analysis.latkan_tassels),
+            ("Special Features", analysis.special_design_features),
+        )
+        if value
+    ]
     
     # Secondary colors
-    secondary = details.get("secondary_colors", [])
-    if isinstance(secondary, list) and secondary:
-        sec_str = ", ".join([f"{c.get('name','')} ({c.get('hex','')}) on {c.get('location','')}" for c in secondary if isinstance(c, dict)])
-        if sec_str:
-            dress_lines.append(f"• Colors: Primary={primary}, Secondary={sec_str}")
+    if analysis.secondary_colors:
+        sec_str = ", ".join(f"{c.name or ''} ({c.hex or ''}) on {c.location or ''}" for c in analysis.secondary_colors)
+        dress_lines.append(f"• Colors: Primary={primary}, Secondary={sec_str}")
     
-    dress_details_block = ""
-    if dress_lines:
-        dress_details_block = "\n".join(dress_lines)
+    dress_details_block = "\n".join(dress_lines)
     
     # Reproduction checklists
-    dress_checklist = details.get("dress_reproduction_checklist", "")
-    if isinstance(dress_checklist, list):
-        dress_checklist = "\n".join(dress_checklist)
+    dress_checklist = analysis.dress_checklist or ""
+    jewelry_checklist = analysis.jewelry_checklist or ""
     
-    jewelry_checklist = details.get("jewelry_reproduction_checklist", "")
-    if isinstance(jewelry_checklist, list):
-        jewelry_checklist = "\n".join(jewelry_checklist)
-    
-    # ─── Extract EXPLICIT jewelry details from JSON ───
+    # ─── Extract EXPLICIT jewelry details ───
     jewelry_color_lines = []
-    jewelry_pieces = details.get("jewelry_pieces", [])
-    if isinstance(jewelry_pieces, list):
-        for piece in jewelry_pieces:
-            if not isinstance(piece, dict):
-                continue
-            ptype = piece.get("type", "jewelry piece")
-            design_pattern = piece.get("design_pattern", "")
-            metal_hex = piece.get("material_color_hex", "")
-            stones = piece.get("stones", "")
-            pearls = piece.get("pearls", "")
-            enamel = piece.get("enamel_meenakari", "")
-            dangles = piece.get("dangling_elements", "")
-            dimensions = piece.get("dimensions", "")
-            visual_weight = piece.get("visual_weight", "")
-            desc = piece.get("description", "")
-            
-            color_parts = [f"  • {ptype}:"]
-            if design_pattern and str(design_pattern).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Design: {design_pattern}")
-            if metal_hex:
-                color_parts.append(f"    Metal: {metal_hex}")
-            if stones and str(stones).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Stones: {stones}")
-            if pearls and str(pearls).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Pearls: {pearls}")
-            if enamel and str(enamel).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Enamel: {enamel}")
-            if dangles and str(dangles).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Drops/Dangles: {dangles}")
-            if dimensions and str(dimensions).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    SIZE/Dimensions: {dimensions} ← MATCH THIS EXACT SIZE!")
-            if visual_weight and str(visual_weight).lower() not in ('null', 'none', ''):
-                color_parts.append(f"    Visual Weight: {visual_weight}")
-            if desc and str(desc).lower() not in ('null', 'none', '') and len(color_parts) <= 3:
-                color_parts.append(f"    Full: {desc}")
-            
-            if len(color_parts) > 1:
-                jewelry_color_lines.append("\n".join(color_parts))
+    for piece in analysis.jewelry:
+        color_parts = [f"  • {piece.type or 'jewelry piece'}:"]
+        if piece.design_pattern:
+            color_parts.append(f"    Design: {piece.design_pattern}")
+        if piece.material_color_hex:
+            color_parts.append(f"    Metal: {piece.material_color_hex}")
+        if piece.stones:
+            color_parts.append(f"    Stones: {piece.stones}")
+        if piece.pearls:
+            color_parts.append(f"    Pearls: {piece.pearls}")
+        if piece.enamel_meenakari:
+            color_parts.append(f"    Enamel: {piece.enamel_meenakari}")
+        if piece.dangling_elements:
+            color_parts.append(f"    Drops/Dangles: {piece.dangling_elements}")
+        if piece.dimensions:
+            color_parts.append(f"    SIZE/Dimensions: {piece.dimensions}"
+                               + ("" if compact_rules else " ← MATCH THIS EXACT SIZE!"))
+        if piece.visual_weight:
+            color_parts.append(f"    Visual Weight: {piece.visual_weight}")
+        if piece.description and len(color_parts) <= 3:
+            color_parts.append(f"    Full: {piece.description}")
+        
+        if len(color_parts) > 1:
+            jewelry_color_lines.append("\n".join(color_parts))
     
     jewelry_details_block = ""
     if jewelry_color_lines:
-        jewelry_details_block = (
-            "\n\n═══ EXACT JEWELRY — PIECE BY PIECE (MUST MATCH IMAGE 1) ═══\n"
-            + "\n".join(jewelry_color_lines)
-            + "\n🚨 These are analyzed from the ACTUAL source image. Reproduce EACH piece "
-            "with these EXACT designs, colors, stone types. Do NOT default to white/clear."
-            "\n⚠️ JEWELRY SIZE RULE: Every jewelry piece MUST be the EXACT SAME SIZE as in IMAGE 1. "
-            "Do NOT make jewelry smaller or larger. If the necklace is big and heavy in IMAGE 1, "
-            "it must be big and heavy in the output. If earrings are long chandeliers, output "
-            "long chandeliers — NOT small studs. MATCH THE SCALE EXACTLY."
-        )
+        template = prompt_templates.GENERATION_JEWELRY_COMPACT if compact_rules else prompt_templates.GENERATION_JEWELRY
+        jewelry_details_block = template.render(pieces="\n".join(jewelry_color_lines))
     
     # Dupatta details
-    dupatta_draping = details.get("dupatta_draping") or ""
-    dupatta_details = details.get("dupatta_details") or ""
+    dupatta_draping = analysis.dupatta_draping or ""
+    dupatta_details = analysis.dupatta_details or ""
     dupatta_block = ""
     if dupatta_draping or dupatta_details:
         dupatta_block = "\n\n═══ DUPATTA/SCARF ═══"
@@ -257,56 +432,18 @@ def build_generation_prompt(details: dict, user_instructions: str = "") -> str:
         if dupatta_details:
             dupatta_block += f"\nDetails: {dupatta_details}"
     
-    # User instructions block
-    user_block = ""
-    if user_instructions and user_instructions.strip():
-        user_block = f"""
-
-═══ USER'S CUSTOM INSTRUCTIONS (HIGH PRIORITY) ═══
-{user_instructions.strip()}"""
-    
-    prompt = f"""YOU MUST COPY THE EXACT OUTFIT FROM IMAGE 1 ONTO THE PERSON IN IMAGE 2.
-Use BOTH the source image AND the text details below to achieve 100% accuracy.
-
-═══ #1 RULE: IMAGE 1 + TEXT DETAILS = YOUR REFERENCE ═══
-ZOOM INTO IMAGE 1 and CROSS-CHECK with the text details below:
-• Every color, pattern, embroidery must EXACTLY match IMAGE 1
-• Every jewelry piece must match IMAGE 1 — correct stones, correct colors, correct design
-• If the text says GREEN stones → verify in IMAGE 1 → output GREEN stones
-• If IMAGE 1 shows dense embroidery → output must show SAME density. Do NOT simplify!
-{user_block}
-
-═══ DRESS DETAILS (verified from source image) ═══
-Outfit: {dress}
-Primary Color: {primary}
-{dress_details_block if dress_details_block else "See IMAGE 1 for all dress details."}
-
-═══ DRESS REPRODUCTION CHECKLIST (MUST get EVERY item right) ═══
-{dress_checklist if dress_checklist else "Copy ALL dress details exactly from IMAGE 1."}
-{jewelry_details_block}
-
-═══ JEWELRY REPRODUCTION CHECKLIST ═══
-{jewelry_checklist if jewelry_checklist else "Copy ALL jewelry exactly from IMAGE 1."}
-{dupatta_block}
-
-═══ ABSOLUTE RULES — NEVER VIOLATE ═══
-1. FACE/BODY/HAIR/SKIN from IMAGE 2 → 100% UNCHANGED — do NOT alter the person
-2. CLOTHES + JEWELRY from IMAGE 1 → 100% COPIED — every detail, every color, every stone
-3. Background from IMAGE 2 (unless user says otherwise)
-4. Dress must look naturally worn — proper fit, realistic draping, natural shadows
-5. Output SINGLE photorealistic image — NEVER a collage, NEVER two people, NEVER side-by-side
-6. EMBROIDERY: Match the EXACT density and pattern from IMAGE 1. Do NOT simplify to plain fabric
-7. JEWELRY STONES: Match EXACT colors — Green=green, Red=red, Blue=blue. NEVER default to white
-8. JEWELRY SIZE: Each jewelry piece MUST be the EXACT SAME SIZE/SCALE as in IMAGE 1.
-   Big necklace → big necklace. Long earrings → long earrings. Heavy bangles → heavy bangles.
-   Do NOT shrink, enlarge, or simplify ANY jewelry piece. Match proportions EXACTLY.
-9. BORDERS/TRIM: Match EXACT width, design, and colors from IMAGE 1
-10. Every detail matters — tassels, latkans, scalloped edges, piping, dupatta borders — ALL must match
-{"10. FOLLOW USER INSTRUCTIONS: " + user_instructions.strip() if user_instructions and user_instructions.strip() else ""}"""
-
-
-
-    return prompt
+    return prompt_templates.GENERATION.render(
+        user_block=f"\n\n═══ USER'S CUSTOM INSTRUCTIONS (HIGH PRIORITY) ═══\n{instructions}" if instructions else "",
+        dress=dress,
+        primary=primary,
+        dress_details=dress_details_block or "See IMAGE 1 for all dress details.",
+        dress_checklist=dress_checklist or "Copy ALL dress details exactly from IMAGE 1.",
+        jewelry_details=jewelry_details_block,
+        jewelry_checklist=jewelry_checklist or "Copy ALL jewelry exactly from IMAGE 1.",
+        dupatta_block=dupatta_block,
+        user_rule=("" if not instructions else "10. FOLLOW THE USER'S CUSTOM INSTRUCTIONS ABOVE" if compact_rules
+                   else f"10. FOLLOW USER INSTRUCTIONS: {instructions}"),
+    )
 
 
 
@@ -327,13 +464,24 @@ GENERATION_MODELS = [
     "gemini-2.5-flash-image",
 ]
 
-def _call_generation_model(source_part, target_part, prompt: str):
-    """Call the generation model — source outfit shown FIRST for maximum visual attention."""
-    for model_name in GENERATION_MODELS:
+def _call_generation_model(source_part, target_part, prompt: str, deadline: Deadline = None,
+                           prompt_name: str = "generation", model: str = None, temperature: float = None):
+    """Call the generation model — source outfit shown FIRST for maximum visual attention.
+
+    `model` / `temperature` override GENERATION_MODELS and the default 0.1
+    (best-of-N candidates). Raises DeadlineExceeded if there is no time left
+    to start (another) attempt.
+    """
+    deadline = deadline or Deadline()
+    for model_name in ([model] if model else GENERATION_MODELS):
         for attempt in range(3):
+            deadline.check("generation")
             try:
-                print(f"[GEN] Trying {model_name} (attempt {attempt+1}/3)...")
-                resp = client.models.generate_content(
+                gen_log.info("Trying %s (attempt %d/3)...", model_name, attempt + 1,
+                             extra={"model": model_name, "attempt": attempt + 1})
+                resp = deadline.run(
+                    "generation", get_client().models.generate_content,
+                    prompt_name=prompt_name,
                     model=model_name,
                     contents=[
                         "🔴 IMAGE 1 — SOURCE OUTFIT (COPY THIS EXACTLY onto the person below):",
@@ -345,21 +493,27 @@ def _call_generation_model(source_part, target_part, prompt: str):
                     config=types.GenerateContentConfig(
                         response_modalities=["Text", "Image"],
                         system_instruction=GENERATION_SYSTEM_INSTRUCTION,
-                        temperature=0.1,
+                        temperature=0.1 if temperature is None else temperature,
+                        http_options=deadline.http_options(),
                     ),
                 )
-                print(f"[GEN] Success with {model_name}!")
+                gen_log.info("Success with %s", model_name, extra={"model": model_name})
                 return resp
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 err_str = str(e)
                 if "503" in err_str or "UNAVAILABLE" in err_str:
                     wait = 10 * (attempt + 1)
-                    print(f"[GEN] 503 overloaded — waiting {wait}s before retry...")
-                    _time.sleep(wait)
+                    deadline.check_retry("generation", wait)
+                    gen_log.warning("503 overloaded — waiting %ss before retry...", wait,
+                                    extra={"model": model_name, "wait_s": wait})
+                    deadline.sleep(wait)
                 else:
-                    print(f"[GEN] Non-retryable error on {model_name}: {e}")
+                    gen_log.error("Non-retryable error on %s: %s", model_name, e, extra={"model": model_name})
                     break  # try next model
-        print(f"[GEN] All attempts failed for {model_name}, trying next model...")
+        gen_log.warning("All attempts failed for %s, trying next model...", model_name,
+                        extra={"model": model_name})
     
     raise Exception("All generation models failed. Please try again later.")
 
@@ -368,23 +522,26 @@ def _extract_response_parts(response) -> tuple[str | None, bytes | None]:
     """Extract text and image from model response."""
     text_result = None
     image_result = None
-    try:
-        # Try candidates first (some models use this structure)
-        parts = None
-        if hasattr(response, 'candidates') and response.candidates:
-            parts = response.candidates[0].content.parts
-        elif hasattr(response, 'parts') and response.parts:
-            parts = response.parts
+    with stage_timer("response_parse") as timer:
+        try:
+            # Try candidates first (some models use this structure)
+            parts = None
+            if hasattr(response, 'candidates') and response.candidates:
+                parts = response.candidates[0].content.parts
+            elif hasattr(response, 'parts') and response.parts:
+                parts = response.parts
         
-        if parts:
-            for part in parts:
-                if hasattr(part, 'text') and part.text is not None:
-                    text_result = part.text
-                elif hasattr(part, 'inline_data') and part.inline_data is not None:
-                    image_result = part.inline_data.data
-    except Exception as e:
-        print(f"[ERROR] Failed to extract response parts: {e}")
-        traceback.print_exc()
+            if parts:
+                for part in parts:
+                    if hasattr(part, 'text') and part.text is not None:
+                        text_result = part.text
+                    elif hasattr(part, 'inline_data') and part.inline_data is not None:
+                        image_result = part.inline_data.data
+        except Exception as e:
+            timer.outcome = "error"
+            gen_log.exception("Failed to extract response parts: %s", e)
+        if image_result is None and timer.outcome is None:
+            timer.outcome = "no_image"
     return text_result, image_result
 
 
@@ -392,48 +549,76 @@ def _extract_response_parts(response) -> tuple[str | None, bytes | None]:
 # Agentic Verification Module — Compares source vs generated for accuracy
 # ---------------------------------------------------------------------------
 
-# VERIFICATION_PROMPT — imported from prompts.py
+# VERIFICATION_PROMPT — prompts.get_prompt("verification")
 
 
 
 def verify_output(source_bytes: bytes, source_mime: str,
-                  generated_bytes: bytes) -> dict:
-    """Compare source dress image vs generated output to find differences."""
-    print("[VERIFY] Comparing source vs generated image...")
+                  generated_bytes: bytes, deadline: Deadline = None) -> dict:
+    """Compare source dress image vs generated output to find differences.
+
+    Verification is optional: if the deadline leaves no room for it, the stage
+    is skipped and a score of -1 is returned.
+    """
+    deadline = deadline or Deadline()
+    if not deadline.has_time_for("verification"):
+        deadline.skip("verification")
+        return {"match_score": -1, "differences": [], "overall_assessment": "Verification skipped: request deadline reached"}
+
+    verify_log.info("Comparing source vs generated image...")
     
     source_part = types.Part.from_bytes(data=source_bytes, mime_type=source_mime)
     gen_part = types.Part.from_bytes(data=generated_bytes, mime_type="image/png")
+    prompt = get_prompt("verification")
     
-    try:
-        response = client.models.generate_content(
-            model="gemini-3-flash-preview",
-            contents=[
-                source_part,
-                "👆 IMAGE 1 — SOURCE (the ORIGINAL outfit). This is the TRUTH.",
-                gen_part,
-                "👆 IMAGE 2 — GENERATED (AI output). Compare clothing/jewelry with IMAGE 1.",
-                VERIFICATION_PROMPT,
-            ],
-            config=types.GenerateContentConfig(
-                temperature=0.1,  # Low temperature for precise comparison
-            ),
-        )
+    with stage_timer("verification", model="gemini-3-flash-preview") as timer:
+        try:
+            response = deadline.run(
+                "verification", get_client().models.generate_content,
+                prompt_name=prompt.name,
+                model="gemini-3-flash-preview",
+                contents=[
+                    source_part,
+                    "👆 IMAGE 1 — SOURCE (the ORIGINAL outfit). This is the TRUTH.",
+                    gen_part,
+                    "👆 IMAGE 2 — GENERATED (AI output). Compare clothing/jewelry with IMAGE 1.",
+                    prompt.text,
+                ],
+                config=types.GenerateContentConfig(
+                    temperature=0.1,  # Low temperature for precise comparison
+                    http_options=deadline.http_options(),
+                ),
+            )
         
-        result = _parse_json_response(response.text)
-        score = result.get("match_score", 0)
-        diffs = result.get("differences", [])
-        print(f"[VERIFY] Match score: {score}/100, Differences found: {len(diffs)}")
-        for d in diffs:
-            print(f"  [{d.get('severity', '?')}] {d.get('feature', '?')}: {d.get('fix_instruction', '')[:80]}")
-        return result
+            result = _parse_json_response(response.text)
+            score = result.get("match_score", 0)
+            diffs = result.get("differences", [])
+            verify_log.info("Match score: %s/100, Differences found: %d", score, len(diffs),
+                            extra={"score": score, "differences": len(diffs)})
+            _log_differences(verify_log, diffs)
+            return result
         
-    except Exception as e:
-        print(f"[VERIFY] Verification failed: {e}")
-        traceback.print_exc()
-        return {"match_score": -1, "differences": [], "overall_assessment": f"Verification failed: {e}"}
+        except RequestCancelled as e:
+            timer.outcome = e.metric_outcome
+            verify_log.info("%s", e)
+            return {"match_score": -1, "differences": [], "overall_assessment": "Verification cancelled by client"}
+        except Exception as e:
+            timer.outcome = "error"
+            verify_log.exception("Verification failed: %s", e)
+            return {"match_score": -1, "differences": [], "overall_assessment": f"Verification failed: {e}"}
+
+
+def _log_differences(log, diffs: list):
+    """Verbose: all differences on one sampled line."""
+    if diffs and logs.verbose_enabled(log):
+        log.info("Differences noted (%d)", len(diffs), extra={"differences": [
+            {"severity": d.get("severity", "?"), "feature": d.get("feature", "unknown"),
+             "fix": d.get("fix_instruction", "")[:80]}
+            for d in diffs
+        ]})
 
 
-def _build_refinement_prompt(details: dict, differences: list, user_instructions: str = "") -> str:
+def _build_refinement_prompt(details: "Analysis | dict", differences: list, user_instructions: str = "") -> str:
     """Build a focused correction prompt from verification differences."""
     
     # Format differences into actionable fixes
@@ -446,52 +631,33 @@ def _build_refinement_prompt(details: dict, differences: list, user_instructions
     
     fixes_block = "\n".join(fix_lines) if fix_lines else "No specific fixes — match source image more closely."
     
-    dress_type = details.get("dress_type", "clothing")
-    primary_color = details.get("primary_color", "as described")
-    checklist = details.get("dress_reproduction_checklist", "")
-    
-    user_block = ""
-    if user_instructions and user_instructions.strip():
-        user_block = f"\n\n═══ USER INSTRUCTIONS (HIGH PRIORITY — MUST FOLLOW) ═══\n{user_instructions.strip()}"
-    
-    prompt = f"""REFINEMENT — Your previous attempt (IMAGE 3) had issues. Fix them.
-
-Look at the SOURCE OUTFIT (IMAGE 1) very carefully. Now compare it to your
-PREVIOUS ATTEMPT (IMAGE 3). Fix THESE specific differences:
-
-═══ ISSUES FOUND — FIX EACH ONE ═══
-{fixes_block}
-{user_block}
-
-═══ OUTFIT REFERENCE ═══
-Type: {dress_type}
-Primary Color: {primary_color}
-{('Key Features: ' + str(checklist)) if checklist else ''}
-
-═══ HOW TO FIX ═══
-1. ZOOM INTO each problem area in the SOURCE image (IMAGE 1)
-2. Compare that exact area in your PREVIOUS ATTEMPT (IMAGE 3)
-3. Edit your previous attempt to match the source — region by region
-4. EMBROIDERY: If the source shows dense, heavy embroidery — match that EXACT density.
-   Do NOT simplify to light/sparse embroidery.
-5. JEWELRY: If the source shows specific jewelry — replicate EACH piece exactly.
-   Match the metal color, stone count, chain style, and size.
-   JEWELRY MUST BE THE EXACT SAME SIZE. Do NOT shrink or enlarge any piece.
-   Big necklace = big necklace. Long earrings = long earrings. Match proportions EXACTLY.
-6. COLORS: Match the EXACT shade from the source. Not similar — IDENTICAL.
-7. Keep the PERSON (IMAGE 2) unchanged — face, skin, hair, body, pose, background.
-8. Output must be photorealistic with natural fit and proper shadows."""
-
-    
-    return prompt
+    analysis = as_analysis(details)
+    instructions = (user_instructions or "").strip()
+    checklist = analysis.dress_checklist
+    return prompt_templates.memo.get_or_render(
+        prompt_templates.REFINEMENT, (analysis.digest, instructions, fixes_block),
+        lambda: prompt_templates.REFINEMENT.render(
+            fixes=fixes_block,
+            user_block=(f"\n\n═══ USER INSTRUCTIONS (HIGH PRIORITY — MUST FOLLOW) ═══\n{instructions}"
+                        if instructions else ""),
+            dress_type=analysis.dress_type or "clothing",
+            primary_color=analysis.primary_color or "as described",
+            key_features=f"Key Features: {checklist}" if checklist else "",
+        ),
+    )
 
 
-def _call_refinement_model(source_part, target_part, prev_gen_part, prompt: str):
+def _call_refinement_model(source_part, target_part, prev_gen_part, prompt: str,
+                           deadline: Deadline = None):
     """Call generation model for refinement — source outfit shown FIRST."""
+    deadline = deadline or Deadline()
     for attempt in range(3):
+        deadline.check("generation")
         try:
-            print(f"[REFINE] Attempt {attempt+1}/3...")
-            resp = client.models.generate_content(
+            refine_log.info("Attempt %d/3...", attempt + 1, extra={"attempt": attempt + 1})
+            resp = deadline.run(
+                "generation", get_client().models.generate_content,
+                prompt_name="refinement",
                 model="gemini-2.5-flash-image",
                 contents=[
                     "🔴 OUTFIT REFERENCE — the outfit MUST look EXACTLY like this:",
@@ -506,109 +672,141 @@ def _call_refinement_model(source_part, target_part, prev_gen_part, prompt: str)
                     response_modalities=["Text", "Image"],
                     system_instruction=GENERATION_SYSTEM_INSTRUCTION,
                     temperature=0.25,
+                    http_options=deadline.http_options(),
                 ),
             )
             return resp
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             err_str = str(e)
             if "503" in err_str or "UNAVAILABLE" in err_str:
                 wait = 10 * (attempt + 1)
-                print(f"[REFINE] 503 — waiting {wait}s...")
-                _time.sleep(wait)
+                deadline.check_retry("generation", wait)
+                refine_log.warning("503 — waiting %ss...", wait, extra={"wait_s": wait})
+                deadline.sleep(wait)
             else:
-                print(f"[REFINE] Error: {e}")
+                refine_log.error("Error: %s", e)
                 raise
     raise Exception("Refinement model failed after 3 attempts.")
 
 
+def _refine(source_image_bytes: bytes, source_mime: str, source_part, target_part,
+            details: "Analysis | dict", user_instructions: str,
+            image: bytes, text: str, verification: dict, deadline: Deadline, rounds: int) -> dict:
+    """Run the refinement loop (refinement.py) on a verified image."""
+    return refinement.run(
+        image, text, verification,
+        refine=lambda prev, critical, d: _extract_response_parts(_call_refinement_model(
+            source_part, target_part, types.Part.from_bytes(data=prev, mime_type="image/png"),
+            _build_refinement_prompt(details, critical, user_instructions), d)),
+        verify=lambda generated, d: verify_output(source_image_bytes, source_mime, generated, d),
+        deadline=deadline,
+        rounds=rounds,
+    )
+
+
 def generate_image(source_image_bytes: bytes, source_mime: str,
                    target_image_bytes: bytes, target_mime: str,
-                   details: dict, user_instructions: str = "") -> dict:
+                   details: "Analysis | dict", user_instructions: str = "",
+                   deadline: Deadline = None, refine_rounds: int = None) -> dict:
     """
     Agentic Virtual Try-On with self-verification loop.
     
     Pipeline:
       1. Generate initial clothing transfer
       2. Verify: Compare source vs generated using vision model
-      3. If match_score < 90: Refine with focused correction prompt (max 2 rounds)
+      3. If match_score < REFINE_SCORE_THRESHOLD: Refine the CRITICAL differences
+         (up to `refine_rounds`, default REFINE_ROUNDS; see refinement.py)
     
-    Returns dict with: image_bytes, text, verification_score, corrections_applied
+    Returns dict with: image_bytes, text, verification_score, corrections_applied,
+    skipped_stages
     """
-    prompt = build_generation_prompt(details, user_instructions)
-
-    # Log prompt (truncated)
-    print("=" * 60)
-    print("GENERATION PROMPT (truncated):")
-    print("=" * 60)
-    print(prompt[:400] + "..." if len(prompt) > 400 else prompt)
-    print("=" * 60)
+    deadline = deadline or Deadline()
+    refine_rounds = refinement.rounds_for(refine_rounds)
+    analysis = as_analysis(details)
+    with stage_timer("prompt_build"):
+        prompt, budget_report = budgeted_generation_prompt(analysis, user_instructions, deadline=deadline)
+    deadline.prompt_budget.append({"prompt": "build_generation_prompt", **budget_report})
+
+    # Log prompt (truncated, sampled)
+    if logs.verbose_enabled(pipeline_log):
+        pipeline_log.info("Generation prompt (truncated)", extra={
+            "prompt": prompt[:400] + "..." if len(prompt) > 400 else prompt,
+            "prompt_chars": len(prompt),
+        })
 
     source_part = types.Part.from_bytes(data=source_image_bytes, mime_type=source_mime)
     target_part = types.Part.from_bytes(data=target_image_bytes, mime_type=target_mime)
 
     # ─── Stage 1: Initial Generation ───
-    print("[PIPELINE] Stage 1: Initial Generation...")
+    pipeline_log.info("Stage 1: Initial Generation...")
     image_result = None
     text_result = None
     
     try:
-        response = _call_generation_model(source_part, target_part, prompt)
+        response = _call_generation_model(source_part, target_part, prompt, deadline,
+                                          prompt_name="build_generation_prompt")
         text_result, image_result = _extract_response_parts(response)
+    except DeadlineExceeded as e:
+        pipeline_log.warning("Generation attempt 1 stopped: %s", e)
+        text_result = str(e)
     except Exception as e:
-        print(f"[ERROR] Generation attempt 1 failed: {e}")
-        traceback.print_exc()
+        pipeline_log.exception("Generation attempt 1 failed: %s", e)
 
     # Retry with simplified prompt if no image
-    if image_result is None:
-        print("[RETRY] No image in first attempt. Retrying with simplified prompt...")
+    if image_result is None and not deadline.has_time_for("generation"):
+        deadline.skip("generation_simplified")
+    elif image_result is None:
+        pipeline_log.info("No image in first attempt. Retrying with simplified prompt...")
         simple_prompt = (
             f"Copy the EXACT outfit and jewelry from IMAGE 1 onto the person in IMAGE 2. "
-            f"The outfit is: {details.get('dress_type', 'clothing')}. "
-            f"Primary color: {details.get('primary_color', 'not specified')}. "
+            f"The outfit is: {analysis.dress_type or 'clothing'}. "
+            f"Primary color: {analysis.primary_color or 'not specified'}. "
             f"Keep the person's face, body, hair, skin, and background EXACTLY the same. "
             f"Only change their clothes and jewelry to match IMAGE 1."
         )
         try:
-            response = _call_generation_model(source_part, target_part, simple_prompt)
+            response = _call_generation_model(source_part, target_part, simple_prompt, deadline,
+                                              prompt_name="simplified_generation")
             text_result, image_result = _extract_response_parts(response)
+        except DeadlineExceeded as e:
+            pipeline_log.warning("Generation attempt 2 stopped: %s", e)
+            text_result = str(e)
         except Exception as e:
-            print(f"[ERROR] Generation attempt 2 failed: {e}")
-            traceback.print_exc()
+            pipeline_log.exception("Generation attempt 2 failed: %s", e)
 
     if image_result is None:
+        if deadline.cancelled:
+            deadline.skip("verification")
         return {
             "image_bytes": None,
             "text": text_result,
             "prompt": prompt,
             "verification_score": -1,
             "corrections_applied": [],
+            "skipped_stages": deadline.skipped_stages,
         }
 
-    # ─── Stage 2: Score-only verification (NO refinement — first pass must be accurate) ───
-    print("[PIPELINE] Stage 2: Verifying output (score only)...")
-    score = -1
+    # ─── Stage 2: Verification ───
+    pipeline_log.info("Stage 2: Verifying output...")
+    verification = {}
     try:
-        verification = verify_output(source_image_bytes, source_mime, image_result)
-        score = verification.get("match_score", -1)
-        diffs = verification.get("differences", [])
-        print(f"[PIPELINE] ✅ Score: {score}/100")
-        if diffs:
-            print(f"[PIPELINE] Differences noted ({len(diffs)}):")
-            for d in diffs[:5]:
-                sev = d.get("severity", "?")
-                feat = d.get("feature", "unknown")
-                print(f"  [{sev}] {feat}: {d.get('fix_instruction', '')[:80]}")
+        verification = verify_output(source_image_bytes, source_mime, image_result, deadline)
     except Exception as e:
-        print(f"[PIPELINE] Verification failed: {e}")
-
-    print(f"\n[PIPELINE] ✅ Complete. Score: {score}/100 (single pass)")
+        pipeline_log.error("Verification failed: %s", e)
+
+    # ─── Stage 3: Optional refinement of CRITICAL differences ───
+    result = _refine(source_image_bytes, source_mime, source_part, target_part, analysis, user_instructions,
+                     image_result, text_result, verification, deadline, refine_rounds)
+    score = result["verification_score"]
+    pipeline_log.info("Complete. Score: %s/100 (%d refinement round(s))", score, len(result["corrections_applied"]),
+                      extra={"score": score, "rounds": len(result["corrections_applied"])})
     
     return {
-        "image_bytes": image_result,
-        "text": text_result,
+        **result,
         "prompt": prompt,
-        "verification_score": score,
-        "corrections_applied": [],
+        "skipped_stages": deadline.skipped_stages,
     }
 
 
@@ -617,20 +815,29 @@ def generate_image(source_image_bytes: bytes, source_mime: str,
 # Vision-First Pipeline — Extract 100% outfit details, then generate
 # ---------------------------------------------------------------------------
 
-# VISION_EXTRACT_PROMPT — imported from prompts.py
+# VISION_EXTRACT_PROMPT — prompts.get_prompt("extraction")
 
 
 
-def _extract_outfit_details(source_image_bytes: bytes, source_mime: str) -> str:
+def _extract_outfit_details(source_image_bytes: bytes, source_mime: str,
+                            deadline: Deadline = None) -> str:
     """
     Vision-first: Extract 100% outfit details from source image using text model.
     Returns detailed text description covering every visual element.
     """
-    source_part = types.Part.from_bytes(data=source_image_bytes, mime_type=source_mime)
-    try:
-        resp = client.models.generate_content(
+    deadline = deadline or Deadline()
+    if not deadline.has_time_for("extraction"):
+        deadline.skip("extraction")
+        return ""
+    prompt = get_prompt("extraction")
+
+    def _extract():
+        source_part = types.Part.from_bytes(data=source_image_bytes, mime_type=source_mime)
+        resp = deadline.run(
+            "extraction", get_client().models.generate_content,
+            prompt_name=prompt.name,
             model="gemini-3-flash-preview",
-            contents=[source_part, VISION_EXTRACT_PROMPT],
+            contents=[source_part, prompt.text],
             config=types.GenerateContentConfig(
                 system_instruction=(
                     "You are a master fashion analyst. Your job is to capture EVERY visual detail "
@@ -639,40 +846,79 @@ def _extract_outfit_details(source_image_bytes: bytes, source_mime: str) -> str:
                     "Miss NOTHING — every embroidery motif, every color shade, every jewelry element."
                 ),
                 temperature=0.2,
+                http_options=deadline.http_options(),
             ),
         )
-        details = resp.text.strip()
-        print(f"[VISION] ✅ Extracted outfit details ({len(details)} chars)")
-        return details
-    except Exception as e:
-        print(f"[VISION] ❌ Extraction failed: {e}")
-        traceback.print_exc()
-        return ""
+        return resp.text.strip() or None
+
+    with stage_timer("extraction", model="gemini-3-flash-preview") as timer:
+        try:
+            details = shared_cache.get_or_compute(
+                "extraction", _image_cache_key(source_image_bytes, prompt), _extract,
+                wait_timeout=deadline.remaining(), cancelled=lambda: deadline.cancelled,
+            ) or ""
+            vision_log.info("Extracted outfit details (%d chars)", len(details), extra={"chars": len(details)})
+            return details
+        except Exception as e:
+            timer.outcome = getattr(e, "metric_outcome", "error")
+            vision_log.exception("Extraction failed: %s", e)
+            return ""
+
+
+def _local_scorer(source_image_bytes: bytes):
+    """score(image_bytes) -> visual-descriptor similarity to the source image
+    (0.0 when either image cannot be decoded)."""
+    source_vec = []
+
+    def score(image_bytes: bytes) -> float:
+        try:
+            if not source_vec:
+                source_vec.append(visual_index.descriptor(source_image_bytes))
+            return float(visual_index.descriptor(image_bytes) @ source_vec[0])
+        except Exception as e:
+            gen_log.warning("Local scoring failed: %s", e)
+            return 0.0
+
+    return score
+
+
+def _best_of_result(result: dict, deadline: Deadline) -> dict:
+    return {**result, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
 
 
 def generate_image_direct(source_image_bytes: bytes, source_mime: str,
                           target_image_bytes: bytes, target_mime: str,
                           user_instructions: str = "",
-                          analysis_json: dict = None) -> dict:
+                          analysis_json: "Analysis | dict" = None,
+                          deadline: Deadline = None,
+                          candidates: int = 1,
+                          refine_rounds: int = None) -> dict:
     """
-    Vision-first clothing transfer pipeline (SINGLE PASS):
+    Vision-first clothing transfer pipeline:
       Uses pre-analyzed JSON (from UI) or falls back to vision extraction.
-      Pipeline: JSON → Generate → Score (single pass, no refinement)
+      Pipeline: JSON → Generate → Score → Refine (only below the score
+      threshold, up to `refine_rounds`, default REFINE_ROUNDS; see refinement.py)
+    Scoring and refinement are skipped when `deadline` leaves no room for
+    them. With `candidates` > 1 the generate/score step runs best-of-N (see
+    best_of.py) and is not refined.
     """
+    deadline = deadline or Deadline()
+    refine_rounds = refinement.rounds_for(refine_rounds)
     target_part = types.Part.from_bytes(data=target_image_bytes, mime_type=target_mime)
     source_part = types.Part.from_bytes(data=source_image_bytes, mime_type=source_mime)
 
     # ─── Step 1: Build prompt from analysis JSON ───
     if analysis_json:
-        print("[DIRECT] Using pre-analyzed JSON to build generation prompt...")
-        prompt = build_generation_prompt(analysis_json, user_instructions)
-        details = analysis_json
+        direct_log.info("Using pre-analyzed JSON to build generation prompt...")
+        with stage_timer("prompt_build"):
+            prompt, budget_report = budgeted_generation_prompt(analysis_json, user_instructions, deadline=deadline)
+        prompt_name = "build_generation_prompt"
     else:
         # Fallback: extract details on the fly
-        print("[DIRECT] No pre-analyzed JSON — extracting outfit details...")
-        outfit_details = _extract_outfit_details(source_image_bytes, source_mime)
+        direct_log.info("No pre-analyzed JSON — extracting outfit details...")
+        outfit_details = _extract_outfit_details(source_image_bytes, source_mime, deadline)
         if not outfit_details:
-            return {"image_bytes": None, "text": "Failed to extract outfit details", "verification_score": -1, "corrections_applied": []}
+            return {"image_bytes": None, "text": "Failed to extract outfit details", "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
         prompt = (
             f"REPLACE ALL CLOTHING on the person with the outfit described below.\n\n"
             f"═══ OUTFIT TO REPRODUCE ═══\n"
@@ -688,46 +934,56 @@ def generate_image_direct(source_image_bytes: bytes, source_mime: str,
         )
         if user_instructions and user_instructions.strip():
             prompt += f"\n\nUSER INSTRUCTIONS (HIGH PRIORITY): {user_instructions.strip()}"
-        details = {}
+        prompt_name = "extracted_details"
+        budget_report = prompt_budget.measure(prompt, prompt_budget.budget_for(metrics.route_label()))
+    deadline.prompt_budget.append({"prompt": prompt_name, **budget_report})
+
+    if candidates > 1:
+        direct_log.info("Generating %d candidates...", candidates)
+        return _best_of_result(best_of.run(
+            candidates,
+            generate=lambda variant, d: _extract_response_parts(_call_generation_model(
+                source_part, target_part, prompt, d, prompt_name=prompt_name,
+                model=variant.get("model"), temperature=variant.get("temperature"))),
+            verify=lambda image, d: verify_output(source_image_bytes, source_mime, image, d).get("match_score", -1),
+            local_score=_local_scorer(source_image_bytes),
+            deadline=deadline,
+        ), deadline)
 
     # ─── Step 2: Initial Generation ───
-    print("[DIRECT] Generating clothing transfer...")
+    direct_log.info("Generating clothing transfer...")
     try:
-        response = _call_generation_model(source_part, target_part, prompt)
+        response = _call_generation_model(source_part, target_part, prompt, deadline,
+                                          prompt_name=prompt_name)
         text_result, image_result = _extract_response_parts(response)
+    except DeadlineExceeded as e:
+        direct_log.warning("Generation stopped: %s", e)
+        if deadline.cancelled:
+            deadline.skip("verification")
+        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
     except Exception as e:
-        print(f"[DIRECT] Generation failed: {e}")
-        traceback.print_exc()
-        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": []}
+        direct_log.exception("Generation failed: %s", e)
+        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
 
     if image_result is None:
-        print("[DIRECT] No image returned.")
-        return {"image_bytes": None, "text": text_result, "verification_score": -1, "corrections_applied": []}
+        direct_log.warning("No image returned.")
+        return {"image_bytes": None, "text": text_result, "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
 
-    # ─── Step 3: Score-only verification (NO refinement — first pass must be accurate) ───
-    print("[DIRECT] Verifying output (score only)...")
-    score = -1
+    # ─── Step 3: Verification ───
+    direct_log.info("Verifying output...")
+    verification = {}
     try:
-        verification = verify_output(source_image_bytes, source_mime, image_result)
-        score = verification.get("match_score", -1)
-        diffs = verification.get("differences", [])
-        print(f"[DIRECT] ✅ Score: {score}/100")
-        if diffs:
-            print(f"[DIRECT] Differences noted ({len(diffs)}):")
-            for d in diffs[:5]:
-                sev = d.get("severity", "?")
-                feat = d.get("feature", "unknown")
-                print(f"  [{sev}] {feat}: {d.get('fix_instruction', '')[:80]}")
+        verification = verify_output(source_image_bytes, source_mime, image_result, deadline)
     except Exception as e:
-        print(f"[DIRECT] Verification failed: {e}")
+        direct_log.error("Verification failed: %s", e)
 
-    print(f"\n[DIRECT] ✅ Complete. Score: {score}/100 (single pass)")
-    return {
-        "image_bytes": image_result,
-        "text": text_result,
-        "verification_score": score,
-        "corrections_applied": [],
-    }
+    # ─── Step 4: Optional refinement of CRITICAL differences ───
+    result = _refine(source_image_bytes, source_mime, source_part, target_part, analysis_json, user_instructions,
+                     image_result, text_result, verification, deadline, refine_rounds)
+    score = result["verification_score"]
+    direct_log.info("Complete. Score: %s/100 (%d refinement round(s))", score, len(result["corrections_applied"]),
+                    extra={"score": score, "rounds": len(result["corrections_applied"])})
+    return {**result, "skipped_stages": deadline.skipped_stages}
 
 
 
@@ -735,120 +991,144 @@ def generate_image_direct(source_image_bytes: bytes, source_mime: str,
 # Standalone Dress Reproduction (No Target Person)
 # ---------------------------------------------------------------------------
 
+def _flatten_analysis_for_prompt(details: "Analysis | dict") -> str:
+    """Render the analysis as "• Label: value" lines for the standalone prompt
+    (computed once per Analysis)."""
+    analysis = as_analysis(details)
+    if analysis._flat is None:
+        outfit_details_lines = []
+        for key, val in analysis.fields.items():
+            label = key.replace('_', ' ').title()
+            if isinstance(val, (list, dict)):
+                val = json.dumps(val, ensure_ascii=False)
+            outfit_details_lines.append(f"• {label}: {val}")
+        analysis._flat = "\n".join(outfit_details_lines)
+    return analysis._flat
+
+
+def _call_standalone_model(gen_prompt: str, source_part, deadline: Deadline, prompt_name: str,
+                           model: str = None, temperature: float = None):
+    """Product-photo generation call, retried on 503 while the deadline allows.
+
+    `model` / `temperature` override the defaults (best-of-N candidates).
+    """
+    for attempt in range(3):
+        deadline.check("generation")
+        try:
+            return deadline.run(
+                "generation", get_client().models.generate_content,
+                prompt_name=prompt_name,
+                # model="gemini-2.5-flash-image",
+                model=model or "gemini-3-pro-image-preview",
+                contents=[gen_prompt, source_part],
+                config=types.GenerateContentConfig(
+                    response_modalities=["Text", "Image"],
+                    system_instruction=(
+                        "You are a PIXEL-PERFECT product photographer. "
+                        "You ZOOM INTO the reference image and reproduce EVERY detail with 100% accuracy. "
+                        "NEVER simplify, NEVER approximate, NEVER skip ANY detail. "
+                        "Match exact colors, exact patterns, exact embroidery density, exact jewelry stones. "
+                        "NEVER include any person, body, face, or mannequin. "
+                        "Show ONLY garments and jewelry on a clean surface. "
+                        "YOU MUST GET IT 100% RIGHT ON THE FIRST ATTEMPT."
+                    ),
+                    temperature=0.0 if temperature is None else temperature,
+                    http_options=deadline.http_options(),
+                ),
+            )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if attempt < 2 and ("503" in str(e) or "UNAVAILABLE" in str(e)):
+                wait = 10 * (attempt + 1)
+                deadline.check_retry("generation", wait)
+                deadline.sleep(wait)
+            else:
+                raise
+
+
 def generate_dress_standalone(source_image_bytes: bytes, source_mime: str,
                               user_instructions: str = "",
-                              analysis_json: dict = None) -> dict:
+                              analysis_json: "Analysis | dict" = None,
+                              deadline: Deadline = None,
+                              candidates: int = 1) -> dict:
     """
     Vision-first standalone dress generation (SINGLE PASS):
       Uses pre-analyzed JSON (from UI) or falls back to vision extraction.
       Pipeline: JSON → Generate → Score (single pass, no refinement)
+    Scoring is skipped when `deadline` leaves no room for it. With
+    `candidates` > 1 the generate/score step runs best-of-N (see best_of.py).
     """
+    deadline = deadline or Deadline()
     source_part = types.Part.from_bytes(data=source_image_bytes, mime_type=source_mime)
     has_custom_prompt = bool(user_instructions and user_instructions.strip())
 
+    template = prompt_templates.STANDALONE_CUSTOM if has_custom_prompt else prompt_templates.STANDALONE_FLATLAY
+    instructions = user_instructions.strip() if has_custom_prompt else ""
+
     # ─── Step 1: Build prompt from analysis JSON ───
     if analysis_json:
-        print("[STANDALONE] Using pre-analyzed JSON to build generation prompt...")
-        # Extract outfit details text from JSON for standalone prompt
-        outfit_details_lines = []
-        for key, val in analysis_json.items():
-            if val and str(val).lower() not in ('null', 'none', 'n/a', ''):
-                label = key.replace('_', ' ').title()
-                if isinstance(val, (list, dict)):
-                    val = json.dumps(val, ensure_ascii=False)
-                outfit_details_lines.append(f"• {label}: {val}")
-        outfit_details = "\n".join(outfit_details_lines)
+        standalone_log.info("Using pre-analyzed JSON to build generation prompt...")
+        analysis = as_analysis(analysis_json)
+        with stage_timer("prompt_build"):
+            gen_prompt = prompt_templates.memo.get_or_render(
+                template, (analysis.digest, instructions),
+                lambda: template.render(user_instructions=instructions,
+                                        outfit_details=_flatten_analysis_for_prompt(analysis)),
+            )
     else:
         # Fallback: extract details on the fly
-        print("[STANDALONE] No pre-analyzed JSON — extracting outfit details...")
-        outfit_details = _extract_outfit_details(source_image_bytes, source_mime)
+        standalone_log.info("No pre-analyzed JSON — extracting outfit details...")
+        outfit_details = _extract_outfit_details(source_image_bytes, source_mime, deadline)
         if not outfit_details:
-            return {"image_bytes": None, "text": "Failed to extract outfit details", "verification_score": -1, "corrections_applied": []}
-
-    # ─── Step 2: Generate once from JSON ───
-    if has_custom_prompt:
-        gen_prompt = (
-            f"{user_instructions.strip()}\n\n"
-            f"═══ OUTFIT TO REPRODUCE ═══\n"
-            f"{outfit_details}\n"
-            f"═══ END OUTFIT DETAILS ═══\n\n"
-            f"Use the attached photo as visual reference. Reproduce every detail with 100% accuracy."
-        )
-    else:
-        gen_prompt = (
-            f"Create a flat-lay product photo of this outfit.\n\n"
-            f"═══ OUTFIT TO REPRODUCE ═══\n"
-            f"{outfit_details}\n"
-            f"═══ END OUTFIT DETAILS ═══\n\n"
-            f"RULES:\n"
-            f"- NO person, NO body, NO mannequin — ONLY the garments and jewelry\n"
-            f"- Lay all items flat on a white surface: dress/lehenga, blouse, dupatta, jewelry\n"
-            f"- Top-down / bird's eye view\n"
-            f"- Every detail above must match 100%: embroidery, colors, patterns, jewelry\n"
-            f"- Professional e-commerce product photography\n"
-            f"- Use the attached photo as visual reference for exact details"
-        )
-
-    print("[STANDALONE] Generating product photo (single pass, maximum detail)...")
+            return {"image_bytes": None, "text": "Failed to extract outfit details", "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
+        gen_prompt = template.render(user_instructions=instructions, outfit_details=outfit_details)
+
+    prompt_name = "standalone_custom" if has_custom_prompt else "standalone_flatlay"
+    if candidates > 1:
+        standalone_log.info("Generating %d product photo candidates...", candidates)
+        return _best_of_result(best_of.run(
+            candidates,
+            generate=lambda variant, d: _extract_response_parts(_call_standalone_model(
+                gen_prompt, source_part, d, prompt_name,
+                model=variant.get("model"), temperature=variant.get("temperature"))),
+            verify=lambda image, d: verify_output(source_image_bytes, source_mime, image, d).get("match_score", -1),
+            local_score=_local_scorer(source_image_bytes),
+            deadline=deadline,
+        ), deadline)
+
+    standalone_log.info("Generating product photo (single pass, maximum detail)...")
     try:
-        for attempt in range(3):
-            try:
-                response = client.models.generate_content(
-                    # model="gemini-2.5-flash-image",
-                    model="gemini-3-pro-image-preview",
-                    contents=[gen_prompt, source_part],
-                    config=types.GenerateContentConfig(
-                        response_modalities=["Text", "Image"],
-                        system_instruction=(
-                            "You are a PIXEL-PERFECT product photographer. "
-                            "You ZOOM INTO the reference image and reproduce EVERY detail with 100% accuracy. "
-                            "NEVER simplify, NEVER approximate, NEVER skip ANY detail. "
-                            "Match exact colors, exact patterns, exact embroidery density, exact jewelry stones. "
-                            "NEVER include any person, body, face, or mannequin. "
-                            "Show ONLY garments and jewelry on a clean surface. "
-                            "YOU MUST GET IT 100% RIGHT ON THE FIRST ATTEMPT."
-                        ),
-                        temperature=0.0,
-                    ),
-                )
-                break
-            except Exception as e:
-                if "503" in str(e) or "UNAVAILABLE" in str(e):
-                    _time.sleep(10 * (attempt + 1))
-                else:
-                    raise
+        response = _call_standalone_model(gen_prompt, source_part, deadline, prompt_name)
         text_result, image_result = _extract_response_parts(response)
+    except DeadlineExceeded as e:
+        standalone_log.warning("Generation stopped: %s", e)
+        if deadline.cancelled:
+            deadline.skip("verification")
+        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
     except Exception as e:
-        print(f"[STANDALONE] Generation failed: {e}")
-        traceback.print_exc()
-        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": []}
+        standalone_log.exception("Generation failed: %s", e)
+        return {"image_bytes": None, "text": str(e), "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
 
     if image_result is None:
-        return {"image_bytes": None, "text": text_result or "No image generated", "verification_score": -1, "corrections_applied": []}
+        return {"image_bytes": None, "text": text_result or "No image generated", "verification_score": -1, "corrections_applied": [], "skipped_stages": deadline.skipped_stages}
 
     # ─── Step 3: Score-only verification (NO refinement — first pass must be accurate) ───
-    print("[STANDALONE] Verifying output (score only)...")
+    standalone_log.info("Verifying output (score only)...")
     score = -1
     try:
-        verification = verify_output(source_image_bytes, source_mime, image_result)
+        verification = verify_output(source_image_bytes, source_mime, image_result, deadline)
         score = verification.get("match_score", -1)
-        diffs = verification.get("differences", [])
-        print(f"[STANDALONE] ✅ Score: {score}/100")
-        if diffs:
-            print(f"[STANDALONE] Differences noted ({len(diffs)}):")
-            for d in diffs[:5]:
-                sev = d.get("severity", "?")
-                feat = d.get("feature", "unknown")
-                print(f"  [{sev}] {feat}: {d.get('fix_instruction', '')[:80]}")
     except Exception as e:
-        print(f"[STANDALONE] Verification failed: {e}")
+        standalone_log.error("Verification failed: %s", e)
 
-    print(f"\n[STANDALONE] ✅ Complete. Score: {score}/100 (single pass)")
+    standalone_log.info("Complete. Score: %s/100 (single pass)", score, extra={"score": score})
     return {
         "image_bytes": image_result,
         "text": text_result,
         "verification_score": score,
         "corrections_applied": [],
+        "skipped_stages": deadline.skipped_stages,
     }
 
 
@@ -865,11 +1145,171 @@ def index():
     return render_template("index.html")
 
 
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def _request_deadline() -> Deadline:
+    """Create this request's Deadline and bind its ID to the log context.
+
+    The client may supply `request_id` (form field or X-Request-ID header) so
+    it can cancel the request later; otherwise, or when it is not a plain
+    token (it ends up in logs, the usage ledger and the cancel registry), one
+    is generated. The ID used is returned in X-Request-ID.
+    """
+    request_id = request.form.get("request_id") or request.headers.get("X-Request-ID")
+    if request_id and not _REQUEST_ID_RE.fullmatch(request_id):
+        api_log.warning("Ignoring malformed request ID %r", request_id[:80])
+        request_id = None
+    request_id = request_id or uuid.uuid4().hex[:16]
+    g.log_token = logs.bind_request(request_id, request.endpoint)
+    g.deadline = Deadline(REQUEST_BUDGET_SECONDS, request_id=request_id)
+    return g.deadline
+
+
+def _debug_requested() -> bool:
+    return request.values.get("debug", "").lower() in ("1", "true", "yes")
+
+
+def _finish_deadline(deadline: Deadline, endpoint: str):
+    """Write the request's usage to the ledger and unregister its deadline."""
+    usage.append_to_ledger(deadline.request_id, endpoint, deadline.usage)
+    deadline.close()
+
+
+@app.teardown_request
+def _finish_request_deadline(exc):
+    if g.get("streaming"):
+        return  # the streamed response finishes its deadline (see _stream_followup)
+    deadline = g.pop("deadline", None)
+    if deadline is not None:
+        _finish_deadline(deadline, request.endpoint)
+    log_token = g.pop("log_token", None)
+    if log_token is not None:
+        logs.unbind_request(log_token)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = _time.perf_counter()
+
+
+@app.before_request
+def _bind_prompt_variant():
+    """`prompt_variant` (form field) or X-Prompt-Variant selects full/compact prompts."""
+    variant = request.values.get("prompt_variant") or request.headers.get("X-Prompt-Variant")
+    if variant:
+        try:
+            g.prompt_variant_token = use_variant(variant.lower())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+
+@app.teardown_request
+def _reset_prompt_variant(exc):
+    token = g.pop("prompt_variant_token", None)
+    if token is not None:
+        reset_variant(token)
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.endpoint or "unknown"
+        metrics.REQUESTS.inc(route=route, status=response.status_code)
+        metrics.REQUEST_SECONDS.observe(_time.perf_counter() - started, route=route, status=response.status_code)
+    if "deadline" in g:
+        response.headers["X-Request-ID"] = g.deadline.request_id
+    return response
+
+
+if profiling.ENABLED:
+    # Registered only when PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set.
+    @app.before_request
+    def _start_profiler():
+        if profiling.requested(request.headers):
+            g.profiler = profiling.RequestProfiler()
+            g.profiler.start()
+
+    @app.after_request
+    def _add_profile_header(response):
+        if "profiler" in g:
+            # Server-generated: the request ID comes from the client and is
+            # kept in the profile's JSON only, never in a file name.
+            g.profile_id = uuid.uuid4().hex
+            g.profile_request_id = g.deadline.request_id if "deadline" in g else None
+            g.profile_status = response.status_code
+            response.headers["X-Profile-Id"] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def _save_profile(exc):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            summary = profiler.stop()
+            profiler.save(g.get("profile_id") or uuid.uuid4().hex, summary, request_id=g.get("profile_request_id"),
+                          route=request.endpoint, status=g.get("profile_status", 500))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint (per worker process)."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache-stats")
+def cache_stats():
+    """Shared-cache counters per namespace, summed over all workers."""
+    cache = shared_cache.get_cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "backend": type(cache).__name__, "namespaces": cache.stats()})
+
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: the Gemini client is built and the API routes can be served."""
+    if not _client_configured:
+        return jsonify({"status": "unconfigured", "error": "GEMINI_API_KEY not set"}), 503
+    if _client_error:
+        return jsonify({"status": "error", "error": _client_error}), 503
+    if client is None:
+        return jsonify({"status": "warming"}), 503
+    return jsonify({"status": "ready"})
+
+
+def _visual_lookup(store, image_bytes: bytes, key: str):
+    """(descriptor, closest stored analysis above VISUAL_REUSE_THRESHOLD or None).
+    Both are None when the visual index is disabled or the image cannot be decoded."""
+    index = visual_index.get_index(store)
+    if index is None:
+        return None, None
+    try:
+        with stage_timer("visual_descriptor"):
+            vec = visual_index.descriptor(image_bytes)
+    except Exception as e:
+        api_log.warning("No visual descriptor for %s: %s", key[:12], e)
+        return None, None
+    for match_hash, similarity in index.search(vec, k=5, exclude=key):
+        if similarity < visual_index.VISUAL_REUSE_THRESHOLD:
+            break
+        if store.summaries([match_hash]):
+            return vec, {"image_hash": match_hash, "similarity": round(similarity, 4)}
+    return vec, None
+
+
 @app.route("/api/analyze", methods=["POST"])
 def api_analyze():
     """Analyze a source image and return structured clothing details."""
-    if client is None:
+    if get_client() is None:
         return jsonify({"error": "GEMINI_API_KEY not configured on server"}), 503
+    deadline = _request_deadline()
     try:
         if "image" not in request.files:
             return jsonify({"error": "No image file provided"}), 400
@@ -878,19 +1318,290 @@ def api_analyze():
         image_bytes = file.read()
         mime_type = file.content_type or "image/jpeg"
 
-        details = analyze_image(image_bytes, mime_type)
-        return jsonify({"success": True, "details": details})
+        # Same image analyzed before: serve the stored analysis, no model call.
+        store = analysis_store.get_store()
+        key = analysis_store.image_hash(image_bytes)
+        if store is not None and not request.values.get("refresh"):
+            stored = store.get(key)
+            if stored is not None:
+                return jsonify({"success": True, "details": stored, "image_hash": key, "cached": True})
+
+        # Near-duplicate of a stored outfit: reuse its analysis when asked to,
+        # otherwise analyze and point at it.
+        vec, similar = _visual_lookup(store, image_bytes, key)
+        if similar is not None and request.values.get("reuse_similar"):
+            return jsonify({"success": True, "details": store.get(similar["image_hash"]), "image_hash": key,
+                            "cached": True, "reused_from": similar})
+
+        use_cache = not request.values.get("refresh")
+        tiled = None
+        if tiling.TILED_ANALYSIS or request.values.get("tiled", "").lower() in ("1", "true", "yes"):
+            tile_mode = request.values.get("tile_mode") or tiling.TILE_MODE
+            if tile_mode not in tiling.MODES:
+                return jsonify({"error": f"tile_mode must be one of {', '.join(tiling.MODES)}"}), 400
+            compare_full = None
+            if request.values.get("compare_full", "").lower() in ("1", "true", "yes"):
+                compare_full = lambda b, m, d: analyze_image(b, m, d, use_cache=False)
+            tiled = tiling.analyze(image_bytes, mime_type,
+                                   lambda b, m, d: analyze_image(b, m, d, use_cache=use_cache),
+                                   _analyze_tile, _deep_merge, deadline, mode=tile_mode, compare_full=compare_full)
+        if tiled is not None:
+            analysis = Analysis.from_dict(tiled[0])
+        else:
+            analysis = Analysis.from_dict(analyze_image(image_bytes, mime_type, deadline, use_cache=use_cache))
+        if store is not None:
+            store.put(key, analysis, get_prompt("analysis").version)
+            if vec is not None:
+                visual_index.get_index(store).add(store, key, vec)
+        fields = analysis_followup.plan(analysis)
+        payload = {"success": True, "details": analysis.to_dict(), "image_hash": key, "cached": False,
+                   "completeness": completeness(analysis), "weak_fields": fields}
+        if similar is not None:
+            payload["similar"] = similar
+        if tiled is not None:
+            payload["tiling"] = tiled[1]
+        if fields and request.values.get("stream", "").lower() in ("1", "true", "yes"):
+            return _stream_followup(payload, analysis, fields, image_bytes, mime_type, store, key, deadline)
+        if _debug_requested():
+            payload["usage"] = usage.summarize(deadline.usage)
+        return jsonify(payload)
+
+    except RequestCancelled as e:
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e), "skipped_stages": deadline.skipped_stages}), 504
+    except json.JSONDecodeError:
+        return jsonify({"error": "Failed to parse vision model output as JSON"}), 500
+    except Exception as e:
+        api_log.exception("Unhandled error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+def _stream_followup(payload: dict, analysis: Analysis, fields: list, image_bytes: bytes, mime_type: str,
+                     store, key: str, deadline: Deadline) -> Response:
+    """NDJSON response: the first pass right away (`followup: "pending"`),
+    then the analysis with the weak fields followed up (`followup: "done"`,
+    or "failed"/"skipped" with the first pass unchanged).
+
+    Flask tears the request down before the body is streamed, so the
+    deadline stays registered (cancellable) until the follow-up is done, and
+    its usage goes to the ledger then, follow-up included.
+    """
+    endpoint = request.endpoint
+    future = analysis_followup.start(analysis, fields, _followup_asker(image_bytes, mime_type),
+                                     _deep_merge, deadline)
+
+    def finish(done):
+        result = done.result()
+        if result["filled"] and store is not None:
+            store.put(key, Analysis.from_dict(result["details"]), get_prompt("analysis").version)
+        _finish_deadline(deadline, endpoint)
+
+    # Runs even if the client leaves before the second line.
+    future.add_done_callback(finish)
+    debug = _debug_requested()
+
+    def events():
+        yield json.dumps({**payload, "followup": "pending"}, ensure_ascii=False) + "\n"
+        result = future.result()
+        final = {"success": True, "details": result["details"], "image_hash": key, "cached": False,
+                 "completeness": result["completeness"], "weak_fields": result["weak_fields"],
+                 "filled": result["filled"], "followup": result["status"]}
+        if result["error"]:
+            final["followup_error"] = result["error"]
+        if debug:
+            final["usage"] = usage.summarize(deadline.usage)
+        yield json.dumps(final, ensure_ascii=False) + "\n"
+
+    response = Response(stream_with_context(events()), mimetype="application/x-ndjson")
+    g.streaming = True
+    log_token = g.pop("log_token", None)
+    if log_token is not None:
+        response.call_on_close(lambda: logs.unbind_request(log_token))
+    return response
+
+
+def _analyze_stored(image_bytes: bytes, mime_type: str, deadline: Deadline) -> dict:
+    """analyze_image, served from / saved to the analysis store when enabled."""
+    store = analysis_store.get_store()
+    key = analysis_store.image_hash(image_bytes)
+    stored = store.get(key) if store is not None else None
+    if stored is not None:
+        return stored
+    analysis = Analysis.from_dict(analyze_image(image_bytes, mime_type, deadline))
+    if store is not None:
+        store.put(key, analysis, get_prompt("analysis").version)
+    return analysis.to_dict()
+
+
+def _read_views(field: str) -> list[dict]:
+    """Uploaded views of one outfit: every `field` file, labelled by the
+    `labels` form values (repeated or comma-separated; default "view N")."""
+    labels = [label.strip() for value in request.form.getlist("labels") for label in value.split(",")]
+    views = []
+    for i, file in enumerate(request.files.getlist(field)):
+        image_bytes = file.read()
+        views.append({
+            "label": labels[i] if i < len(labels) and labels[i] else f"view {i + 1}",
+            "image_bytes": image_bytes,
+            "mime_type": file.content_type or "image/jpeg",
+            "image_hash": analysis_store.image_hash(image_bytes),
+        })
+    return views
+
+
+def _analyze_views(views: list[dict], deadline: Deadline) -> dict:
+    result = multi_view.analyze(views, _analyze_stored, _deep_merge, deadline)
+    for summary in result["views"]:
+        summary["image_hash"] = views[summary["index"]]["image_hash"]
+    return result
+
 
+@app.route("/api/analyze-views", methods=["POST"])
+def api_analyze_views():
+    """Analyze several views of one outfit (`images`, optional `labels` such
+    as front,back,detail) concurrently and fuse them into one analysis.
+    `primary_view` is the most complete view — send it as `source_image`
+    with the fused `details` as `analysis_json`, or send all views as
+    `source_views` to /api/generate-direct."""
+    if get_client() is None:
+        return jsonify({"error": "GEMINI_API_KEY not configured on server"}), 503
+    deadline = _request_deadline()
+    try:
+        views = _read_views("images")
+        if not views:
+            return jsonify({"error": "No image files provided"}), 400
+        if len(views) > multi_view.MULTI_VIEW_MAX:
+            return jsonify({"error": f"At most {multi_view.MULTI_VIEW_MAX} views per request"}), 400
+        payload = {"success": True, **_analyze_views(views, deadline)}
+        if _debug_requested():
+            payload["usage"] = usage.summarize(deadline.usage)
+        return jsonify(payload)
+
+    except RequestCancelled as e:
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e), "skipped_stages": deadline.skipped_stages}), 504
     except json.JSONDecodeError:
         return jsonify({"error": "Failed to parse vision model output as JSON"}), 500
     except Exception as e:
-        traceback.print_exc()
+        api_log.exception("Unhandled error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/analyses", methods=["GET"])
+def api_analyses():
+    """Search stored analyses without calling the model.
+
+    Filters (all optional, combined with AND): dress_type, color (hex),
+    fabric, jewelry (comma-separated; every kind must be present).
+    Paginate with `limit` (max 200) and the returned `next_cursor`.
+    """
+    store = analysis_store.get_store()
+    if store is None:
+        return jsonify({"error": "Analysis store disabled (ANALYSIS_STORE_PATH is empty)"}), 503
+    args = request.args
+    color = args.get("color")
+    color_hex = normalize_hex(color) if color else None
+    if color and color_hex is None:
+        return jsonify({"error": f"Invalid color hex: {color}"}), 400
+    dress_type = args.get("dress_type")
+    fabric = args.get("fabric")
+    jewelry = [kind.strip() for kind in args.get("jewelry", "").split(",") if kind.strip()]
+    try:
+        limit = min(max(int(args.get("limit", 50)), 1), 200)
+        items, next_cursor = store.query(
+            dress_kind=dress_type and (analysis_store.kind_of(dress_type, analysis_store.DRESS_KINDS) or dress_type.lower()),
+            color_hex=color_hex,
+            fabric_kind=fabric and (analysis_store.kind_of(fabric, analysis_store.FABRIC_KINDS) or fabric.lower()),
+            jewelry=[analysis_store.kind_of(kind, analysis_store.JEWELRY_KINDS) or kind.lower() for kind in jewelry],
+            limit=limit,
+            cursor=args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": items, "next_cursor": next_cursor})
+
+
+@app.route("/api/analyses/<image_hash>", methods=["GET"])
+def api_analysis_get(image_hash):
+    """Full stored analysis for an image hash."""
+    store = analysis_store.get_store()
+    if store is None:
+        return jsonify({"error": "Analysis store disabled (ANALYSIS_STORE_PATH is empty)"}), 503
+    details = store.get(image_hash)
+    if details is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"success": True, "details": details, "image_hash": image_hash})
+
+
+@app.route("/api/colors/search", methods=["GET"])
+def api_color_search():
+    """Outfits whose extracted colors are perceptually closest to `hex`.
+
+    Optional: `k` (max 200, default 20), `max_delta_e`, and `role`
+    (comma-separated subset of primary, secondary, jewelry).
+    """
+    store = analysis_store.get_store()
+    if store is None:
+        return jsonify({"error": "Analysis store disabled (ANALYSIS_STORE_PATH is empty)"}), 503
+    args = request.args
+    hex_code = normalize_hex(args.get("hex"))
+    if hex_code is None:
+        return jsonify({"error": "Provide a color as ?hex=RRGGBB"}), 400
+    roles = tuple(role.strip() for role in args.get("role", "").split(",") if role.strip())
+    if any(role not in color_index.ROLES for role in roles):
+        return jsonify({"error": f"role must be one of {', '.join(color_index.ROLES)}"}), 400
+    try:
+        k = min(max(int(args.get("k", 20)), 1), 200)
+        max_delta_e = float(args.get("max_delta_e", "inf"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    matches = color_index.get_index(store).nearest(hex_code, k=k, max_delta_e=max_delta_e, roles=roles or None)
+    summaries = store.summaries([m["image_hash"] for m in matches])
+    items = [{**summaries.get(m["image_hash"], {}), "match": m} for m in matches]
+    return jsonify({"hex": hex_code, "items": items})
+
+
+@app.route("/api/similar", methods=["GET", "POST"])
+def api_similar():
+    """Stored outfits that look most like an uploaded `image` or a stored
+    `image_hash`, by visual descriptor similarity (1.0 = identical). `k` max 100."""
+    store = analysis_store.get_store()
+    index = visual_index.get_index(store)
+    if index is None:
+        return jsonify({"error": "Visual index disabled (ANALYSIS_STORE_PATH or VISUAL_INDEX_PATH is empty)"}), 503
+    try:
+        k = min(max(int(request.values.get("k", 10)), 1), 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if "image" in request.files:
+        image_bytes = request.files["image"].read()
+        key = analysis_store.image_hash(image_bytes)
+        try:
+            vec = visual_index.descriptor(image_bytes)
+        except Exception as e:
+            return jsonify({"error": f"Cannot read image: {e}"}), 400
+    elif request.values.get("image_hash"):
+        key = request.values["image_hash"]
+        vec = index.vector(key)
+        if vec is None:
+            return jsonify({"error": "Not found"}), 404
+    else:
+        return jsonify({"error": "Provide an image file or image_hash"}), 400
+    matches = index.search(vec, k=k, exclude=key)
+    summaries = store.summaries([match_hash for match_hash, _ in matches])
+    items = [{**summaries.get(match_hash, {"image_hash": match_hash}), "similarity": round(similarity, 4)}
+             for match_hash, similarity in matches]
+    return jsonify({"image_hash": key, "items": items})
+
+
 @app.route("/api/prompt-preview", methods=["POST"])
 def api_prompt_preview():
-    """Debug: Return the exact generation prompt that would be sent to the model."""
+    """Debug: Return the exact generation prompt that would be sent to the model.
+
+    Compacted to /api/generate's token budget, or to `?budget=N` when given.
+    """
     try:
         details_str = request.form.get("details") or request.get_json(silent=True, force=True)
         if isinstance(details_str, str):
@@ -900,19 +1611,25 @@ def api_prompt_preview():
         else:
             return jsonify({"error": "No details provided"}), 400
 
-        prompt = build_generation_prompt(details)
-        return jsonify({"success": True, "prompt": prompt})
+        with stage_timer("prompt_build"):
+            budget = request.args.get("budget", type=int)
+            if budget is None:
+                budget = prompt_budget.budget_for("api_generate")
+            prompt, budget_report = budgeted_generation_prompt(Analysis.from_dict(details), budget=budget)
+        return jsonify({"success": True, "prompt": prompt, "prompt_budget": budget_report,
+                        "template_version": prompt_templates.GENERATION.version})
 
     except Exception as e:
-        traceback.print_exc()
+        api_log.exception("Unhandled error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/generate", methods=["POST"])
 def api_generate():
     """Generate clothing transfer with agentic verification pipeline."""
-    if client is None:
+    if get_client() is None:
         return jsonify({"error": "GEMINI_API_KEY not configured on server"}), 503
+    deadline = _request_deadline()
     try:
         if "target_image" not in request.files:
             return jsonify({"error": "No target image provided"}), 400
@@ -923,7 +1640,10 @@ def api_generate():
         if not details_str:
             return jsonify({"error": "No details JSON provided"}), 400
 
-        details = json.loads(details_str)
+        try:
+            details = Analysis.from_dict(json.loads(details_str))
+        except ValueError:  # includes json.JSONDecodeError
+            return jsonify({"error": "Invalid details JSON"}), 400
         user_instructions = request.form.get("user_instructions", "")
 
         source_file = request.files["source_image"]
@@ -939,30 +1659,38 @@ def api_generate():
             source_bytes, source_mime,
             target_bytes, target_mime,
             details, user_instructions,
+            deadline=deadline,
+            refine_rounds=request.form.get("refine_rounds"),
         )
 
         image_bytes = result.get("image_bytes")
+        if deadline.cancelled:
+            return jsonify({"error": "Request cancelled by client", "cancelled": True}), 499
         if image_bytes is None:
             return jsonify({
                 "error": "Model did not return an image. " + (result.get("text") or ""),
                 "prompt": result.get("prompt", ""),
+                "skipped_stages": result.get("skipped_stages", []),
             }), 500
 
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-
-        return jsonify({
-            "success": True,
-            "image": image_b64,
-            "text": result.get("text"),
-            "prompt": result.get("prompt", ""),
-            "verification_score": result.get("verification_score", -1),
-            "corrections_applied": result.get("corrections_applied", []),
-        })
+        with stage_timer("encode"):
+            image_b64 = base64.b64encode(image_bytes).decode("utf-8")
+            payload = {
+                "success": True,
+                "image": image_b64,
+                "text": result.get("text"),
+                "prompt": result.get("prompt", ""),
+                "verification_score": result.get("verification_score", -1),
+                "corrections_applied": result.get("corrections_applied", []),
+                "skipped_stages": result.get("skipped_stages", []),
+            }
+            if _debug_requested():
+                payload["usage"] = usage.summarize(deadline.usage)
+                payload["prompt_budget"] = deadline.prompt_budget
+            return jsonify(payload)
 
-    except json.JSONDecodeError:
-        return jsonify({"error": "Invalid details JSON"}), 400
     except Exception as e:
-        traceback.print_exc()
+        api_log.exception("Unhandled error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/generate-direct", methods=["POST"])
@@ -970,27 +1698,44 @@ def api_generate_direct():
     """Direct clothing transfer or standalone dress reproduction.
     If target_image is provided: virtual try-on (dress on person).
     If target_image is NOT provided: standalone dress reproduction.
+    Instead of source_image, several `source_views` (see /api/analyze-views)
+    may be sent: they are analyzed and fused, and the most complete view is
+    the source image.
     """
-    if client is None:
+    if get_client() is None:
         return jsonify({"error": "GEMINI_API_KEY not configured on server"}), 503
+    deadline = _request_deadline()
     try:
-        if "source_image" not in request.files:
+        views = _read_views("source_views")
+        multi = None
+        if len(views) > multi_view.MULTI_VIEW_MAX:
+            return jsonify({"error": f"At most {multi_view.MULTI_VIEW_MAX} views per request"}), 400
+        if views:
+            multi = _analyze_views(views, deadline)
+            primary = views[multi["primary_view"]]
+            source_bytes, source_mime = primary["image_bytes"], primary["mime_type"]
+        elif "source_image" in request.files:
+            source_file = request.files["source_image"]
+            source_bytes = source_file.read()
+            source_mime = source_file.content_type or "image/jpeg"
+        else:
             return jsonify({"error": "No source image provided"}), 400
-
-        source_file = request.files["source_image"]
-        source_bytes = source_file.read()
-        source_mime = source_file.content_type or "image/jpeg"
         user_instructions = request.form.get("user_instructions", "")
+        candidates = best_of.candidates_for(request.form.get("candidates"))
 
         # Parse pre-analyzed JSON from frontend (if available)
         analysis_json = None
         analysis_json_str = request.form.get("analysis_json", "")
         if analysis_json_str:
             try:
-                analysis_json = json.loads(analysis_json_str)
-                print(f"[API] Using pre-analyzed JSON ({len(analysis_json)} fields)")
+                parsed = json.loads(analysis_json_str)
+                if parsed:
+                    analysis_json = Analysis.from_dict(parsed)
+                    api_log.info("Using pre-analyzed JSON (%d fields)", len(analysis_json.fields))
             except (json.JSONDecodeError, ValueError) as e:
-                print(f"[API] Failed to parse analysis_json: {e}")
+                api_log.warning("Failed to parse analysis_json: %s", e)
+        if analysis_json is None and multi is not None:
+            analysis_json = Analysis.from_dict(multi["details"])
 
         # Check if target image is provided
         if "target_image" in request.files:
@@ -1004,6 +1749,9 @@ def api_generate_direct():
                 target_bytes, target_mime,
                 user_instructions,
                 analysis_json=analysis_json,
+                deadline=deadline,
+                candidates=candidates,
+                refine_rounds=request.form.get("refine_rounds"),
             )
         else:
             # Standalone dress reproduction mode
@@ -1011,29 +1759,186 @@ def api_generate_direct():
                 source_bytes, source_mime,
                 user_instructions,
                 analysis_json=analysis_json,
+                deadline=deadline,
+                candidates=candidates,
             )
 
         image_bytes = result.get("image_bytes")
+        if deadline.cancelled:
+            return jsonify({"error": "Request cancelled by client", "cancelled": True}), 499
         if image_bytes is None:
             return jsonify({
                 "error": "Model did not return an image. " + (result.get("text") or ""),
+                "skipped_stages": result.get("skipped_stages", []),
             }), 500
 
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
+        with stage_timer("encode"):
+            image_b64 = base64.b64encode(image_bytes).decode("utf-8")
+            payload = {
+                "success": True,
+                "image": image_b64,
+                "text": result.get("text"),
+                "verification_score": result.get("verification_score", -1),
+                "corrections_applied": result.get("corrections_applied", []),
+                "skipped_stages": result.get("skipped_stages", []),
+            }
+            if "candidates" in result:
+                payload["candidates"] = result["candidates"]
+                payload["early_stopped"] = result["early_stopped"]
+            if multi is not None:
+                payload["primary_view"] = multi["primary_view"]
+                payload["views"] = multi["views"]
+            if _debug_requested():
+                payload["usage"] = usage.summarize(deadline.usage)
+                payload["prompt_budget"] = deadline.prompt_budget
+            return jsonify(payload)
+
+    except RequestCancelled as e:
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except DeadlineExceeded as e:  # multi-view analysis ran out of time
+        return jsonify({"error": str(e), "skipped_stages": deadline.skipped_stages}), 504
+    except Exception as e:
+        api_log.exception("Unhandled error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 
-        return jsonify({
-            "success": True,
-            "image": image_b64,
+@app.route("/api/cancel/<request_id>", methods=["POST"])
+def api_cancel(request_id):
+    """Cancel an in-flight analyze/generate request started with this request_id.
+
+    Only reaches requests running in this worker process — run gunicorn with
+    threads (see gunicorn.conf.py) so the cancel can be served while the
+    generation is still in progress.
+    """
+    found = cancel_request(request_id)
+    return jsonify({"success": True, "cancelled": found, "stats": CANCEL_STATS})
+
+
+# ---------------------------------------------------------------------------
+# Durable Jobs — analysis and generation that survive worker restarts
+# (see jobs.py). Inputs and finished stages live in the content store.
+# ---------------------------------------------------------------------------
+
+def _job_deadline(job: "jobs.Job") -> Deadline:
+    """Unbounded deadline registered under the job ID, so the heartbeat (or
+    /api/cancel/<job_id> on the same worker) can stop the job. A cancelled
+    job ends `cancelled` without a retry (see jobs.Worker)."""
+    job.deadline = Deadline(request_id=job.id)
+    return job.deadline
+
+
+def _job_analysis(job: "jobs.Job", image_bytes: bytes, deadline: Deadline) -> str:
+    """Content hash of the job's analysis, analyzing only if no attempt has yet."""
+    ref = job.payload.get("analysis") or job.stage("analysis")
+    if ref is None:
+        analysis = Analysis.from_dict(analyze_image(image_bytes, job.payload["source_mime"], deadline))
+        store = analysis_store.get_store()
+        if store is not None:
+            store.put(job.payload["source"], analysis, get_prompt("analysis").version)
+        ref = content_store.put_json(analysis.to_dict())
+        job.checkpoint("analysis", ref)
+    return ref
+
+
+@jobs.handler("analysis")
+def _run_analysis_job(job: "jobs.Job") -> dict:
+    deadline = _job_deadline(job)
+    return {"analysis": _job_analysis(job, content_store.get(job.payload["source"]), deadline)}
+
+
+@jobs.handler("generate")
+def _run_generate_job(job: "jobs.Job") -> dict:
+    """analysis -> generation (+ verification); each stage checkpointed."""
+    deadline = _job_deadline(job)
+    payload = job.payload
+    source_bytes = content_store.get(payload["source"])
+    analysis_ref = _job_analysis(job, source_bytes, deadline)
+    generated = job.stage("generation")
+    if generated is None:
+        analysis = Analysis.from_dict(content_store.get_json(analysis_ref))
+        if payload.get("target"):
+            result = generate_image_direct(
+                source_bytes, payload["source_mime"],
+                content_store.get(payload["target"]), payload["target_mime"],
+                payload.get("user_instructions", ""), analysis_json=analysis, deadline=deadline,
+            )
+        else:
+            result = generate_dress_standalone(
+                source_bytes, payload["source_mime"], payload.get("user_instructions", ""),
+                analysis_json=analysis, deadline=deadline,
+            )
+        if deadline.cancelled:
+            raise RequestCancelled(f"Job {job.id} stopped during generation")
+        if result.get("image_bytes") is None:
+            raise RuntimeError("Model did not return an image. " + (result.get("text") or ""))
+        generated = {
+            "image": content_store.put(result["image_bytes"]),
             "text": result.get("text"),
             "verification_score": result.get("verification_score", -1),
-            "corrections_applied": result.get("corrections_applied", []),
-        })
+        }
+        job.checkpoint("generation", generated)
+    return {"analysis": analysis_ref, **generated}
+
+
+@app.route("/api/jobs", methods=["POST"])
+def api_jobs_submit():
+    """Queue a durable job: `kind` = analysis (needs `source_image`) or
+    generate (`source_image`, optional `target_image`, `user_instructions`,
+    `analysis_json`). Poll GET /api/jobs/<job_id>; artifacts are served from
+    /api/content/<hash>."""
+    kind = request.form.get("kind", "generate")
+    if kind not in ("analysis", "generate"):
+        return jsonify({"error": "kind must be analysis or generate"}), 400
+    if "source_image" not in request.files:
+        return jsonify({"error": "No source image provided"}), 400
+    source_file = request.files["source_image"]
+    payload = {"source": content_store.put(source_file.read()), "source_mime": source_file.content_type or "image/jpeg"}
+    if kind == "generate":
+        if "target_image" in request.files:
+            target_file = request.files["target_image"]
+            payload["target"] = content_store.put(target_file.read())
+            payload["target_mime"] = target_file.content_type or "image/jpeg"
+        payload["user_instructions"] = request.form.get("user_instructions", "")
+        if request.form.get("analysis_json"):
+            try:
+                payload["analysis"] = content_store.put_json(
+                    Analysis.from_dict(json.loads(request.form["analysis_json"])).to_dict())
+            except (json.JSONDecodeError, ValueError) as e:
+                return jsonify({"error": f"Invalid analysis_json: {e}"}), 400
+    job_id = jobs.get_queue().enqueue(kind, payload)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
 
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_jobs_get(job_id):
+    job = jobs.get_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/content/<digest>", methods=["GET"])
+def api_content(digest):
+    """A content-store blob (job inputs, analyses, generated images)."""
+    try:
+        data = content_store.get(digest)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if data is None:
+        return jsonify({"error": "Not found"}), 404
+    return Response(data, mimetype=content_store.sniff_mime(data),
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+def start_job_workers():
+    """Start this process's JOB_WORKERS job threads. Called by the servers
+    (gunicorn.conf.py post_worker_init, `python app.py`), never on import, so
+    scripts and benchmarks that import app do not claim queued jobs."""
+    if _client_configured:
+        jobs.start_workers()
 
 
 if __name__ == "__main__":
+    start_job_workers()
     port = int(os.getenv("PORT", 5000))
     app.run(debug=False, host="0.0.0.0", port=port)
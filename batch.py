@@ -0,0 +1,264 @@
+# ---------------------------------------------------------------------------
+# Batch Runner — pushes a catalog of source/target pairs through the same
+# pipeline functions the API uses (analyze_image, generate_image_direct,
+# generate_dress_standalone), without Flask.
+#
+# Input is a manifest or a directory:
+#   items.csv / items.jsonl   columns/keys: id, source, target (optional),
+#                             user_instructions (optional); paths relative
+#                             to the manifest
+#   a directory               every image in it is a source; --target gives
+#                             one target person for all of them
+#
+# Items run on a thread or process pool, started no faster than --rate per
+# minute. Every finished item is appended to OUT/progress.jsonl, so an
+# interrupted run picks up where it stopped (failed items are retried);
+# outputs go to OUT/images/<id>.png and OUT/analysis/<id>.json, and
+# OUT/report.csv has per-item score, completeness, latency, tokens and cost.
+#
+#   python batch.py catalog.csv --out runs/spring --workers 8 --rate 60
+#   python batch.py photos/ --target model.jpg --out runs/flatlay --executor process
+# ---------------------------------------------------------------------------
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+STAGES = ("analysis", "generation", "verification")
+REPORT_FIELDS = (
+    "id", "status", "verification_score", "completeness", "wall_s",
+    *(f"{stage}_{key}" for stage in STAGES for key in ("latency_s", "input_tokens", "output_tokens")),
+    "cost_usd", "image", "error",
+)
+
+
+def _mime(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    return {".png": "image/png", ".webp": "image/webp"}.get(ext, "image/jpeg")
+
+
+def load_items(source: str, target: str = None) -> list[dict]:
+    """Items ({id, source, target, user_instructions}) from a manifest or directory."""
+    if os.path.isdir(source):
+        items = [{"id": os.path.splitext(name)[0], "source": os.path.join(source, name)}
+                 for name in sorted(os.listdir(source)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8", newline="") as f:
+            if source.endswith(".jsonl"):
+                items = [json.loads(line) for line in f if line.strip()]
+            else:
+                items = list(csv.DictReader(f))
+        for n, item in enumerate(items):
+            item["id"] = str(item.get("id") or n)
+            for role in ("source", "target"):
+                if item.get(role):
+                    item[role] = os.path.join(base, item[role])
+    for item in items:
+        if target and not item.get("target"):
+            item["target"] = target
+    ids = [item["id"] for item in items]
+    if len(set(ids)) != len(ids):
+        raise SystemExit("Item ids must be unique")
+    # Ids name the output files under --out.
+    for item_id in ids:
+        if item_id in ("", ".", "..") or any(sep in item_id for sep in ("/", "\\", os.sep)):
+            raise SystemExit(f"Item id {item_id!r} is not a valid file name")
+    return items
+
+
+def _init_worker():
+    """Import the pipeline once per worker process (the import is the slow part)."""
+    os.environ.setdefault("JOB_WORKERS", "0")
+    os.environ.setdefault("CLIENT_WARMUP", "0")
+    import app
+    if app.get_client() is None:
+        raise RuntimeError("No Gemini client: set GEMINI_API_KEY (or GEMINI_BACKEND=replay)")
+
+
+def run_item(item: dict, out: str, options: dict) -> dict:
+    """Analyze and generate one item; returns its report row."""
+    import app
+    from analysis_model import Analysis, completeness
+    from deadline import Deadline
+    from prompts import reset_variant, use_variant
+
+    token = use_variant(options["variant"]) if options["variant"] else None
+    deadline = Deadline(options["budget"])
+    row = {"id": item["id"], "status": "ok", "error": None}
+    started = time.perf_counter()
+    try:
+        with open(item["source"], "rb") as f:
+            source_bytes = f.read()
+        source_mime = _mime(item["source"])
+        analysis = Analysis.from_dict(app.analyze_image(source_bytes, source_mime, deadline))
+        row["completeness"] = completeness(analysis)
+        _write(os.path.join(out, "analysis", f"{item['id']}.json"),
+               json.dumps(analysis.to_dict(), ensure_ascii=False, indent=2).encode("utf-8"))
+        if not options["analyze_only"]:
+            instructions = item.get("user_instructions") or options["instructions"]
+            if item.get("target"):
+                with open(item["target"], "rb") as f:
+                    target_bytes = f.read()
+                result = app.generate_image_direct(source_bytes, source_mime, target_bytes, _mime(item["target"]),
+                                                   instructions, analysis_json=analysis, deadline=deadline)
+            else:
+                result = app.generate_dress_standalone(source_bytes, source_mime, instructions,
+                                                       analysis_json=analysis, deadline=deadline)
+            row["verification_score"] = result.get("verification_score", -1)
+            if result.get("image_bytes") is None:
+                row["status"] = "failed"
+                row["error"] = "No image: " + (result.get("text") or "")[:200]
+            else:
+                row["image"] = os.path.join("images", f"{item['id']}.png")
+                _write(os.path.join(out, row["image"]), result["image_bytes"])
+    except Exception as e:
+        row["status"] = "failed"
+        row["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if token is not None:
+            reset_variant(token)
+    row["wall_s"] = round(time.perf_counter() - started, 3)
+    cost = 0.0
+    for rec in deadline.usage:
+        stage = rec["stage"].split("_")[0]
+        if stage in STAGES:
+            row[f"{stage}_latency_s"] = round(row.get(f"{stage}_latency_s", 0.0) + rec.get("latency_s", 0.0), 3)
+            for key in ("input_tokens", "output_tokens"):
+                row[f"{stage}_{key}"] = row.get(f"{stage}_{key}", 0) + rec[key]
+        cost += rec["cost_usd"]
+    row["cost_usd"] = round(cost, 6)
+    return row
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load_progress(path: str) -> dict:
+    """id -> latest report row from a previous run."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    done[row["id"]] = row
+    return done
+
+
+class RateLimiter:
+    """Allows `per_minute` starts per minute, evenly spaced (0 = unlimited)."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def write_report(path: str, rows: list[dict]):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="manifest (.csv/.jsonl) or directory of source images")
+    parser.add_argument("--out", required=True, help="output directory (also holds progress.jsonl)")
+    parser.add_argument("--target", help="target person image for items without one")
+    parser.add_argument("--instructions", default="", help="user instructions for items without their own")
+    parser.add_argument("--analyze-only", action="store_true", help="stop after analysis")
+    parser.add_argument("--workers", type=int, default=4, help="items in flight")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread")
+    parser.add_argument("--rate", type=float, default=0, help="max item starts per minute (0 = unlimited)")
+    parser.add_argument("--budget", type=float, default=None, help="per-item time budget in seconds (default none)")
+    parser.add_argument("--prompt-variant", default="", help="prompt variant for analysis/verification/extraction")
+    parser.add_argument("--limit", type=int, default=0, help="process at most this many pending items")
+    args = parser.parse_args()
+
+    items = load_items(args.input, args.target)
+    os.makedirs(args.out, exist_ok=True)
+    progress_path = os.path.join(args.out, "progress.jsonl")
+    previous = load_progress(progress_path)
+    pending = [item for item in items if previous.get(item["id"], {}).get("status") != "ok"]
+    if args.limit:
+        pending = pending[:args.limit]
+    already = sum(1 for item in items if previous.get(item["id"], {}).get("status") == "ok")
+    print(f"{len(items)} items, {already} already done, running {len(pending)} with {args.workers} {args.executor}(s)")
+
+    options = {"budget": args.budget, "instructions": args.instructions, "analyze_only": args.analyze_only,
+               "variant": args.prompt_variant}
+    if args.executor == "process":
+        pool = ProcessPoolExecutor(args.workers, initializer=_init_worker)
+    else:
+        try:
+            _init_worker()
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        pool = ThreadPoolExecutor(args.workers, thread_name_prefix="batch")
+    limiter = RateLimiter(args.rate)
+    started = time.monotonic()
+    finished = 0
+    in_flight = {}
+    queue = list(reversed(pending))
+    try:
+        with open(progress_path, "a", encoding="utf-8") as progress:
+            while queue or in_flight:
+                while queue and len(in_flight) < args.workers:
+                    limiter.wait()
+                    item = queue.pop()
+                    in_flight[pool.submit(run_item, item, args.out, options)] = item
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = in_flight.pop(future)
+                    try:
+                        row = future.result()
+                    except Exception as e:
+                        row = {"id": item["id"], "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                    previous[row["id"]] = row
+                    progress.write(json.dumps(row) + "\n")
+                    progress.flush()
+                    finished += 1
+                    print(f"  [{finished}/{len(pending)}] {row['id']:<24} {row['status']:<6} "
+                          f"score {row.get('verification_score', '-')} {row.get('wall_s', '-')}s"
+                          + (f"  {row['error']}" if row.get("error") else ""), flush=True)
+    except KeyboardInterrupt:
+        print("Interrupted — finished items are saved; rerun the same command to resume.", flush=True)
+        # Do not wait for the items still running (minutes of model calls):
+        # drop the queued ones and exit without the executor's exit-time join.
+        pool.shutdown(wait=False, cancel_futures=True)
+        os._exit(130)
+    pool.shutdown()
+
+    rows = [previous[item["id"]] for item in items if item["id"] in previous]
+    write_report(os.path.join(args.out, "report.csv"), rows)
+    ok = sum(1 for row in rows if row["status"] == "ok")
+    print(f"\n{ok}/{len(items)} ok in {time.monotonic() - started:.1f}s — report: {os.path.join(args.out, 'report.csv')}")
+    sys.exit(0 if ok == len(items) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Cold-start benchmark — how long a fresh process takes before it can serve.
+
+Measures, in new processes:
+  1. `python -X importtime -c "import app"` — total import time of app.py and
+     the heaviest modules it pulls in.
+  2. Time-to-first-byte — spawn the server and poll /healthz (process can
+     accept traffic) and /readyz (Gemini client built) until they answer.
+
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/cold_start.py --runs 5
+    python benchmarks/cold_start.py --compare benchmarks/results/cold_start-<sha>.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def _env(**extra) -> dict:
+    env = dict(os.environ)
+    # The key only has to be present; no request is sent to Gemini.
+    env.setdefault("GEMINI_API_KEY", "cold-start-benchmark")
+    # Never claim jobs queued in the real data/jobs.sqlite3.
+    env["JOB_WORKERS"] = "0"
+    env.update(extra)
+    return env
+
+
+def _git_sha() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_importtime(warmup: bool) -> dict:
+    """Run one `-X importtime` import of app.py and parse the report."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=_env(CLIENT_WARMUP="1" if warmup else "0"),
+        capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    app_entry = next(m for m in modules if m["module"] == "app")
+    heaviest = sorted((m for m in modules if m["module"] != "app"),
+                      key=lambda m: m["cumulative_ms"], reverse=True)[:15]
+    return {"app_import_ms": app_entry["cumulative_ms"], "heaviest": heaviest}
+
+
+def _wait_for(url: str, deadline: float) -> float | None:
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return time.monotonic()
+        except urllib.error.HTTPError:
+            pass  # 503 from /readyz while warming up
+        except OSError:
+            pass  # not listening yet
+        time.sleep(0.01)
+    return None
+
+
+def measure_ttfb(server: str, timeout: float) -> dict:
+    """Spawn a cold server and time /healthz and /readyz."""
+    port = _free_port()
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+               "--workers", "1", "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=_env(PORT=str(port)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        healthy = _wait_for(f"{base}/healthz", started + timeout)
+        ready = _wait_for(f"{base}/readyz", started + timeout)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {
+        "healthz_ms": None if healthy is None else (healthy - started) * 1000,
+        "readyz_ms": None if ready is None else (ready - started) * 1000,
+    }
+
+
+def _summary(values: list) -> dict:
+    values = [v for v in values if v is not None]
+    if not values:
+        return {"median": None, "min": None, "max": None}
+    return {"median": statistics.median(values), "min": min(values), "max": max(values)}
+
+
+def run(runs: int, server: str, timeout: float) -> dict:
+    imports = [measure_importtime(warmup=False) for _ in range(runs)]
+    ttfb = [measure_ttfb(server, timeout) for _ in range(runs)]
+    return {
+        "benchmark": "cold_start",
+        "commit": _git_sha(),
+        "python": sys.version.split()[0],
+        "server": server,
+        "runs": runs,
+        "app_import_ms": _summary([r["app_import_ms"] for r in imports]),
+        "healthz_ms": _summary([r["healthz_ms"] for r in ttfb]),
+        "readyz_ms": _summary([r["readyz_ms"] for r in ttfb]),
+        "heaviest_imports": imports[-1]["heaviest"],
+    }
+
+
+def _print_report(result: dict, baseline: dict = None):
+    print(f"Cold start @ {result['commit']} ({result['server']}, {result['runs']} runs)")
+    for key in ("app_import_ms", "healthz_ms", "readyz_ms"):
+        median = result[key]["median"]
+        line = f"  {key:<15} {median:8.1f} ms" if median is not None else f"  {key:<15}   timeout"
+        if baseline and baseline.get(key, {}).get("median") and median is not None:
+            base = baseline[key]["median"]
+            line += f"   (baseline {base:.1f} ms, {100 * (median - base) / base:+.1f}%)"
+        print(line)
+    print("  heaviest imports (cumulative):")
+    for m in result["heaviest_imports"][:8]:
+        print(f"    {m['cumulative_ms']:8.1f} ms  {m['module']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the server")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/cold_start-<sha>.json)")
+    parser.add_argument("--compare", help="Previous result JSON to compare against")
+    args = parser.parse_args()
+
+    result = run(args.runs, args.server, args.timeout)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_report(result, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"cold_start-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Fake Gemini API server for load tests — speaks just enough of the REST
+`models/{model}:generateContent` and `:countTokens` endpoints for
+google-genai clients pointed at it with GEMINI_BASE_URL.
+
+Latency is drawn per call from a distribution:
+    fixed:SECONDS | uniform:LOW:HIGH | lognormal:MEDIAN:SIGMA
+
+    python benchmarks/fake_gemini.py --port 8765 --text-latency lognormal:6:0.3 \\
+        --image-latency lognormal:15:0.3 --error-rate 0.05 --image-size 1024x1024
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS = {
+    "dress_type": "Lehenga choli",
+    "primary_color": "Deep maroon (#800000)",
+    "primary_color_hex": "#800000",
+    "secondary_colors": [{"name": "Antique gold", "hex": "#D4AF37", "location": "border"}],
+    "fabric": "Raw silk",
+    "neckline": "Sweetheart",
+    "sleeves": "Elbow-length",
+    "embroidery": "Dense zardozi on the border and blouse",
+    "jewelry_pieces": [
+        {"type": "Necklace", "material_color_hex": "#D4AF37", "stones": "Kundan with green drops"},
+        {"type": "Earrings", "material_color_hex": "#D4AF37", "stones": "Kundan jhumkas"},
+    ],
+    "dress_reproduction_checklist": ["1. Maroon base", "2. Gold zardozi border", "3. Sweetheart neckline"],
+}
+VERIFICATION = {
+    "match_score": 88,
+    "overall_assessment": "Close match",
+    "differences": [{"feature": "border", "severity": "MINOR", "fix_instruction": "Widen the gold border"}],
+}
+# Answer to the targeted analysis follow-up (analysis_followup.py).
+FOLLOWUP = {
+    "embroidery": "Dense gold zardozi jaal on the blouse; scattered buttis on the skirt; 4-inch zardozi border",
+    "border_design": "Wide antique-gold (#D4AF37) zardozi border with scalloped edge",
+    "embellishments": "Sequins and small mirrors along the border and the blouse hem",
+    "jewelry_pieces": [{"type": "Necklace", "design_pattern": "Layered kundan choker with green drops",
+                        "dimensions": "4 cm wide choker"}],
+}
+# Answer to a full-resolution crop's detail prompt (tiling.py).
+TILE = {
+    "embroidery": "Zari paisley motifs about 3 cm tall, tightly packed, gold (#D4AF37) and copper (#B87333) thread",
+    "jewelry_pieces": [{"type": "Necklace", "stones": "11 emerald-green (#50C878) drops under 5 kundan stones"}],
+}
+EXTRACTION = "Deep maroon raw-silk lehenga with a wide antique-gold zardozi border. " * 20
+OVERLOADED = {"error": {"code": 503, "message": "The model is overloaded. Please try again later.",
+                        "status": "UNAVAILABLE"}}
+
+
+def parse_distribution(spec: str):
+    """'lognormal:6:0.3' -> callable returning a latency in seconds."""
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: params[0]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def make_image(size: str) -> str:
+    """Base64 PNG of random noise (incompressible, like a detailed photo)."""
+    from PIL import Image
+
+    width, height = (int(v) for v in size.lower().split("x"))
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buf, "PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class FakeGemini:
+    def __init__(self, text_latency: str, image_latency: str, error_rate: float, image_size: str):
+        self.text_latency = parse_distribution(text_latency)
+        self.image_latency = parse_distribution(image_latency)
+        self.error_rate = error_rate
+        self.image_b64 = make_image(image_size)
+        self.stats = {"calls": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self._lock = threading.Lock()
+
+    def respond(self, model: str, body: dict) -> tuple[int, dict]:
+        is_image = "image" in model
+        texts = [p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", [])]
+        system = " ".join(p.get("text", "") for p in (body.get("systemInstruction") or {}).get("parts", []))
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            time.sleep((self.image_latency if is_image else self.text_latency)())
+            if random.random() < self.error_rate:
+                with self._lock:
+                    self.stats["errors"] += 1
+                return 503, OVERLOADED
+            if is_image:
+                parts = [{"text": "Here is the image."},
+                         {"inlineData": {"mimeType": "image/png", "data": self.image_b64}}]
+            elif any("match_score" in t for t in texts):
+                parts = [{"text": json.dumps(VERIFICATION)}]
+            elif any("came back missing or too vague" in t for t in texts):
+                parts = [{"text": json.dumps(FOLLOWUP)}]
+            elif any("full-resolution crop" in t for t in texts):
+                parts = [{"text": json.dumps(TILE)}]
+            elif "fashion analyst" in system:
+                parts = [{"text": EXTRACTION}]
+            else:
+                parts = [{"text": json.dumps(ANALYSIS)}]
+            prompt_tokens = sum(len(t) for t in texts) // 4 + 258 * sum(
+                1 for c in body.get("contents", []) for p in c.get("parts", []) if "inlineData" in p)
+            output_tokens = 1290 if is_image else sum(len(p.get("text", "")) for p in parts) // 4
+            return 200, {
+                "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                                  "totalTokenCount": prompt_tokens + output_tokens},
+                "modelVersion": model,
+            }
+        finally:
+            with self._lock:
+                self.stats["in_flight"] -= 1
+
+
+def make_handler(fake: FakeGemini):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload: dict):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if ":countTokens" in self.path:  # PROMPT_TOKEN_COUNTER=api
+                texts = [p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", [])]
+                return self._send(200, {"totalTokens": sum(len(t) for t in texts) // 4})
+            if ":generateContent" not in self.path:
+                return self._send(404, {"error": {"code": 404, "message": self.path, "status": "NOT_FOUND"}})
+            model = self.path.split("/models/")[-1].split(":")[0]
+            self._send(*fake.respond(model, body))
+
+        def do_GET(self):
+            self._send(200, fake.stats)  # /stats for the load test
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--text-latency", default="lognormal:6:0.3", help="analysis/verification/extraction calls")
+    parser.add_argument("--image-latency", default="lognormal:15:0.3", help="image generation calls")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 503")
+    parser.add_argument("--image-size", default="1024x1024", help="generated image WIDTHxHEIGHT")
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.text_latency, args.image_latency, args.error_rate, args.image_size)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"Fake Gemini listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Fake Redis server for load tests and local runs of the shared cache —
+speaks just enough RESP2 for shared_cache.RedisCache (PING, GET, SET with
+PX/NX, DEL, SADD, SMEMBERS, HINCRBY, HGETALL, SELECT, AUTH, and EVAL of the
+lock-release script only). Data lives in memory; keys with a PX expiry are
+dropped on access.
+
+    python benchmarks/fake_redis.py --port 6399
+    SHARED_CACHE_URL=redis://127.0.0.1:6399 gunicorn app:app
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+
+class Store:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires < time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def execute(self, args: list[bytes]):
+        cmd = args[0].upper().decode()
+        with self.lock:
+            if cmd in ("PING", "SELECT", "AUTH"):
+                return "+PONG" if cmd == "PING" else "+OK"
+            if cmd == "GET":
+                value = self._live(args[1])
+                return value if isinstance(value, bytes) or value is None else "-WRONGTYPE"
+            if cmd == "SET":
+                key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+                if b"NX" in options and self._live(key) is not None:
+                    return None
+                self.data[key] = value
+                self.expires.pop(key, None)
+                if b"PX" in options:
+                    self.expires[key] = time.monotonic() + int(args[3 + options.index(b"PX") + 1]) / 1000
+                return "+OK"
+            if cmd == "DEL":
+                removed = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+                return removed
+            if cmd == "EVAL":
+                # Only RedisCache's compare-and-delete unlock: EVAL script 1 key owner
+                key, owner = args[3], args[4]
+                if self._live(key) == owner:
+                    del self.data[key]
+                    return 1
+                return 0
+            if cmd == "SADD":
+                members = self.data.setdefault(args[1], set())
+                before = len(members)
+                members.update(args[2:])
+                return len(members) - before
+            if cmd == "SMEMBERS":
+                return sorted(self._live(args[1]) or ())
+            if cmd == "HINCRBY":
+                fields = self.data.setdefault(args[1], {})
+                fields[args[2]] = fields.get(args[2], 0) + int(args[3])
+                return fields[args[2]]
+            if cmd == "HGETALL":
+                out = []
+                for field, value in (self._live(args[1]) or {}).items():
+                    out += [field, str(value).encode()]
+                return out
+        return f"-ERR unknown command '{cmd}'"
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return reply.encode() + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+def make_handler(store: Store):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(size + 2)[:-2])
+                self.wfile.write(encode(store.execute(args)))
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", args.port), make_handler(Store()))
+    server.daemon_threads = True
+    print(f"Fake Redis listening on redis://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
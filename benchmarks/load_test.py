@@ -0,0 +1,358 @@
+"""
+Load test — how many concurrent try-ons one instance sustains.
+
+Starts benchmarks/fake_gemini.py and the app under gunicorn (pointed at the
+fake with GEMINI_BASE_URL), then drives /api/analyze and /api/generate-direct
+with a closed loop of N concurrent clients per step and reports throughput,
+p50/p95/p99 latency, worker CPU utilization, request-slot occupancy and
+peak RSS. Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/load_test.py --concurrency 1,4,8 --duration 30
+    python benchmarks/load_test.py --error-rate 0.1 --image-latency lognormal:20:0.4
+    python benchmarks/load_test.py --compare benchmarks/results/load-<sha>.json
+
+Worker CPU and RSS are read from /proc (Linux only). Slot occupancy is the
+server-side request time from /metrics divided by workers × threads × wall
+time; it is only reported for single-worker runs, since each scrape reaches
+one worker.
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+
+from cold_start import RESULTS_DIR, ROOT, _free_port, _git_sha, _wait_for
+from fake_gemini import ANALYSIS
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _upload_image(size: str) -> bytes:
+    """A photo-sized JPEG upload (noise, so it does not compress away)."""
+    from PIL import Image
+
+    width, height = (int(v) for v in size.lower().split("x"))
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _multipart(fields: dict, files: dict) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, value in fields.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+        out.write(value.encode("utf-8") + b"\r\n")
+    for name, data in files.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.jpg"\r\n'
+                  f"Content-Type: image/jpeg\r\n\r\n".encode())
+        out.write(data + b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
+    return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def _scenarios(upload: bytes) -> dict:
+    analysis = json.dumps(ANALYSIS)
+    return {
+        "analyze": ("/api/analyze", lambda: _multipart({}, {"image": upload})),
+        "generate-direct": ("/api/generate-direct", lambda: _multipart(
+            {"analysis_json": analysis}, {"source_image": upload, "target_image": upload})),
+    }
+
+
+def _post(url: str, body: bytes, content_type: str, timeout: float) -> tuple[int, float]:
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError:
+        status = 0  # connection error / client timeout
+    return status, time.perf_counter() - started
+
+
+# ---------------------------------------------------------------------------
+# Process stats (Linux /proc)
+# ---------------------------------------------------------------------------
+
+def _children(pid: int) -> list[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def _cpu_seconds(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    except OSError:
+        return 0.0
+
+
+def _memory_mb(pid: int, key: str) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _metric_sum(base: str, route: str) -> float | None:
+    try:
+        with urllib.request.urlopen(f"{base}/metrics", timeout=5) as resp:
+            text = resp.read().decode("utf-8")
+    except OSError:
+        return None
+    pattern = re.compile(r'^tryon_request_duration_seconds_sum\{route="%s",status="\d+"\} (\S+)$' % route, re.M)
+    return sum(float(v) for v in pattern.findall(text))
+
+
+class _Sampler(threading.Thread):
+    """Tracks the peak total RSS of the gunicorn workers while a step runs."""
+
+    def __init__(self, pids: list[int]):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.peak_total_mb = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(0.5):
+            total = sum(_memory_mb(pid, "VmRSS") for pid in self.pids)
+            self.peak_total_mb = max(self.peak_total_mb, total)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# ---------------------------------------------------------------------------
+# Servers
+# ---------------------------------------------------------------------------
+
+def start_servers(args) -> tuple[list, str, int]:
+    fake_port, app_port = _free_port(), _free_port()
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "fake_gemini.py"), "--port", str(fake_port),
+         "--text-latency", args.text_latency, "--image-latency", args.image_latency,
+         "--error-rate", str(args.error_rate), "--image-size", args.image_size],
+        stdout=subprocess.DEVNULL,
+    )
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": "load-test",
+        "GEMINI_BACKEND": "live",
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{fake_port}",
+        "WEB_CONCURRENCY": str(args.workers),
+        "GUNICORN_THREADS": str(args.threads),
+        "REQUEST_BUDGET_SECONDS": str(args.budget),
+        "LOG_LEVEL": "WARNING",
+        "USAGE_LEDGER_PATH": "",
+        # Every call should reach the fake model, not a store or cache hit.
+        "ANALYSIS_STORE_PATH": "",
+        "SHARED_CACHE_URL": "",
+        # Never claim jobs queued in the real data/jobs.sqlite3.
+        "JOB_WORKERS": "0",
+    })
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{app_port}"]
+    if args.worker_class:
+        cmd += ["--worker-class", args.worker_class]
+    app = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                           stderr=None if args.verbose else subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{app_port}"
+    if _wait_for(f"{base}/readyz", time.monotonic() + 60) is None:
+        stop_servers([fake, app])
+        raise SystemExit("App did not become ready within 60s")
+    return [fake, app], base, fake_port
+
+
+def stop_servers(procs: list):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.wait(timeout=15)
+
+
+# ---------------------------------------------------------------------------
+# Load steps
+# ---------------------------------------------------------------------------
+
+def _percentile(sorted_values: list, pct: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_step(base: str, master_pid: int, scenario: tuple, name: str, concurrency: int,
+             duration: float, capacity: int, single_worker: bool, timeout: float) -> dict:
+    path, make_body = scenario
+    url = base + path
+    route = path.strip("/").replace("/", "_").replace("-", "_")
+    results = []
+    results_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < stop_at:
+            body, content_type = make_body()
+            status, seconds = _post(url, body, content_type, timeout)
+            with results_lock:
+                results.append((status, seconds))
+
+    workers = _children(master_pid)
+    cpu_before = sum(_cpu_seconds(pid) for pid in workers)
+    busy_before = _metric_sum(base, route) if single_worker else None
+    sampler = _Sampler(workers)
+    sampler.start()
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - started
+    sampler.stop()
+    cpu_after = sum(_cpu_seconds(pid) for pid in workers)
+    busy_after = _metric_sum(base, route) if single_worker else None
+
+    ok = sorted(seconds * 1000 for status, seconds in results if status == 200)
+    occupancy = None
+    if busy_before is not None and busy_after is not None:
+        occupancy = round(min(1.0, (busy_after - busy_before) / (wall * capacity)), 3)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": dict(Counter(str(status) for status, _ in results)),
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 3),
+        "latency_ms": {
+            "p50": _percentile(ok, 50),
+            "p95": _percentile(ok, 95),
+            "p99": _percentile(ok, 99),
+            "mean": sum(ok) / len(ok) if ok else None,
+            "max": ok[-1] if ok else None,
+        },
+        "worker_cpu_utilization": round((cpu_after - cpu_before) / (wall * max(1, len(workers))), 3),
+        "slot_occupancy": occupancy,
+        "peak_worker_rss_mb": round(max((_memory_mb(pid, "VmHWM") for pid in workers), default=0.0), 1),
+        "peak_total_rss_mb": round(sampler.peak_total_mb, 1),
+    }
+
+
+def _fmt(value, spec: str = ".0f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def _print_step(step: dict, baseline: dict = None):
+    lat = step["latency_ms"]
+    line = (f"  {step['scenario']:<16} c={step['concurrency']:<3} {step['ok']:>5}/{step['requests']:<5} ok "
+            f"{step['throughput_rps']:>7.2f} rps  p50 {_fmt(lat['p50']):>6}  p95 {_fmt(lat['p95']):>6}  "
+            f"p99 {_fmt(lat['p99']):>6} ms  cpu {step['worker_cpu_utilization']:>5.0%}  "
+            f"slots {_fmt(step['slot_occupancy'], '.0%'):>4}  rss {step['peak_worker_rss_mb']:.0f} MB")
+    if baseline:
+        before = next((b for b in baseline.get("steps", []) if b["scenario"] == step["scenario"]
+                       and b["concurrency"] == step["concurrency"]), None)
+        if before and before["throughput_rps"] and before["latency_ms"]["p95"] and lat["p95"]:
+            line += (f"  (rps {100 * (step['throughput_rps'] - before['throughput_rps']) / before['throughput_rps']:+.0f}%,"
+                     f" p95 {100 * (lat['p95'] - before['latency_ms']['p95']) / before['latency_ms']['p95']:+.0f}%)")
+    if set(step["statuses"]) - {"200"}:
+        line += f"  statuses {step['statuses']}"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="analyze,generate-direct")
+    parser.add_argument("--concurrency", default="1,4,8", help="comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per step")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--worker-class", help="gunicorn worker class (default from gunicorn.conf.py)")
+    parser.add_argument("--budget", type=float, default=30.0, help="REQUEST_BUDGET_SECONDS for the app")
+    parser.add_argument("--text-latency", default="lognormal:6:0.3")
+    parser.add_argument("--image-latency", default="lognormal:15:0.3")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", default="1024x1024", help="size of generated images")
+    parser.add_argument("--upload-size", default="768x1024", help="size of uploaded photos")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/load-<sha>.json)")
+    parser.add_argument("--compare", help="Previous result JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show gunicorn output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    scenarios = _scenarios(_upload_image(args.upload_size))
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    capacity = args.workers * args.threads
+    timeout = args.budget + 15
+
+    procs, base, fake_port = start_servers(args)
+    steps = []
+    try:
+        master_pid = procs[1].pid
+        print(f"Load test @ {_git_sha()}: {args.workers} worker(s) × {args.threads} thread(s), "
+              f"{args.duration:.0f}s per step", flush=True)
+        for name in names:
+            path, make_body = scenarios[name]
+            _post(base + path, *make_body(), timeout)  # warm up the route
+            for concurrency in levels:
+                step = run_step(base, master_pid, scenarios[name], name, concurrency, args.duration,
+                                capacity, args.workers == 1, timeout)
+                _print_step(step, baseline)
+                steps.append(step)
+        with urllib.request.urlopen(f"http://127.0.0.1:{fake_port}/stats", timeout=5) as resp:
+            fake_stats = json.load(resp)
+    finally:
+        stop_servers(procs)
+
+    result = {
+        "benchmark": "load",
+        "commit": _git_sha(),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "verbose")},
+        "steps": steps,
+        "fake_gemini": fake_stats,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
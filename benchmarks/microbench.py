@@ -0,0 +1,238 @@
+"""
+Microbenchmarks for the pure-Python helpers that run on every request:
+build_generation_prompt, _deep_merge, _parse_json_response,
+_extract_response_parts, _flatten_analysis_for_prompt and the analysis
+normalization (Analysis.from_dict). build_generation_prompt is measured on a
+raw dict (normalizing inside) and on an already-normalized Analysis, the
+way the routes call it; both hit the rendered-prompt memo after warm-up, so
+_render_generation_prompt gives the cost of a miss.
+
+Each helper runs on synthetic analysis JSON of increasing size (up to 50
+jewelry pieces and 100-item checklists). The report gives the best-of-7
+time per call and the tracemalloc peak for one call.
+
+    python benchmarks/microbench.py                   # check micro_thresholds.json
+    python benchmarks/microbench.py --compare benchmarks/results/micro-<sha>.json
+    python benchmarks/microbench.py --update-thresholds
+
+The exit status is 1 when a case exceeds its threshold in
+benchmarks/micro_thresholds.json, or regresses against the --compare
+baseline by more than --tolerance (time) or --memory-tolerance (peak).
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from cold_start import RESULTS_DIR, ROOT, _git_sha
+
+os.environ.setdefault("CLIENT_WARMUP", "0")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from analysis_model import Analysis  # noqa: E402
+from lazy_imports import LazyModule  # noqa: E402
+
+types = LazyModule("google.genai.types")
+
+THRESHOLDS_PATH = os.path.join(ROOT, "benchmarks", "micro_thresholds.json")
+
+# name -> (jewelry pieces, checklist items, words per free-text field)
+SIZES = {
+    "small": (2, 5, 12),
+    "medium": (8, 15, 25),
+    "large": (20, 40, 40),
+    "xlarge": (50, 100, 60),
+}
+
+_WORDS = ("zardozi", "gota", "patti", "maroon", "antique", "gold", "kundan", "emerald", "scalloped",
+          "border", "dense", "floral", "paisley", "mirror", "sequin", "thread", "silk", "organza")
+
+
+def _text(words: int, seed: int) -> str:
+    return " ".join(_WORDS[(seed + i * 7) % len(_WORDS)] for i in range(words))
+
+
+def synthetic_analysis(jewelry: int, checklist: int, words: int, variant: int = 0) -> dict:
+    """Analysis JSON shaped like VISION_PROMPT output."""
+    return {
+        "dress_type": "Lehenga choli with dupatta",
+        "primary_color": "Deep maroon (#800000)",
+        "primary_color_hex": "#800000",
+        "secondary_colors": [{"name": f"shade {i}", "hex": f"#{(i * 2654435) % 0xFFFFFF:06X}",
+                              "location": _text(4, i)} for i in range(max(2, jewelry // 4))],
+        "fabric": _text(words // 2, 1),
+        "neckline": _text(words // 3, 2),
+        "sleeves": _text(words // 3, 3),
+        "embroidery": _text(words + variant, 4),
+        "border_design": _text(words, 5),
+        "embellishments": _text(words, 6),
+        "latkan_tassels": _text(words // 2, 7),
+        "special_design_features": _text(words, 8),
+        "dupatta_draping": _text(words // 2, 9),
+        "dupatta_details": _text(words, 10),
+        "jewelry_pieces": [{
+            "type": f"Piece {i % (jewelry - variant) if variant else i}",
+            "design_pattern": _text(words // 2 + variant, i),
+            "material_color_hex": "#D4AF37",
+            "stones": _text(words // 3, i + 1),
+            "pearls": _text(6, i + 2),
+            "enamel_meenakari": "null",
+            "dangling_elements": _text(8, i + 3),
+            "dimensions": f"{3 + i % 5} cm",
+            "visual_weight": "heavy",
+            "description": _text(words, i + 4),
+        } for i in range(jewelry)],
+        "dress_reproduction_checklist": [f"{i + 1}. {_text(words // 3, i)}" for i in range(checklist)],
+        "jewelry_reproduction_checklist": [f"{i + 1}. {_text(words // 4, i + 5)}" for i in range(checklist // 2)],
+    }
+
+
+def _response(analysis: dict):
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[
+        types.Part(text=json.dumps(analysis)),
+        types.Part(inline_data=types.Blob(data=b"\x89PNG" + b"\0" * 1_500_000, mime_type="image/png")),
+    ]))])
+
+
+def cases(size: str) -> dict:
+    """name -> (fn, make_args). make_args() builds fresh inputs outside the timed region."""
+    jewelry, checklist, words = SIZES[size]
+    analysis = synthetic_analysis(jewelry, checklist, words)
+    updates = synthetic_analysis(jewelry, checklist, words, variant=1)
+    fenced = "```json\n" + json.dumps(analysis, indent=2) + "\n```"
+    response = _response(analysis)
+    # Pairs of a type the base lacks (earrings, bangles), the second piece of
+    # each pair richer than the first: the new piece is enriched in place.
+    pairs = {"jewelry_pieces": [{**piece, "type": f"Pair {i // 2}", "stones": piece["stones"] + " pair" * (i % 2)}
+                                for i, piece in enumerate(updates["jewelry_pieces"])]}
+    normalized = Analysis.from_dict(analysis)
+    return {
+        "Analysis.from_dict": (Analysis.from_dict, lambda: (analysis,)),
+        "build_generation_prompt": (app.build_generation_prompt, lambda: (analysis, "Make the dupatta longer")),
+        "build_generation_prompt (normalized)": (
+            app.build_generation_prompt, lambda: (normalized, "Make the dupatta longer")),
+        # Template render without the memo (a miss); the case above is a memo hit after warm-up.
+        "_render_generation_prompt": (app._render_generation_prompt, lambda: (normalized, "Make the dupatta longer")),
+        # _deep_merge copies what it changes and leaves its inputs alone.
+        "_deep_merge": (app._deep_merge, lambda: (analysis, updates)),
+        "_deep_merge (new pairs)": (app._deep_merge, lambda: (analysis, pairs)),
+        "_parse_json_response": (app._parse_json_response, lambda: (fenced,)),
+        "_extract_response_parts": (app._extract_response_parts, lambda: (response,)),
+        "_flatten_analysis_for_prompt": (app._flatten_analysis_for_prompt, lambda: (analysis,)),
+    }
+
+
+def _time_calls(fn, inputs: list) -> float:
+    gc.disable()  # like timeit: keep collector pauses out of the timing
+    try:
+        started = time.perf_counter()
+        for args in inputs:
+            fn(*args)
+        return time.perf_counter() - started
+    finally:
+        gc.enable()
+
+
+def measure(fn, make_args, repeats: int = 7, repeat_seconds: float = 0.05) -> dict:
+    """Best-of-`repeats` seconds per call, and the tracemalloc peak of one call."""
+    fn(*make_args())  # warm up
+    number = 1
+    while _time_calls(fn, [make_args() for _ in range(number)]) < repeat_seconds and number < 100_000:
+        number *= 2
+    best = min(_time_calls(fn, [make_args() for _ in range(number)]) / number for _ in range(repeats))
+
+    args = make_args()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"us": round(best * 1e6, 2), "peak_kib": round((peak - before) / 1024, 1), "calls": number * repeats}
+
+
+def run(sizes: list) -> dict:
+    results = {}
+    for size in sizes:
+        for name, (fn, make_args) in cases(size).items():
+            results.setdefault(name, {})[size] = measure(fn, make_args)
+    return results
+
+
+def check(results: dict, limits: dict, label: str, time_scale: float = 1.0, memory_scale: float = 1.0) -> list[str]:
+    """Cases whose time or peak memory exceeds `limits` × the matching scale."""
+    failures = []
+    for name, by_size in results.items():
+        for size, measured in by_size.items():
+            limit = limits.get(name, {}).get(size)
+            if not limit:
+                continue
+            for key, scale in (("us", time_scale), ("peak_kib", memory_scale)):
+                if limit.get(key) and measured[key] > limit[key] * scale:
+                    failures.append(f"{name}[{size}] {key} {measured[key]} > {label} {limit[key] * scale:.1f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(SIZES), help="comma-separated subset of " + ",".join(SIZES))
+    parser.add_argument("--compare", help="Previous result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed time regression vs --compare (timings on shared machines are noisy)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.1,
+                        help="allowed tracemalloc peak regression vs --compare")
+    parser.add_argument("--update-thresholds", action="store_true",
+                        help="rewrite micro_thresholds.json from this run (3x time, 1.5x memory)")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/micro-<sha>.json)")
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    results = run(sizes)
+
+    print(f"Microbenchmarks @ {_git_sha()}")
+    print(f"  {'function':<38} {'size':<7} {'µs/call':>10} {'peak KiB':>10}")
+    for name, by_size in results.items():
+        for size, m in by_size.items():
+            print(f"  {name:<38} {size:<7} {m['us']:>10.1f} {m['peak_kib']:>10.1f}")
+
+    result = {"benchmark": "micro", "commit": _git_sha(), "python": sys.version.split()[0], "results": results}
+    output = args.output or os.path.join(RESULTS_DIR, f"micro-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+
+    if args.update_thresholds:
+        thresholds = {name: {size: {"us": round(m["us"] * 3, 1), "peak_kib": round(m["peak_kib"] * 1.5 + 4, 1)}
+                             for size, m in by_size.items()} for name, by_size in results.items()}
+        with open(THRESHOLDS_PATH, "w", encoding="utf-8") as f:
+            json.dump(thresholds, f, indent=2)
+            f.write("\n")
+        print(f"Updated {THRESHOLDS_PATH}")
+        return
+
+    failures = []
+    if os.path.exists(THRESHOLDS_PATH):
+        with open(THRESHOLDS_PATH, encoding="utf-8") as f:
+            failures += check(results, json.load(f), "threshold")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            failures += check(results, json.load(f)["results"], "baseline",
+                              1 + args.tolerance, 1 + args.memory_tolerance)
+    if failures:
+        print("REGRESSIONS:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Prompt variant evaluation — runs every prompt variant in prompts.REGISTRY
+(full, compact) over a fixture set and reports, per variant, model latency
+and tokens for each stage, analysis JSON completeness and the verification
+score of the image generated from that analysis, so a cheaper variant can be
+shipped on data.
+
+Fixtures are source-outfit/target-person image pairs listed in a JSON file
+(default benchmarks/prompt_fixtures.json, paths relative to the repo root).
+Record them once against the live API, then evaluate offline from the
+recording (replayed with the recorded latency):
+
+    GEMINI_BACKEND=record GEMINI_API_KEY=... python benchmarks/prompt_eval.py
+    GEMINI_BACKEND=replay python benchmarks/prompt_eval.py
+    GEMINI_BACKEND=replay python benchmarks/prompt_eval.py --compare benchmarks/results/prompt-eval-<sha>.json
+
+Per fixture and variant: analyze_image -> generate_image_direct from that
+analysis (generation prompt built as in production, verification with the
+variant's prompt) -> _extract_outfit_details. Latency is the model-call time
+recorded on each usage record, so it excludes local work.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+from cold_start import RESULTS_DIR, ROOT, _git_sha
+
+os.environ.setdefault("CLIENT_WARMUP", "0")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("SHARED_CACHE_URL", "")
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from analysis_model import Analysis, completeness  # noqa: E402
+from deadline import Deadline  # noqa: E402
+from prompts import VARIANTS, get_prompt, reset_variant, use_variant  # noqa: E402
+
+DEFAULT_FIXTURES = os.path.join(ROOT, "benchmarks", "prompt_fixtures.json")
+STAGES = ("analysis", "generation", "verification", "extraction")
+
+
+def _mime(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def load_fixtures(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        fixtures = json.load(f)
+    for fixture in fixtures:
+        for role in ("source", "target"):
+            with open(os.path.join(ROOT, fixture[role]), "rb") as f:
+                fixture[f"{role}_bytes"] = f.read()
+            fixture[f"{role}_mime"] = _mime(fixture[f"{role}_bytes"])
+    return fixtures
+
+
+def run_one(fixture: dict, variant: str) -> dict:
+    """One fixture through every stage with `variant` prompts."""
+    token = use_variant(variant)
+    deadline = Deadline()
+    row = {"fixture": fixture["id"], "variant": variant, "error": None}
+    started = time.perf_counter()
+    try:
+        raw = app.analyze_image(fixture["source_bytes"], fixture["source_mime"], deadline)
+        analysis = Analysis.from_dict(raw)
+        row["completeness"] = completeness(analysis)
+        row["jewelry_pieces"] = len(analysis.jewelry)
+        result = app.generate_image_direct(
+            fixture["source_bytes"], fixture["source_mime"], fixture["target_bytes"], fixture["target_mime"],
+            analysis_json=analysis, deadline=deadline,
+        )
+        row["verification_score"] = result.get("verification_score", -1)
+        row["extraction_chars"] = len(app._extract_outfit_details(
+            fixture["source_bytes"], fixture["source_mime"], deadline))
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        reset_variant(token)
+        deadline.close()
+    row["wall_s"] = round(time.perf_counter() - started, 3)
+    stages = defaultdict(lambda: {"latency_s": 0.0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+    for rec in deadline.usage:
+        totals = stages[rec["stage"]]
+        totals["latency_s"] += rec.get("latency_s", 0.0)
+        for key in ("input_tokens", "output_tokens", "cost_usd"):
+            totals[key] += rec[key]
+    row["stages"] = dict(stages)
+    return row
+
+
+def aggregate(rows: list[dict]) -> dict:
+    """variant -> medians over fixtures and repeats."""
+    by_variant = defaultdict(list)
+    for row in rows:
+        by_variant[row["variant"]].append(row)
+    summary = {}
+    for variant, vrows in by_variant.items():
+        ok = [r for r in vrows if not r["error"]]
+        entry = {"runs": len(vrows), "errors": len(vrows) - len(ok)}
+        for key in ("completeness", "verification_score", "extraction_chars", "wall_s"):
+            values = [r[key] for r in ok if key in r]
+            entry[key] = round(statistics.median(values), 3) if values else None
+        for stage in STAGES:
+            for key in ("latency_s", "input_tokens", "output_tokens", "cost_usd"):
+                values = [r["stages"][stage][key] for r in ok if stage in r["stages"]]
+                entry[f"{stage}_{key}"] = round(statistics.median(values), 6) if values else None
+        entry["cost_usd"] = round(sum(entry[f"{s}_cost_usd"] or 0 for s in STAGES), 6)
+        summary[variant] = entry
+    return summary
+
+
+def _fmt(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(summary: dict, baseline: dict = None):
+    print(f"\n  {'variant':<9} {'complete':>8} {'score':>6} {'cost $':>8}  " +
+          "  ".join(f"{s[:5] + ' s':>7} {'in':>6} {'out':>6}" for s in STAGES))
+    for variant, e in summary.items():
+        cells = "  ".join(
+            f"{_fmt(e[f'{s}_latency_s'], '.2f'):>7} {_fmt(e[f'{s}_input_tokens'], '.0f'):>6} "
+            f"{_fmt(e[f'{s}_output_tokens'], '.0f'):>6}" for s in STAGES)
+        print(f"  {variant:<9} {_fmt(e['completeness'], '.3f'):>8} {_fmt(e['verification_score'], '.0f'):>6} "
+              f"{e['cost_usd']:>8.4f}  {cells}")
+        if e["errors"]:
+            print(f"  {'':<9} {e['errors']} of {e['runs']} runs failed")
+        base = (baseline or {}).get(variant)
+        if base:
+            deltas = []
+            for key in ("completeness", "verification_score", "cost_usd", "analysis_latency_s",
+                        "analysis_input_tokens"):
+                if base.get(key) is not None and e.get(key) is not None:
+                    deltas.append(f"{key} {e[key] - base[key]:+.3g}")
+            print(f"  {'':<9} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="fixture list JSON")
+    parser.add_argument("--variants", default=",".join(VARIANTS), help="comma-separated subset of " + ",".join(VARIANTS))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per fixture and variant")
+    parser.add_argument("--compare", help="previous prompt-eval result JSON")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/prompt-eval-<sha>.json)")
+    args = parser.parse_args()
+
+    if app.get_client() is None:
+        sys.exit("No Gemini client: set GEMINI_API_KEY (GEMINI_BACKEND=live/record) or GEMINI_BACKEND=replay")
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+    fixtures = load_fixtures(args.fixtures)
+    print(f"Prompt eval @ {_git_sha()} — {len(fixtures)} fixture(s), backend {app._backend}")
+    for variant in variants:
+        print(f"  {variant}: " + ", ".join(get_prompt(stage, variant).version
+                                          for stage in ("analysis", "verification", "extraction")))
+
+    rows = []
+    for _ in range(args.repeat):
+        for fixture in fixtures:
+            for variant in variants:
+                row = run_one(fixture, variant)
+                rows.append(row)
+                print(f"  {fixture['id']:<24} {variant:<8} score {row.get('verification_score', '-')} "
+                      f"complete {row.get('completeness', '-')} wall {row['wall_s']}s"
+                      + (f"  ERROR {row['error']}" if row["error"] else ""))
+
+    summary = aggregate(rows)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+    print_report(summary, baseline)
+
+    result = {
+        "benchmark": "prompt-eval", "commit": _git_sha(), "backend": app._backend,
+        "prompts": {v: {stage: get_prompt(stage, v).version for stage in ("analysis", "verification", "extraction")}
+                    for v in variants},
+        "summary": summary, "runs": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"prompt-eval-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
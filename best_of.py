@@ -0,0 +1,167 @@
+# ---------------------------------------------------------------------------
+# Best-of-N — optional parallel candidates for a generation, so a weak first
+# image does not cost the user another full round trip.
+#
+# N generations start at once, each with its own sampling variant
+# (temperature, optionally model). As each image arrives it gets a local
+# score right away (visual-descriptor similarity to the source outfit, a
+# few ms), which decides whether it is worth a verify_output call: at most
+# BEST_OF_VERIFY_TOP candidates are verified, and none scoring locally more
+# than BEST_OF_LOCAL_MARGIN below the best image so far. Verification starts
+# as soon as an image passes, so it overlaps with the generations still
+# running. The first candidate verified at or above the target score ends
+# the round: the other candidates are abandoned and the response goes out.
+# Otherwise the best candidate wins by verification score, then local
+# score. Wall-clock stays close to one generation plus one verification;
+# every candidate's token usage lands on the request.
+#
+# BEST_OF_N             candidates per generation by default (default 1 = off;
+#                       a request can ask for up to BEST_OF_MAX)
+# BEST_OF_MAX           cap on candidates per request (default 4)
+# BEST_OF_TARGET_SCORE  verification score that stops early (default 85)
+# BEST_OF_VERIFY_TOP    most candidates verified per generation (default 2)
+# BEST_OF_LOCAL_MARGIN  local-score gap below the best image so far at which
+#                       a candidate is not verified (default 0.05)
+# BEST_OF_VARIANTS      JSON list of {"temperature": t, "model": m} per
+#                       candidate slot; null/missing keys keep the pipeline's
+#                       own model and temperature
+# ---------------------------------------------------------------------------
+
+import contextvars
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import logs
+from deadline import Deadline
+from metrics import Counter
+
+BEST_OF_N = int(os.getenv("BEST_OF_N", "1"))
+BEST_OF_MAX = int(os.getenv("BEST_OF_MAX", "4"))
+BEST_OF_TARGET_SCORE = int(os.getenv("BEST_OF_TARGET_SCORE", "85"))
+BEST_OF_VERIFY_TOP = int(os.getenv("BEST_OF_VERIFY_TOP", "2"))
+BEST_OF_LOCAL_MARGIN = float(os.getenv("BEST_OF_LOCAL_MARGIN", "0.05"))
+
+# Slot 0 is the production configuration; the others sample more freely.
+DEFAULT_VARIANTS = ({}, {"temperature": 0.4}, {"temperature": 0.7}, {"temperature": 1.0})
+BEST_OF_VARIANTS = tuple(json.loads(os.getenv("BEST_OF_VARIANTS", "") or "null") or DEFAULT_VARIANTS)
+
+log = logs.get_logger("best_of")
+
+_POLL_SECONDS = 0.25
+
+CANDIDATES = Counter(
+    "tryon_best_of_candidates_total", "Best-of-N candidates, by outcome "
+    "(chosen/scored/filtered/no_image/failed/abandoned).", ("outcome",),
+)
+EARLY_STOPS = Counter("tryon_best_of_early_stops_total", "Best-of-N rounds that stopped at the target score.")
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BEST_OF_THREADS", "16")), thread_name_prefix="candidate")
+
+
+def candidates_for(requested) -> int:
+    """Candidates for a request asking for `requested` (None/'' = BEST_OF_N)."""
+    try:
+        n = int(requested) if requested not in (None, "") else BEST_OF_N
+    except (TypeError, ValueError):
+        n = BEST_OF_N
+    return max(1, min(n, BEST_OF_MAX))
+
+
+def _submit(fn, *args):
+    # Carry the request context (log request ID, prompt variant) into the worker.
+    return _executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def run(n: int, generate, verify, local_score, deadline: Deadline, target_score: int = None) -> dict:
+    """Generate `n` candidates in parallel and return the best.
+
+    generate(variant, deadline) -> (text, image_bytes or None)
+    verify(image_bytes, deadline) -> verification score (-1 if skipped)
+    local_score(image_bytes) -> float, higher is closer to the source
+
+    Returns the pipeline result dict (image_bytes, text, verification_score)
+    plus `candidates` (one summary per candidate) and `early_stopped`.
+    """
+    target_score = BEST_OF_TARGET_SCORE if target_score is None else target_score
+    children = [deadline.child() for _ in range(n)]
+    variants = [BEST_OF_VARIANTS[i % len(BEST_OF_VARIANTS)] for i in range(n)]
+    summaries = [{"index": i, **variants[i], "status": "running"} for i in range(n)]
+    generating = {_submit(generate, variants[i], children[i]): i for i in range(n)}
+    verifying = {}
+    scored = []
+    best_local = None
+    verified = 0
+    early_stopped = False
+
+    while generating or verifying:
+        done, _ = wait([*generating, *verifying], timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if deadline.cancelled:
+            break
+        for future in done:
+            if future in generating:
+                i = generating.pop(future)
+                try:
+                    text, image = future.result()
+                except Exception as e:
+                    log.warning("Candidate %d failed: %s", i, e, extra={"candidate": i})
+                    summaries[i]["status"] = "failed"
+                    summaries[i]["error"] = str(e)[:200]
+                    continue
+                if image is None:
+                    summaries[i]["status"] = "no_image"
+                    continue
+                candidate = {"index": i, "text": text, "image_bytes": image,
+                             "local_score": round(local_score(image), 4), "verification_score": -1}
+                summaries[i]["local_score"] = candidate["local_score"]
+                best_local = max(best_local or 0.0, candidate["local_score"])
+                # Local score first: only promising images get a verification call.
+                if verified >= BEST_OF_VERIFY_TOP or candidate["local_score"] < best_local - BEST_OF_LOCAL_MARGIN:
+                    summaries[i]["status"] = "filtered"
+                    scored.append(candidate)
+                    continue
+                verified += 1
+                summaries[i]["status"] = "verifying"
+                verifying[_submit(verify, image, children[i])] = candidate
+            else:
+                candidate = verifying.pop(future)
+                try:
+                    candidate["verification_score"] = future.result()
+                except Exception as e:
+                    log.warning("Verifying candidate %d failed: %s", candidate["index"], e)
+                summaries[candidate["index"]].update(status="scored",
+                                                     verification_score=candidate["verification_score"])
+                scored.append(candidate)
+                if candidate["verification_score"] >= target_score:
+                    early_stopped = True
+        if early_stopped:
+            break
+
+    # Whatever is still running is no longer needed.
+    for i in [*generating.values(), *(c["index"] for c in verifying.values())]:
+        children[i].abandon()
+        summaries[i]["status"] = "abandoned"
+    # Unverified images still count, ranked by their local score.
+    scored += verifying.values()
+    for child in children:
+        deadline.absorb(child)
+        deadline.skipped_stages.extend(s for s in child.skipped_stages
+                                       if s["reason"] not in ("cancelled", "abandoned"))
+    if early_stopped:
+        EARLY_STOPS.inc()
+
+    best = max(scored, key=lambda c: (c["verification_score"], c["local_score"])) if scored else None
+    if best is not None:
+        summaries[best["index"]]["status"] = "chosen"
+    for summary in summaries:
+        CANDIDATES.inc(outcome=summary["status"])
+    if best is None:
+        errors = [s.get("error") for s in summaries if s.get("error")]
+        return {"image_bytes": None, "text": errors[0] if errors else "No candidate returned an image",
+                "verification_score": -1, "candidates": summaries, "early_stopped": False}
+    log.info("Best of %d: candidate %d (score %s, local %.3f)%s", n, best["index"], best["verification_score"],
+             best["local_score"], " — stopped early" if early_stopped else "",
+             extra={"candidates": n, "chosen": best["index"], "score": best["verification_score"]})
+    return {"image_bytes": best["image_bytes"], "text": best["text"],
+            "verification_score": best["verification_score"], "candidates": summaries,
+            "early_stopped": early_stopped}
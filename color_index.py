@@ -0,0 +1,218 @@
+# ---------------------------------------------------------------------------
+# Color Index — nearest outfits by perceptual color distance.
+#
+# Every hex code an analysis extracts (primary color, secondary colors,
+# jewelry material colors) is converted to CIELAB (D65) and kept in memory in
+# a uniform voxel grid over Lab space. A query scans grid shells outward from
+# the query color and stops as soon as no unscanned cell can hold a closer
+# color, so a lookup touches a few cells instead of every color. Distance is
+# ΔE*ab (CIE76, Euclidean in Lab); ~2.3 is a just-noticeable difference.
+#
+# The colors themselves live in the analysis store (analysis_colors table).
+# Before each query the index pulls rows added since its last sync, so it
+# stays current incrementally — also across gunicorn workers.
+#
+# COLOR_INDEX_CELL  grid cell edge in ΔE units (default 4)
+#
+#   python color_index.py --bench 100000   # build/query timings on random colors
+# ---------------------------------------------------------------------------
+
+import math
+import os
+import threading
+
+import logs
+
+COLOR_INDEX_CELL = float(os.getenv("COLOR_INDEX_CELL", "4"))
+
+log = logs.get_logger("color_index")
+
+ROLES = ("primary", "secondary", "jewelry")
+
+# D65 reference white
+_XN, _YN, _ZN = 0.95047, 1.0, 1.08883
+
+
+def _linear(channel: int) -> float:
+    c = channel / 255.0
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+_LINEAR = tuple(_linear(i) for i in range(256))
+
+
+def _f(t: float) -> float:
+    return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
+
+
+def hex_to_lab(hex_code: str) -> tuple[float, float, float]:
+    """'#RRGGBB' (sRGB) -> (L*, a*, b*)."""
+    value = int(hex_code.lstrip("#"), 16)
+    r, g, b = _LINEAR[value >> 16], _LINEAR[(value >> 8) & 0xFF], _LINEAR[value & 0xFF]
+    fx = _f((0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / _XN)
+    fy = _f((0.2126729 * r + 0.7151522 * g + 0.0721750 * b) / _YN)
+    fz = _f((0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / _ZN)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def analysis_colors(analysis) -> list[tuple[str, str]]:
+    """(role, hex) for every normalized hex code in an Analysis."""
+    colors = []
+    if analysis.primary_color_hex:
+        colors.append(("primary", analysis.primary_color_hex))
+    colors += [("secondary", c.hex) for c in analysis.secondary_colors if c.hex]
+    colors += [("jewelry", p.material_color_hex) for p in analysis.jewelry if p.material_color_hex]
+    return colors
+
+
+class ColorIndex:
+    """Voxel grid over Lab with per-outfit nearest-neighbour search.
+
+    Entries are (L, a, b, image_hash, role, hex) tuples; `replace()` swaps
+    all colors of one outfit, so re-analyzed images do not leave stale
+    entries behind.
+    """
+
+    def __init__(self, cell: float = None):
+        self.cell = cell or COLOR_INDEX_CELL
+        self._cells = {}
+        self._by_hash = {}
+        self._bounds = None
+        self._lock = threading.RLock()
+        self.synced_id = 0
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._by_hash.values())
+
+    def _key(self, lab) -> tuple[int, int, int]:
+        return (math.floor(lab[0] / self.cell), math.floor(lab[1] / self.cell), math.floor(lab[2] / self.cell))
+
+    def replace(self, image_hash: str, colors: list[tuple[str, str]]):
+        """Set the colors of one outfit to `colors` ((role, hex) pairs)."""
+        with self._lock:
+            for key, entry in self._by_hash.pop(image_hash, ()):
+                bucket = self._cells[key]
+                bucket.remove(entry)
+                if not bucket:
+                    del self._cells[key]
+            placed = []
+            for role, hex_code in colors:
+                lab = hex_to_lab(hex_code)
+                entry = (*lab, image_hash, role, hex_code)
+                key = self._key(lab)
+                self._cells.setdefault(key, []).append(entry)
+                placed.append((key, entry))
+                if self._bounds is None:
+                    self._bounds = [list(key), list(key)]
+                else:
+                    lo, hi = self._bounds
+                    for axis in range(3):
+                        lo[axis] = min(lo[axis], key[axis])
+                        hi[axis] = max(hi[axis], key[axis])
+            if placed:
+                self._by_hash[image_hash] = placed
+
+    def nearest(self, hex_code: str, k: int = 20, max_delta_e: float = math.inf,
+                roles: tuple = None) -> list[dict]:
+        """Up to `k` outfits closest to `hex_code`, each with its closest
+        matching color, ordered by ΔE."""
+        lab = hex_to_lab(hex_code)
+        qi, qj, qk = self._key(lab)
+        best = {}
+        with self._lock:
+            if self._bounds is None:
+                return []
+            lo, hi = self._bounds
+            # Farthest shell that can still contain an occupied cell.
+            max_ring = max(qi - lo[0], hi[0] - qi, qj - lo[1], hi[1] - qj, qk - lo[2], hi[2] - qk)
+            ring = 0
+            while ring <= max_ring:
+                for key in self._shell(qi, qj, qk, ring, lo, hi):
+                    for entry in self._cells.get(key, ()):
+                        if roles and entry[4] not in roles:
+                            continue
+                        d = math.sqrt((entry[0] - lab[0]) ** 2 + (entry[1] - lab[1]) ** 2 + (entry[2] - lab[2]) ** 2)
+                        if d <= max_delta_e and (entry[3] not in best or d < best[entry[3]][0]):
+                            best[entry[3]] = (d, entry)
+                # Anything in a farther shell is at least ring * cell away.
+                reach = ring * self.cell
+                if reach > max_delta_e:
+                    break
+                if len(best) >= k and sorted(d for d, _ in best.values())[k - 1] <= reach:
+                    break
+                ring += 1
+        ranked = sorted(best.values(), key=lambda item: item[0])[:k]
+        return [{"image_hash": e[3], "delta_e": round(d, 2), "hex": e[5], "role": e[4]} for d, e in ranked]
+
+    @staticmethod
+    def _shell(qi, qj, qk, ring, lo, hi):
+        """Cells at Chebyshev distance `ring` from (qi, qj, qk), clipped to bounds."""
+        if ring == 0:
+            yield qi, qj, qk
+            return
+        for i in range(max(qi - ring, lo[0]), min(qi + ring, hi[0]) + 1):
+            edge_i = abs(i - qi) == ring
+            for j in range(max(qj - ring, lo[1]), min(qj + ring, hi[1]) + 1):
+                if edge_i or abs(j - qj) == ring:
+                    for k in range(max(qk - ring, lo[2]), min(qk + ring, hi[2]) + 1):
+                        yield i, j, k
+                else:
+                    if lo[2] <= qk - ring:
+                        yield i, j, qk - ring
+                    if qk + ring <= hi[2]:
+                        yield i, j, qk + ring
+
+    def sync(self, store):
+        """Pull colors stored since the last sync (all of them on first call)."""
+        with self._lock:
+            pending = {}
+            last_id = self.synced_id
+            for row_id, image_hash, role, hex_code in store.colors_since(self.synced_id):
+                pending.setdefault(image_hash, []).append((role, hex_code))
+                last_id = max(last_id, row_id)
+            for image_hash, colors in pending.items():
+                self.replace(image_hash, colors)
+            if self.synced_id == 0 and pending:
+                log.info("Color index loaded %d colors of %d outfits", len(self), len(self._by_hash))
+            self.synced_id = last_id
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(store) -> ColorIndex:
+    """The process-wide index, synced with `store`."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ColorIndex()
+    _index.sync(store)
+    return _index
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Color index timings on random colors")
+    parser.add_argument("--bench", type=int, default=100000, help="number of outfits")
+    parser.add_argument("--colors", type=int, default=4, help="colors per outfit")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = ColorIndex()
+    started = time.perf_counter()
+    for n in range(args.bench):
+        index.replace(f"{n:064x}", [(ROLES[c % 3], "#%06X" % rng.randrange(1 << 24)) for c in range(args.colors)])
+    print(f"build: {len(index)} colors in {time.perf_counter() - started:.2f}s")
+    for k, max_delta_e in ((10, math.inf), (50, math.inf), (1000, 10.0)):
+        queries = ["#%06X" % rng.randrange(1 << 24) for _ in range(args.queries)]
+        started = time.perf_counter()
+        for q in queries:
+            index.nearest(q, k=k, max_delta_e=max_delta_e)
+        per_query = (time.perf_counter() - started) / len(queries) * 1000
+        print(f"nearest k={k} max_delta_e={max_delta_e}: {per_query:.2f} ms/query")
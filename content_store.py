@@ -0,0 +1,70 @@
+# ---------------------------------------------------------------------------
+# Content Store — content-addressed blobs on local disk (job inputs, analyses
+# and generated images). A blob's name is the SHA-256 of its bytes, so writes
+# are idempotent and safe from any number of workers: each write goes to a
+# temp file and is renamed into place.
+#
+# CONTENT_STORE_DIR  blob directory (default data/content)
+# ---------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+CONTENT_STORE_DIR = os.getenv("CONTENT_STORE_DIR", os.path.join("data", "content"))
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def path(digest: str) -> str:
+    if not _HASH_RE.match(digest or ""):
+        raise ValueError(f"Not a content hash: {digest!r}")
+    return os.path.join(CONTENT_STORE_DIR, digest[:2], digest[2:])
+
+
+def put(data: bytes) -> str:
+    """Store `data`; returns its content hash."""
+    digest = hashlib.sha256(data).hexdigest()
+    target = path(digest)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return digest
+
+
+def get(digest: str) -> bytes | None:
+    try:
+        with open(path(digest), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def put_json(value) -> str:
+    return put(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+
+def get_json(digest: str):
+    data = get(digest)
+    return None if data is None else json.loads(data)
+
+
+def sniff_mime(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:1] in (b"{", b"["):
+        return "application/json"
+    return "application/octet-stream"
@@ -0,0 +1,296 @@
+# ---------------------------------------------------------------------------
+# Request Deadlines — tracks how much of the request budget is left
+# Created once per Flask route and passed through every pipeline stage.
+# A deadline can also be cancelled by request ID (client closed the tab or
+# re-clicked Generate), which aborts waits and skips the remaining stages.
+#
+# MODEL_CALL_TIMEOUT_SECONDS  HTTP timeout of one model call (default 120); the
+#                             remaining budget when that is shorter. Bounds
+#                             calls under unbounded deadlines (jobs, scripts),
+#                             which otherwise hold a model-call thread for as
+#                             long as the API takes, even once abandoned.
+# ---------------------------------------------------------------------------
+
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import logs
+import usage
+from lazy_imports import LazyModule
+from metrics import MODEL_ATTEMPTS, MODEL_CALL_SECONDS, STAGES_SKIPPED, register_collector, route_label
+
+types = LazyModule("google.genai.types")
+log = logs.get_logger("deadline")
+
+# Render closes the client connection after this many seconds.
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "30"))
+
+MODEL_CALL_TIMEOUT_SECONDS = float(os.getenv("MODEL_CALL_TIMEOUT_SECONDS", "120"))
+
+# Time kept back for encoding the image and writing the response.
+RESPONSE_RESERVE_SECONDS = 1.0
+
+# Smallest useful budget for each stage — below this we skip instead of starting.
+STAGE_MIN_SECONDS = {
+    "analysis": 6.0,
+    "extraction": 6.0,
+    "generation": 8.0,
+    "verification": 4.0,
+}
+
+# Typical stage durations (seconds), refined from observed calls. Used to
+# estimate how much model time a cancellation saved.
+_stage_estimates = {
+    "analysis": 15.0,
+    "extraction": 10.0,
+    "generation": 20.0,
+    "verification": 8.0,
+}
+
+# How often a waiting request thread checks for cancellation.
+_CANCEL_POLL_SECONDS = 0.25
+
+# Gemini calls run here so the request thread can stop waiting on cancel.
+_call_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MODEL_CALL_THREADS", "16")),
+                                    thread_name_prefix="gemini-call")
+
+_active_requests = {}
+_active_lock = threading.Lock()
+
+CANCEL_STATS = {
+    "cancelled_requests": 0,
+    "abandoned_calls": 0,
+    "skipped_stages": 0,
+    "retry_sleep_seconds_avoided": 0.0,
+    "model_seconds_avoided": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str, amount: float = 1):
+    with _stats_lock:
+        CANCEL_STATS[key] += amount
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a required stage cannot start because the budget is spent."""
+    metric_outcome = "deadline"
+
+
+class RequestCancelled(DeadlineExceeded):
+    """Raised when the client cancelled the request."""
+    metric_outcome = "cancelled"
+
+
+class AttemptAbandoned(RequestCancelled):
+    """Raised in a parallel attempt that was abandoned (Deadline.abandon);
+    not a client cancellation, so not counted in the cancel metrics."""
+    metric_outcome = "abandoned"
+
+
+def _stage_key(stage: str) -> str:
+    return stage.split("_")[0]
+
+
+class Deadline:
+    """Per-request time budget shared by all pipeline stages.
+
+    A budget of None means "no deadline" (used by callers outside Flask).
+    Stages that are skipped for lack of time are recorded in `skipped_stages`
+    so the route can report them to the client. When `request_id` is given the
+    deadline is registered so `cancel_request()` can reach it. Token usage of
+    every model call made through `run()` is collected in `usage`, and the
+    input-token budget report of each prompt built for it in `prompt_budget`.
+    """
+
+    def __init__(self, budget_seconds: float = None, request_id: str = None):
+        self.budget_seconds = budget_seconds
+        self.request_id = request_id or None
+        self._cancelled = threading.Event()
+        self._abandoned = False
+        self.started_at = time.monotonic()
+        if budget_seconds is None:
+            self.expires_at = math.inf
+        else:
+            self.expires_at = self.started_at + budget_seconds - RESPONSE_RESERVE_SECONDS
+        self.skipped_stages = []
+        self.usage = []
+        self.prompt_budget = []
+        if self.request_id:
+            with _active_lock:
+                _active_requests[self.request_id] = self
+
+    def close(self):
+        """Unregister the deadline once the route has finished."""
+        if self.request_id:
+            with _active_lock:
+                if _active_requests.get(self.request_id) is self:
+                    del _active_requests[self.request_id]
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def abandoned(self) -> bool:
+        return self._abandoned
+
+    def cancel(self):
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            _count("cancelled_requests")
+
+    def child(self) -> "Deadline":
+        """A deadline with the same expiry that can be abandoned on its own,
+        for one of several parallel attempts (see best_of.py). Fold its usage
+        back into this deadline with `absorb()`."""
+        child = Deadline(self.budget_seconds)
+        child.started_at = self.started_at
+        child.expires_at = self.expires_at
+        return child
+
+    def abandon(self):
+        """Stop the work running under this deadline without counting it as a
+        client cancellation (a parallel attempt that is no longer needed):
+        waits end and stages are skipped as for a cancel, but with reason
+        "abandoned" and outside the tryon_cancel_* metrics."""
+        self._abandoned = True
+        self._cancelled.set()
+
+    def absorb(self, child: "Deadline"):
+        """Add a child's token usage and prompt-budget reports to this deadline."""
+        self.usage.extend(child.usage)
+        self.prompt_budget.extend(child.prompt_budget)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def has_time_for(self, stage: str, extra_seconds: float = 0.0) -> bool:
+        """True if `stage` can still start (after waiting `extra_seconds`).
+        Sub-stages ("analysis_tile") need what their stage ("analysis") needs."""
+        minimum = STAGE_MIN_SECONDS.get(stage, STAGE_MIN_SECONDS.get(_stage_key(stage), 0.0))
+        return self.remaining() >= minimum + extra_seconds
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded (or RequestCancelled) if a required stage cannot start."""
+        if self.cancelled:
+            self.skip(stage)
+            if self._abandoned:
+                raise AttemptAbandoned(f"Attempt abandoned before {stage}")
+            raise RequestCancelled(f"Request cancelled by client before {stage}")
+        if not self.has_time_for(stage):
+            self.skip(stage)
+            raise DeadlineExceeded(
+                f"Request deadline reached before {stage} "
+                f"({self.remaining():.1f}s left of {self.budget_seconds:.0f}s)"
+            )
+
+    def check_retry(self, stage: str, wait: float):
+        """Raise unless there is time to wait `wait` seconds and retry `stage`."""
+        if self.cancelled:
+            self.skip(f"{stage}_retry")
+            if self._abandoned:
+                raise AttemptAbandoned(f"Attempt abandoned before {stage} retry")
+            raise RequestCancelled(f"Request cancelled by client before {stage} retry")
+        if not self.has_time_for(stage, wait):
+            self.skip(f"{stage}_retry")
+            raise DeadlineExceeded(f"No time left to retry {stage} after 503")
+
+    def skip(self, stage: str, reason: str = None):
+        """Record that a stage was skipped."""
+        reason = reason or ("abandoned" if self._abandoned else "cancelled" if self.cancelled else "deadline")
+        if reason == "cancelled":
+            _count("skipped_stages")
+            _count("model_seconds_avoided", _stage_estimates.get(_stage_key(stage), 0.0))
+        STAGES_SKIPPED.inc(route=route_label(), stage=stage, reason=reason)
+        log.info("Skipping %s (%s, %.1fs left)", stage, reason, self.remaining(),
+                 extra={"stage": stage, "reason": reason})
+        self.skipped_stages.append({
+            "stage": stage,
+            "reason": reason,
+            "remaining_s": round(self.remaining(), 2),
+        })
+
+    def http_options(self) -> "types.HttpOptions":
+        """Per-call HTTP options whose timeout is the remaining budget, capped
+        at MODEL_CALL_TIMEOUT_SECONDS."""
+        seconds = min(self.remaining(), MODEL_CALL_TIMEOUT_SECONDS)
+        return types.HttpOptions(timeout=max(1000, int(seconds * 1000)))
+
+    def sleep(self, seconds: float):
+        """Sleep, but never past the deadline; returns early on cancel."""
+        started = time.monotonic()
+        if self._cancelled.wait(min(seconds, self.remaining())) and not self._abandoned:
+            _count("retry_sleep_seconds_avoided", max(0.0, seconds - (time.monotonic() - started)))
+
+    def run(self, stage: str, fn, *args, prompt_name: str = "", **kwargs):
+        """Run a blocking model call, abandoning it if the request is cancelled.
+
+        The HTTP call itself keeps running in the background until its own
+        timeout, but the request thread is released immediately and no
+        further stages are started. Every attempt is counted in the
+        model-call metrics, labelled by stage, model and outcome, and the
+        token usage of the response is recorded under `prompt_name`.
+        """
+        self.check(stage)
+        started = time.monotonic()
+        outcome = "ok"
+        # Carry the log context (request ID) into the worker thread.
+        future = _call_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        try:
+            while True:
+                try:
+                    result = future.result(timeout=_CANCEL_POLL_SECONDS)
+                    break
+                except FutureTimeout:
+                    if self._abandoned:
+                        raise AttemptAbandoned(f"Attempt abandoned during {stage}")
+                    if self.cancelled:
+                        _count("abandoned_calls")
+                        raise RequestCancelled(f"Request cancelled by client during {stage}")
+        except Exception as e:
+            outcome = getattr(e, "metric_outcome", None) or (
+                "503" if "503" in str(e) or "UNAVAILABLE" in str(e) else "error")
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            labels = {"route": route_label(), "stage": stage, "model": kwargs.get("model", ""), "outcome": outcome}
+            MODEL_ATTEMPTS.inc(**labels)
+            MODEL_CALL_SECONDS.observe(elapsed, **labels)
+        key = _stage_key(stage)
+        if key in _stage_estimates:
+            with _stats_lock:
+                _stage_estimates[key] = 0.8 * _stage_estimates[key] + 0.2 * elapsed
+        rec = usage.record(stage, kwargs.get("model", ""), result, prompt_name)
+        if rec is not None:
+            rec["latency_s"] = round(elapsed, 3)
+            self.usage.append(rec)
+        return result
+
+
+def cancel_request(request_id: str) -> bool:
+    """Cancel an in-flight request by ID. Returns False if it is not running here."""
+    with _active_lock:
+        deadline = _active_requests.get(request_id)
+    if deadline is None:
+        return False
+    log.info("Cancelling request %s", request_id, extra={"cancel_request_id": request_id})
+    deadline.cancel()
+    return True
+
+
+@register_collector
+def _cancel_metrics():
+    with _stats_lock:
+        stats = dict(CANCEL_STATS)
+    return [(f"tryon_cancel_{key}_total", "counter", f"Cancellation: {key.replace('_', ' ')}.", value)
+            for key, value in stats.items()]
@@ -0,0 +1,250 @@
+# ---------------------------------------------------------------------------
+# Gemini Record / Replay — run the full app without spending quota.
+#
+#   GEMINI_BACKEND=live     talk to Gemini (default)
+#   GEMINI_BACKEND=record   talk to Gemini and save every generate_content
+#                           call (request hashes, response, latency) to the corpus
+#   GEMINI_BACKEND=replay   serve responses from the corpus; no API key needed
+#
+# Corpus layout (REPLAY_CORPUS_DIR, default data/replay):
+#   index.jsonl     one line per recorded call: model, config hash, content
+#                   hashes, latency, usage and the response minus image bytes
+#   blobs/<sha256>  inline image bytes, stored once per distinct image
+#
+# Replay matches on the exact request key (model + config + contents). With
+# REPLAY_STRICT=0 (default) an unmatched request falls back to recordings with
+# the same model and config, so new inputs still get a realistic response.
+# REPLAY_LATENCY is "recorded" (default), "none", or a fixed number of seconds.
+# ---------------------------------------------------------------------------
+
+import base64
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import logs
+from lazy_imports import LazyModule
+
+types = LazyModule("google.genai.types")
+log = logs.get_logger("replay")
+
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "live").lower()
+CORPUS_DIR = os.getenv("REPLAY_CORPUS_DIR", os.path.join("data", "replay"))
+REPLAY_STRICT = os.getenv("REPLAY_STRICT", "0") == "1"
+REPLAY_LATENCY = os.getenv("REPLAY_LATENCY", "recorded").lower()
+
+
+class ReplayMiss(LookupError):
+    """No recording matches the request."""
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _content_hashes(contents) -> list[str]:
+    """Stable short hash of every content item (text or inline image)."""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    hashes = []
+    for item in contents:
+        if isinstance(item, str):
+            hashes.append("text:" + _sha(item.encode("utf-8"))[:16])
+        elif getattr(item, "inline_data", None) is not None:
+            hashes.append(f"{item.inline_data.mime_type}:" + _sha(item.inline_data.data)[:16])
+        elif getattr(item, "text", None) is not None:
+            hashes.append("text:" + _sha(item.text.encode("utf-8"))[:16])
+        else:
+            hashes.append("other:" + _sha(repr(item).encode("utf-8"))[:16])
+    return hashes
+
+
+def _config_hash(config) -> str:
+    """Hash of the generation config, ignoring per-call HTTP options (timeouts)."""
+    if config is None:
+        return "none"
+    dumped = config.model_dump(mode="json", exclude_none=True, exclude={"http_options"})
+    return _sha(json.dumps(dumped, sort_keys=True).encode("utf-8"))[:16]
+
+
+def request_key(model: str, contents, config) -> tuple[str, str, list[str]]:
+    """(key, config_hash, content_hashes) identifying a generate_content call."""
+    config_hash = _config_hash(config)
+    content_hashes = _content_hashes(contents)
+    key = _sha(json.dumps([model, config_hash, content_hashes]).encode("utf-8"))[:24]
+    return key, config_hash, content_hashes
+
+
+class Corpus:
+    """On-disk store of recorded calls (index.jsonl + content-addressed blobs)."""
+
+    def __init__(self, root: str = None):
+        self.root = root or CORPUS_DIR
+        self.index_path = os.path.join(self.root, "index.jsonl")
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self._lock = threading.Lock()
+
+    def put_blob(self, data: bytes) -> str:
+        digest = _sha(data)
+        path = os.path.join(self.blob_dir, digest)
+        if not os.path.exists(path):
+            os.makedirs(self.blob_dir, exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get_blob(self, digest: str) -> bytes:
+        with open(os.path.join(self.blob_dir, digest), "rb") as f:
+            return f.read()
+
+    def append(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def entries(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    # --- response (de)serialization: image bytes live in blobs/ ---
+
+    def dump_response(self, response) -> dict:
+        data = response.model_dump(mode="json", exclude_none=True)
+        for candidate in data.get("candidates", []):
+            for part in (candidate.get("content") or {}).get("parts", []):
+                inline = part.get("inline_data")
+                if inline and "data" in inline:
+                    inline["blob"] = self.put_blob(base64.urlsafe_b64decode(inline.pop("data")))
+        return data
+
+    def load_response(self, data: dict):
+        data = json.loads(json.dumps(data))  # recordings are shared between replays
+        for candidate in data.get("candidates", []):
+            for part in (candidate.get("content") or {}).get("parts", []):
+                inline = part.get("inline_data")
+                if inline and "blob" in inline:
+                    inline["data"] = self.get_blob(inline.pop("blob"))
+        return types.GenerateContentResponse.model_validate(data)
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+class _RecordingModels:
+    def __init__(self, models, corpus: Corpus):
+        self._models = models
+        self._corpus = corpus
+
+    def generate_content(self, *, model: str, contents, config=None):
+        key, config_hash, content_hashes = request_key(model, contents, config)
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "key": key,
+            "model": model,
+            "config_hash": config_hash,
+            "contents": content_hashes,
+        }
+        started = time.monotonic()
+        try:
+            response = self._models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            entry["latency_ms"] = round((time.monotonic() - started) * 1000)
+            entry["error"] = str(e)
+            self._corpus.append(entry)
+            raise
+        entry["latency_ms"] = round((time.monotonic() - started) * 1000)
+        try:
+            entry["response"] = self._corpus.dump_response(response)
+            self._corpus.append(entry)
+        except Exception as e:
+            log.warning("Could not record %s response: %s", model, e)
+        return response
+
+
+class RecordingClient:
+    """Wraps a live genai.Client and records every generate_content call."""
+
+    def __init__(self, client, corpus: Corpus = None):
+        self._client = client
+        self.corpus = corpus or Corpus()
+        self.models = _RecordingModels(client.models, self.corpus)
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+class _ReplayModels:
+    def __init__(self, corpus: Corpus, strict: bool, latency: str):
+        self._corpus = corpus
+        self._strict = strict
+        self._latency = latency
+        self._by_key = {}
+        self._by_config = {}
+        count = 0
+        for entry in corpus.entries():
+            self._by_key.setdefault(entry["key"], []).append(entry)
+            self._by_config.setdefault((entry["model"], entry["config_hash"]), []).append(entry)
+            count += 1
+        # Repeated identical requests walk through their recordings in order
+        # (e.g. a 503 followed by a success), then start over.
+        self._cursors = {k: itertools.cycle(v) for k, v in self._by_key.items()}
+        self._cursors.update({k: itertools.cycle(v) for k, v in self._by_config.items()})
+        self._lock = threading.Lock()
+        log.info("Loaded %d recorded calls from %s", count, corpus.root, extra={"recordings": count})
+
+    def _next(self, cursor_key):
+        with self._lock:
+            return next(self._cursors[cursor_key])
+
+    def _find(self, model: str, contents, config) -> dict:
+        key, config_hash, _ = request_key(model, contents, config)
+        if key in self._by_key:
+            return self._next(key)
+        if not self._strict and (model, config_hash) in self._by_config:
+            return self._next((model, config_hash))
+        raise ReplayMiss(f"No recording for {model} (key {key}, config {config_hash})")
+
+    def _delay(self, entry: dict, config):
+        if self._latency == "none":
+            return
+        seconds = entry.get("latency_ms", 0) / 1000 if self._latency == "recorded" else float(self._latency)
+        timeout_ms = getattr(getattr(config, "http_options", None), "timeout", None)
+        if timeout_ms is not None and seconds > timeout_ms / 1000:
+            time.sleep(timeout_ms / 1000)
+            raise TimeoutError(f"Replayed call exceeded its {timeout_ms} ms timeout")
+        time.sleep(seconds)
+
+    def generate_content(self, *, model: str, contents, config=None):
+        entry = self._find(model, contents, config)
+        self._delay(entry, config)
+        if "error" in entry:
+            raise Exception(entry["error"])
+        return self._corpus.load_response(entry["response"])
+
+
+class ReplayClient:
+    """Stand-in for genai.Client that serves recorded responses."""
+
+    def __init__(self, corpus: Corpus = None, strict: bool = None, latency: str = None):
+        self.corpus = corpus or Corpus()
+        self.models = _ReplayModels(
+            self.corpus,
+            REPLAY_STRICT if strict is None else strict,
+            REPLAY_LATENCY if latency is None else latency,
+        )
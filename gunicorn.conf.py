@@ -0,0 +1,18 @@
+# ---------------------------------------------------------------------------
+# Gunicorn settings — picked up automatically by `gunicorn app:app`
+# ---------------------------------------------------------------------------
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Threaded workers, so /api/cancel can be served while a generation request
+# from the same worker is still waiting on Gemini.
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+
+def post_worker_init(worker):
+    # Job threads run in serving workers only; importing app starts none.
+    import app
+    app.start_job_workers()
@@ -0,0 +1,37 @@
+# ---------------------------------------------------------------------------
+# Job Worker — runs durable jobs (see jobs.py) outside the web process, e.g.
+# on another node mounting the same JOBS_DB_PATH and CONTENT_STORE_DIR.
+#
+#   python job_worker.py --threads 4
+# ---------------------------------------------------------------------------
+
+import argparse
+import signal
+import threading
+
+import app  # registers the job handlers
+import jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run durable try-on jobs")
+    parser.add_argument("--threads", type=int, default=2, help="jobs run concurrently")
+    args = parser.parse_args()
+
+    if app.get_client() is None:
+        raise SystemExit("No Gemini client: set GEMINI_API_KEY (or GEMINI_BACKEND=replay)")
+    workers = jobs.start_workers(args.threads)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    # Leave running jobs to their leases: another worker resumes them from
+    # their last checkpoint once the lease expires.
+    for worker in workers:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# ---------------------------------------------------------------------------
+# Jobs — durable analysis/generation jobs that survive worker restarts.
+#
+# Jobs live in SQLite (WAL) so every worker process on the host — and any
+# node mounting the same disk — can pick them up. A worker claims a job with
+# a lease and renews it with heartbeats while the job runs; a job whose lease
+# expires (the worker died or restarted) is claimed again by someone else.
+# Failures are retried with exponential backoff up to max_attempts.
+#
+# Handlers checkpoint each finished stage (analysis, generation, ...) as a
+# reference into the content store, so a re-claimed job resumes after its
+# last finished stage instead of paying for the Gemini calls again.
+#
+# JOBS_DB_PATH        SQLite file (default data/jobs.sqlite3)
+# JOB_WORKERS         job threads per serving process (default 1; 0 = enqueue
+#                     only, run `python job_worker.py` elsewhere). Started by
+#                     gunicorn.conf.py and `python app.py`, not on import.
+# JOB_LEASE_SECONDS   lease length; heartbeats renew it every third (default 60)
+# JOB_MAX_ATTEMPTS    attempts before a job is marked failed (default 3)
+# JOB_RETRY_SECONDS   backoff before the first retry, doubled per attempt (default 10)
+# ---------------------------------------------------------------------------
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import logs
+from metrics import Counter
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "10"))
+
+log = logs.get_logger("jobs")
+
+_POLL_SECONDS = 1.0
+
+JOB_EVENTS = Counter(
+    "tryon_job_events_total", "Job lifecycle events, by kind and event "
+    "(enqueued/claimed/reclaimed/resumed_stage/retried/done/failed/cancelled/lease_lost).", ("kind", "event"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id               TEXT PRIMARY KEY,
+    kind             TEXT NOT NULL,
+    status           TEXT NOT NULL,
+    payload          TEXT NOT NULL,
+    checkpoints      TEXT NOT NULL DEFAULT '{}',
+    result           TEXT,
+    error            TEXT,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    max_attempts     INTEGER NOT NULL,
+    lease_owner      TEXT,
+    lease_expires_at REAL,
+    available_at     REAL NOT NULL,
+    created_at       REAL NOT NULL,
+    updated_at       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_leases ON jobs (status, lease_expires_at);
+"""
+
+_handlers = {}
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker may own it now."""
+
+
+def handler(kind: str):
+    """Register `fn(job)` as the runner for jobs of `kind`; its return value
+    (JSON-able) becomes the job result, an exception triggers a retry."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+class Job:
+    """A claimed job, handed to its handler."""
+
+    def __init__(self, queue: "JobQueue", row: sqlite3.Row, owner: str):
+        self.queue = queue
+        self.owner = owner
+        self.id = row["id"]
+        self.kind = row["kind"]
+        self.attempts = row["attempts"]
+        self.payload = json.loads(row["payload"])
+        self.checkpoints = json.loads(row["checkpoints"])
+        self.deadline = None
+
+    def stage(self, name: str):
+        """Artifact checkpointed for `name` by an earlier attempt, or None."""
+        artifact = self.checkpoints.get(name)
+        if artifact is not None:
+            JOB_EVENTS.inc(kind=self.kind, event="resumed_stage")
+        return artifact
+
+    def checkpoint(self, name: str, artifact):
+        """Record a finished stage; raises LeaseLost if the job is no longer ours."""
+        self.queue._update_owned(self, "checkpoints = json_set(checkpoints, ?, json(?))",
+                                 (f"$.{name}", json.dumps(artifact)))
+        self.checkpoints[name] = artifact
+
+
+class JobQueue:
+    """SQLite job table; one connection per thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = None) -> str:
+        job_id = uuid.uuid4().hex[:16]
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, kind, status, payload, max_attempts, available_at, created_at, updated_at)"
+            " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), max_attempts or JOB_MAX_ATTEMPTS, now, now, now),
+        )
+        JOB_EVENTS.inc(kind=kind, event="enqueued")
+        return job_id
+
+    def claim(self, owner: str, kinds: tuple, lease_seconds: float = None) -> Job | None:
+        """Lease the oldest ready job (queued, or running with an expired lease)."""
+        now = time.time()
+        lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that already used every attempt are finished for good.
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = coalesce(error, 'lease expired'), lease_owner = NULL,"
+                " updated_at = ? WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            marks = ", ".join("?" * len(kinds))
+            row = conn.execute(
+                f"SELECT id, status FROM jobs WHERE kind IN ({marks}) AND ("
+                "  (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_expires_at < ?))"
+                " ORDER BY available_at LIMIT 1",
+                (*kinds, now, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires_at = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ? RETURNING *",
+                (owner, now + lease_seconds, now, row["id"]),
+            ).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        JOB_EVENTS.inc(kind=claimed["kind"], event="reclaimed" if row["status"] == "running" else "claimed")
+        return Job(self, claimed, owner)
+
+    def _update_owned(self, job: Job, assignment: str, params: tuple):
+        changed = self._connect().execute(
+            f"UPDATE jobs SET {assignment}, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (*params, time.time(), job.id, job.owner),
+        ).rowcount
+        if not changed:
+            JOB_EVENTS.inc(kind=job.kind, event="lease_lost")
+            raise LeaseLost(f"Lost the lease on job {job.id}")
+
+    def heartbeat(self, job: Job, lease_seconds: float = None) -> bool:
+        """Extend the lease; False if another worker has taken the job over."""
+        try:
+            self._update_owned(job, "lease_expires_at = ?", (time.time() + (lease_seconds or JOB_LEASE_SECONDS),))
+            return True
+        except LeaseLost:
+            return False
+
+    def finish(self, job: Job, result):
+        self._update_owned(job, "status = 'done', result = ?, error = NULL, lease_owner = NULL",
+                           (json.dumps(result),))
+        JOB_EVENTS.inc(kind=job.kind, event="done")
+
+    def fail(self, job: Job, error: str):
+        """Requeue with backoff, or mark failed once attempts are used up."""
+        row = self._connect().execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job.id,)).fetchone()
+        if row["attempts"] < row["max_attempts"]:
+            backoff = JOB_RETRY_SECONDS * 2 ** (row["attempts"] - 1)
+            self._update_owned(job, "status = 'queued', error = ?, lease_owner = NULL, available_at = ?",
+                               (error, time.time() + backoff))
+            JOB_EVENTS.inc(kind=job.kind, event="retried")
+        else:
+            self._update_owned(job, "status = 'failed', error = ?, lease_owner = NULL", (error,))
+            JOB_EVENTS.inc(kind=job.kind, event="failed")
+
+    def cancel(self, job: Job, error: str):
+        """Mark the job cancelled; it is not retried."""
+        self._update_owned(job, "status = 'cancelled', error = ?, lease_owner = NULL", (error,))
+        JOB_EVENTS.inc(kind=job.kind, event="cancelled")
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"], "kind": row["kind"], "status": row["status"],
+            "attempts": row["attempts"], "max_attempts": row["max_attempts"],
+            "stages": sorted(json.loads(row["checkpoints"])),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"], "created_at": row["created_at"], "updated_at": row["updated_at"],
+        }
+
+
+# ---------------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------------
+
+class Worker(threading.Thread):
+    """Claims and runs jobs until `stop()` is called."""
+
+    def __init__(self, queue: JobQueue, name: str = "job-worker"):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                log.exception("Job worker error: %s", e)
+                ran = False
+            if not ran:
+                self._stop_event.wait(_POLL_SECONDS)
+
+    def run_once(self) -> bool:
+        """Claim and run one job; False when there was nothing to do."""
+        if not _handlers:
+            return False
+        job = self.queue.claim(self.owner, tuple(_handlers))
+        if job is None:
+            return False
+        token = logs.bind_request(job.id, f"job_{job.kind}")
+        beat_stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job, beat_stop), name=f"job-heartbeat-{job.id}",
+                                daemon=True)
+        beat.start()
+        try:
+            log.info("Running %s job %s (attempt %d)", job.kind, job.id, job.attempts,
+                     extra={"job": job.id, "attempt": job.attempts, "resume": sorted(job.checkpoints)})
+            result = _handlers[job.kind](job)
+            self.queue.finish(job, result)
+            log.info("Job %s done", job.id)
+        except LeaseLost as e:
+            log.warning("%s", e)
+        except Exception as e:
+            self._end_failed(job, e)
+        finally:
+            beat_stop.set()
+            beat.join()
+            if job.deadline is not None:
+                job.deadline.close()
+            logs.unbind_request(token)
+        return True
+
+    def _end_failed(self, job: Job, error: Exception):
+        """Retry the job, unless it was cancelled (it ends cancelled) or its
+        lease was lost (it belongs to another worker now)."""
+        deadline = job.deadline
+        try:
+            if deadline is not None and deadline.abandoned:
+                log.warning("Job %s stopped after losing its lease", job.id)
+            elif deadline is not None and deadline.cancelled:
+                log.info("Job %s cancelled", job.id)
+                self.queue.cancel(job, f"{type(error).__name__}: {error}")
+            else:
+                log.exception("Job %s failed: %s", job.id, error)
+                self.queue.fail(job, f"{type(error).__name__}: {error}")
+        except LeaseLost as lost:
+            log.warning("%s", lost)
+
+    def _heartbeat(self, job: Job, stop: threading.Event):
+        while not stop.wait(JOB_LEASE_SECONDS / 3):
+            if not self.queue.heartbeat(job):
+                log.warning("Job %s lease lost; stopping it", job.id)
+                # Not a client cancel: keep it out of the cancellation metrics.
+                if job.deadline is not None:
+                    job.deadline.abandon()
+                return
+
+
+_queue = None
+_queue_lock = threading.Lock()
+_workers = []
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(JOBS_DB_PATH)
+    return _queue
+
+
+def start_workers(count: int = None) -> list:
+    """Start `count` (default JOB_WORKERS) worker threads in this process."""
+    count = JOB_WORKERS if count is None else count
+    for n in range(count):
+        worker = Worker(get_queue(), name=f"job-worker-{n}")
+        worker.start()
+        _workers.append(worker)
+    if count:
+        log.info("Started %d job worker thread(s) on %s", count, JOBS_DB_PATH)
+    return _workers
@@ -0,0 +1,40 @@
+# ---------------------------------------------------------------------------
+# Lazy Imports — defer heavy modules (google.genai, PIL) until first use
+# so a cold gunicorn worker can accept traffic sooner
+# ---------------------------------------------------------------------------
+
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    `types = LazyModule("google.genai.types")` behaves like
+    `from google.genai import types` except that the import happens the first
+    time `types.Something` is used.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Import the module now (used by the warm-up thread)."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
@@ -0,0 +1,147 @@
+# ---------------------------------------------------------------------------
+# Logging — one JSON line per event, tagged with the request ID and route.
+# Records are handed to a background QueueListener, so request threads never
+# block on stdout.
+#
+#   LOG_LEVEL        DEBUG | INFO (default) | WARNING | ERROR
+#   LOG_FORMAT       json (default) | text
+#   LOG_SAMPLE_RATE  share of requests whose verbose lines (prompt dumps,
+#                    per-difference lines) are logged at INFO (default 0.1;
+#                    at DEBUG they are always logged)
+# ---------------------------------------------------------------------------
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_route = contextvars.ContextVar("route", default=None)
+_verbose = contextvars.ContextVar("verbose", default=False)
+
+# Attributes every LogRecord has; anything else was passed via `extra=`.
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "route"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class _ContextFilter(logging.Filter):
+    """Stamp the current request ID and route on the record (caller's thread)."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        record.route = _route.get()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Resolve the message and traceback in the caller's thread and leave
+    formatting to the listener."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name.removeprefix("tryon."),
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+            entry["route"] = record.route
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"[{record.name.removeprefix('tryon.').upper()}] {record.getMessage()}"
+        if getattr(record, "request_id", None):
+            line = f"{record.request_id} {line}"
+        extras = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        if extras:
+            line += " " + json.dumps(extras, ensure_ascii=False, default=str)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def setup():
+    """Install the queue handler on the "tryon" logger (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        listener = logging.handlers.QueueListener(log_queue, output)
+        listener.start()
+        atexit.register(listener.stop)
+
+        handler = _QueueHandler(log_queue)
+        handler.addFilter(_ContextFilter())
+        root = logging.getLogger("tryon")
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        root.addHandler(handler)
+        _listener = listener
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for one pipeline area, e.g. get_logger("gen") -> "tryon.gen"."""
+    setup()
+    return logging.getLogger(f"tryon.{name}")
+
+
+def bind_request(request_id: str, route: str) -> tuple:
+    """Attach the request ID to every log line from this context and decide
+    whether the request's verbose lines are sampled. Returns a token for
+    `unbind_request()`."""
+    sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+    return (_request_id.set(request_id), _route.set(route), _verbose.set(sampled))
+
+
+def unbind_request(token: tuple):
+    request_token, route_token, verbose_token = token
+    _request_id.reset(request_token)
+    _route.reset(route_token)
+    _verbose.reset(verbose_token)
+
+
+def current_request_id() -> str | None:
+    return _request_id.get()
+
+
+def verbose_enabled(logger: logging.Logger) -> bool:
+    """True if verbose lines should be logged for the current request."""
+    return _verbose.get() or logger.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,179 @@
+# ---------------------------------------------------------------------------
+# Metrics — per-stage latency histograms and counters, exported at /metrics
+# in the Prometheus text format. Dependency-free and cheap enough to wrap
+# every pipeline stage: one lock + one bisect per observation.
+# ---------------------------------------------------------------------------
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import has_request_context, request
+
+# Covers prompt building (~ms) through slow image generations (~minutes).
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 20.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_collectors = []
+
+
+def _format_labels(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def register_collector(fn):
+    """Register `fn() -> [(name, type, help, value)]` to be sampled at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, documentation, value in collect():
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Pipeline metrics
+# ---------------------------------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "tryon_stage_duration_seconds", "Duration of each pipeline stage.",
+    ("route", "stage", "model", "outcome"),
+)
+MODEL_ATTEMPTS = Counter(
+    "tryon_model_attempts_total", "Gemini calls per attempt, by outcome (ok/503/error/cancelled/abandoned).",
+    ("route", "stage", "model", "outcome"),
+)
+MODEL_CALL_SECONDS = Histogram(
+    "tryon_model_call_duration_seconds", "Duration of each individual Gemini call attempt.",
+    ("route", "stage", "model", "outcome"),
+)
+REQUESTS = Counter(
+    "tryon_requests_total", "HTTP requests by route and status code.",
+    ("route", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "tryon_request_duration_seconds", "End-to-end HTTP request duration.",
+    ("route", "status"),
+)
+STAGES_SKIPPED = Counter(
+    "tryon_stages_skipped_total", "Pipeline stages skipped, by reason (deadline/cancelled).",
+    ("route", "stage", "reason"),
+)
+
+
+def route_label() -> str:
+    """Route name for labels, taken from the active Flask request."""
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "none"
+
+
+class stage_timer:
+    """Time a pipeline stage and record it in STAGE_SECONDS.
+
+        with stage_timer("verification", model="gemini-3-flash-preview") as t:
+            ...
+            t.outcome = "no_image"  # optional; defaults to ok/error
+
+    Exceptions may carry a `metric_outcome` class attribute (e.g. "cancelled")
+    to label the failure more precisely than "error".
+    """
+
+    __slots__ = ("stage", "model", "outcome", "_started")
+
+    def __init__(self, stage: str, model: str = ""):
+        self.stage = stage
+        self.model = model
+        self.outcome = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        outcome = self.outcome
+        if exc_type is not None:
+            outcome = getattr(exc_type, "metric_outcome", "error")
+        STAGE_SECONDS.observe(elapsed, route=route_label(), stage=self.stage,
+                              model=self.model, outcome=outcome or "ok")
+        return False
@@ -0,0 +1,121 @@
+# ---------------------------------------------------------------------------
+# Multi-view Analysis — front, back and close-up shots of one outfit,
+# analyzed concurrently and fused into one analysis.
+#
+# Every view goes through the normal single-image analysis (so stored and
+# cached analyses are reused per image) on its own thread. The most
+# complete view becomes the primary: its analysis is the base of the fused
+# one, and it is the view generation should use as the source image. The
+# other views add to it:
+#   - fields the primary left missing or vague are taken from them
+#   - descriptive fields (embroidery, borders, ...) that they describe
+#     differently are appended with the view's label, so back embroidery
+#     survives next to the front's
+#   - list fields (checklists, secondary colors) are unioned
+#   - jewelry_pieces are merged by type (close-ups enrich a piece's stones)
+#
+# MULTI_VIEW_MAX  most views per request (default 6)
+# ---------------------------------------------------------------------------
+
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+from analysis_model import Analysis, completeness, is_weak
+from deadline import Deadline
+from metrics import Counter
+
+MULTI_VIEW_MAX = int(os.getenv("MULTI_VIEW_MAX", "6"))
+
+# Fields where each view can see something the others cannot.
+VIEW_TEXT_FIELDS = (
+    "embroidery", "border_design", "embellishments", "latkan_tassels",
+    "special_design_features", "dupatta_details", "dupatta_draping",
+)
+
+log = logs.get_logger("multi_view")
+
+VIEWS = Counter("tryon_multi_view_views_total", "Views in multi-view analyses, by outcome (ok/failed).", ("outcome",))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MULTI_VIEW_THREADS", "16")), thread_name_prefix="view")
+
+
+def _key(value) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def fuse(views: list[tuple[str, Analysis]], merge) -> dict:
+    """Fuse (label, analysis) pairs, primary first, into one analysis dict.
+
+    merge(base_dict, updates_dict) -> merged dict (app._deep_merge)
+    """
+    fused = dict(views[0][1].to_dict())
+    for label, analysis in views[1:]:
+        other = analysis.to_dict()
+        if other.get("jewelry_pieces"):
+            fused = merge(fused, {"jewelry_pieces": other["jewelry_pieces"]})
+        for key, val in other.items():
+            if key == "jewelry_pieces":
+                continue
+            current = fused.get(key)
+            if isinstance(current, list) and isinstance(val, list):
+                seen = {_key(item) for item in current}
+                added = []
+                for item in val:
+                    if _key(item) not in seen:
+                        seen.add(_key(item))
+                        added.append(item)
+                if added:
+                    fused[key] = current + added
+            elif is_weak(key, current):
+                if not is_weak(key, val):
+                    fused[key] = val
+            elif key in VIEW_TEXT_FIELDS and isinstance(current, str) and isinstance(val, str):
+                if not is_weak(key, val) and val not in current:
+                    fused[key] = f"{current}\n[{label}] {val}"
+    return fused
+
+
+def analyze(views: list[dict], analyze_one, merge, deadline: Deadline) -> dict:
+    """Analyze `views` ({label, image_bytes, mime_type}) concurrently and fuse them.
+
+    analyze_one(image_bytes, mime_type, deadline) -> analysis dict
+
+    Returns {details, completeness, primary_view, views}; `views` has one
+    summary per input view (label, completeness or error) in input order.
+    If every view fails, the first view's error is raised.
+    """
+    # Carry the request context (log request ID, prompt variant) into the workers.
+    futures = [_executor.submit(contextvars.copy_context().run, analyze_one,
+                                view["image_bytes"], view["mime_type"], deadline) for view in views]
+    summaries = []
+    analyzed = []
+    first_error = None
+    for i, (view, future) in enumerate(zip(views, futures)):
+        summary = {"index": i, "label": view["label"]}
+        try:
+            analysis = Analysis.from_dict(future.result())
+        except Exception as e:
+            log.warning("View %d (%s) failed: %s", i, view["label"], e, extra={"view": i})
+            VIEWS.inc(outcome="failed")
+            summary["error"] = str(e)[:200]
+            first_error = first_error or e
+        else:
+            VIEWS.inc(outcome="ok")
+            summary["completeness"] = completeness(analysis)
+            analyzed.append((i, analysis))
+        summaries.append(summary)
+    if not analyzed:
+        raise first_error
+
+    # Most complete view first; ties keep the caller's order.
+    analyzed.sort(key=lambda item: -summaries[item[0]]["completeness"])
+    primary = analyzed[0][0]
+    fused = Analysis.from_dict(fuse([(views[i]["label"], analysis) for i, analysis in analyzed], merge))
+    summaries[primary]["primary"] = True
+    log.info("Fused %d/%d view(s), primary %d (%s)", len(analyzed), len(views), primary, views[primary]["label"],
+             extra={"views": len(views), "primary": primary})
+    return {"details": fused.to_dict(), "completeness": completeness(fused), "primary_view": primary,
+            "views": summaries}
@@ -0,0 +1,122 @@
+# ---------------------------------------------------------------------------
+# Request Profiling — opt-in sampling profiler for single slow requests.
+#
+# A request is profiled when it carries `X-Profile-Token: <PROFILE_TOKEN>` or
+# is picked by PROFILE_SAMPLE_RATE. A background thread samples the request
+# thread's stack every PROFILE_INTERVAL_MS and writes, under a server-generated
+# profile ID (returned in X-Profile-Id; the request ID is in the JSON):
+#   <PROFILE_DIR>/<id>.folded   collapsed stacks (flamegraph.pl, speedscope)
+#   <PROFILE_DIR>/<id>.json     wall, CPU and Gemini-wait summary
+# Stacks are rooted at "gemini_wait", "retry_sleep" or "running" so time spent
+# waiting on the model is separated from work done in the process.
+#
+# With neither variable set, app.py registers no hooks (zero overhead).
+# ---------------------------------------------------------------------------
+
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import logs
+from deadline import Deadline
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("data", "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+log = logs.get_logger("profile")
+
+# Frames that mean "the request thread is blocked on the model".
+_WAIT_CODES = {
+    Deadline.run.__code__: "gemini_wait",
+    Deadline.sleep.__code__: "retry_sleep",
+}
+_BLOCKING_FILES = ("threading.py", os.path.join("concurrent", "futures", "_base.py"))
+
+
+def requested(headers) -> bool:
+    """Should this request be profiled?"""
+    token = headers.get("X-Profile-Token")
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    """Samples one thread's stack until stopped. Start it from that thread."""
+
+    def __init__(self, interval_ms: float = None):
+        self.interval = (interval_ms or PROFILE_INTERVAL_MS) / 1000
+        self.stacks = Counter()
+        self.samples = Counter()
+        self._thread_id = None
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._started = time.perf_counter()
+        self._cpu_started = time.thread_time()
+        self._sampler = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._sampler.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            leaf = frame
+            labels = []
+            category = "running"
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                if frame.f_code in _WAIT_CODES and leaf.f_code.co_filename.endswith(_BLOCKING_FILES):
+                    category = _WAIT_CODES[frame.f_code]
+                frame = frame.f_back
+            labels.append(category)
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples[category] += 1
+
+    def stop(self) -> dict:
+        """Stop sampling (from the profiled thread) and return the summary."""
+        wall = time.perf_counter() - self._started
+        cpu = time.thread_time() - self._cpu_started
+        self._stop_event.set()
+        self._sampler.join()
+        total = sum(self.samples.values())
+        per_sample = wall / total if total else 0.0
+        return {
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "gemini_wait_s": round(self.samples["gemini_wait"] * per_sample, 4),
+            "retry_sleep_s": round(self.samples["retry_sleep"] * per_sample, 4),
+            "running_s": round(self.samples["running"] * per_sample, 4),
+            "samples": total,
+            "interval_ms": self.interval * 1000,
+        }
+
+    def save(self, profile_id: str, summary: dict, directory: str = None, **meta) -> str:
+        """Write <id>.folded and <id>.json; returns the .folded path."""
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{profile_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+            json.dump({"id": profile_id, **meta, **summary}, f, indent=2)
+        log.info("Saved profile %s (wall %.2fs, cpu %.2fs, gemini wait %.2fs)", path,
+                 summary["wall_s"], summary["cpu_s"], summary["gemini_wait_s"], extra={"profile": path})
+        return path
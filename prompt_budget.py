@@ -0,0 +1,190 @@
+# ---------------------------------------------------------------------------
+# Prompt Budget — caps the input tokens of the generation prompt.
+#
+# The assembled prompt is counted (a local estimate by default, or the
+# Gemini count_tokens endpoint with PROMPT_TOKEN_COUNTER=api) before it is
+# sent. Over budget, COMPACTION_STEPS are applied in order, lowest-value
+# content first, until the prompt fits or the steps run out:
+#   dedupe_rules       drop rule text repeated elsewhere in the prompt
+#   drop_low_value     jewelry "Full" and visual-weight lines
+#   trim_checklists    keep the first items of each checklist
+#   shorten_fields     cut free-text fields to a word limit
+# Each step's token count is kept in the report, with tokens before/after.
+#
+# PROMPT_TOKEN_BUDGET   default budget in tokens (0 = unlimited)
+# PROMPT_TOKEN_BUDGETS  per-endpoint overrides, JSON: {"api_generate_direct": 3000}
+# PROMPT_TOKEN_COUNTER  estimate | api
+#
+#     python prompt_budget.py analysis.json --budget 2500
+# ---------------------------------------------------------------------------
+
+import argparse
+import dataclasses
+import json
+import math
+import os
+
+import logs
+from analysis_model import Analysis
+from metrics import Counter
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+PROMPT_TOKEN_BUDGETS = {k: int(v) for k, v in json.loads(os.getenv("PROMPT_TOKEN_BUDGETS") or "{}").items()}
+PROMPT_TOKEN_COUNTER = os.getenv("PROMPT_TOKEN_COUNTER", "estimate").lower()
+
+log = logs.get_logger("budget")
+
+COMPACTIONS = Counter(
+    "tryon_prompt_compactions_total", "Over-budget prompts, by whether compaction got them under budget.",
+    ("route", "outcome"),
+)
+TOKENS_SAVED = Counter(
+    "tryon_prompt_tokens_saved_total", "Estimated input tokens removed by prompt compaction.",
+    ("route",),
+)
+
+CHECKLIST_ITEMS = 10
+FIELD_WORDS = 20
+
+
+def budget_for(endpoint: str) -> int:
+    """Token budget for a Flask endpoint (0 = unlimited)."""
+    return PROMPT_TOKEN_BUDGETS.get(endpoint, PROMPT_TOKEN_BUDGET)
+
+
+def estimate_tokens(text: str) -> int:
+    """~4 ASCII characters per token; each non-ASCII character (box drawing,
+    arrows, emoji) counted as a token of its own. Errs on the high side."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+# ─── Compaction steps: Analysis -> Analysis (the same object = nothing to drop) ───
+
+def _drop_low_value(analysis: Analysis) -> Analysis:
+    pieces = tuple(dataclasses.replace(p, description=None, visual_weight=None) for p in analysis.jewelry)
+    if pieces == analysis.jewelry:
+        return analysis
+    return dataclasses.replace(analysis, jewelry=pieces)
+
+
+def _trim_checklist(text: str | None) -> str | None:
+    if text is None:
+        return None
+    items = text.split("\n")
+    return "\n".join(items[:CHECKLIST_ITEMS]) if len(items) > CHECKLIST_ITEMS else text
+
+
+def _trim_checklists(analysis: Analysis) -> Analysis:
+    dress, jewelry = _trim_checklist(analysis.dress_checklist), _trim_checklist(analysis.jewelry_checklist)
+    if dress == analysis.dress_checklist and jewelry == analysis.jewelry_checklist:
+        return analysis
+    return dataclasses.replace(analysis, dress_checklist=dress, jewelry_checklist=jewelry)
+
+
+def _shorten(text: str | None) -> str | None:
+    if not text:
+        return text
+    words = text.split()
+    return " ".join(words[:FIELD_WORDS]) + " …" if len(words) > FIELD_WORDS else text
+
+
+_SHORTEN_TEXT = ("neckline", "sleeves", "embroidery", "border_design", "embellishments", "latkan_tassels",
+                 "special_design_features", "dupatta_draping", "dupatta_details")
+_SHORTEN_PIECE = ("design_pattern", "stones", "pearls", "enamel_meenakari", "dangling_elements")
+
+
+def _shorten_fields(analysis: Analysis) -> Analysis:
+    changes = {name: _shorten(getattr(analysis, name)) for name in _SHORTEN_TEXT}
+    changes["jewelry"] = tuple(
+        dataclasses.replace(p, **{name: _shorten(getattr(p, name)) for name in _SHORTEN_PIECE})
+        for p in analysis.jewelry
+    )
+    if all(getattr(analysis, name) == value for name, value in changes.items()):
+        return analysis
+    return dataclasses.replace(analysis, **changes)
+
+
+# (name, step); a None step switches the renderer to its compact rule text.
+COMPACTION_STEPS = (
+    ("dedupe_rules", None),
+    ("drop_low_value", _drop_low_value),
+    ("trim_checklists", _trim_checklists),
+    ("shorten_fields", _shorten_fields),
+)
+
+
+def fit(analysis: Analysis, render, budget: int, count=estimate_tokens) -> tuple[str, dict]:
+    """Render `analysis` with `render(analysis, compact_rules)` and compact it
+    until `count(prompt) <= budget`. Returns (prompt, report)."""
+    prompt = render(analysis, False)
+    tokens = count(prompt)
+    report = {"budget": budget, "tokens_before": tokens, "tokens_after": tokens, "steps": []}
+    if not budget or tokens <= budget:
+        return prompt, report
+
+    compact_rules = False
+    for name, step in COMPACTION_STEPS:
+        if step is None:
+            compact_rules = True
+        else:
+            compacted = step(analysis)
+            if compacted is analysis:
+                continue
+            analysis = compacted
+        prompt = render(analysis, compact_rules)
+        tokens = count(prompt)
+        report["steps"].append({"step": name, "tokens": tokens})
+        if tokens <= budget:
+            break
+
+    report["tokens_after"] = tokens
+    report["over_budget"] = tokens > budget
+    log.info("Prompt compacted %d -> %d tokens (budget %d)", report["tokens_before"], tokens, budget,
+             extra={"prompt_budget": report})
+    return prompt, report
+
+
+def count_compaction(report: dict, route: str = ""):
+    """Count a fit() report in the compaction metrics. Called once per request
+    (fit() itself only runs on prompt-memo misses)."""
+    if "over_budget" not in report:
+        return
+    COMPACTIONS.inc(route=route, outcome="over_budget" if report["over_budget"] else "fit")
+    TOKENS_SAVED.inc(report["tokens_before"] - report["tokens_after"], route=route)
+
+
+def measure(prompt: str, budget: int, count=estimate_tokens) -> dict:
+    """Report for a prompt that cannot be compacted (free text)."""
+    tokens = count(prompt)
+    report = {"budget": budget, "tokens_before": tokens, "tokens_after": tokens, "steps": []}
+    if budget and tokens > budget:
+        report["over_budget"] = True
+        log.warning("Prompt over budget: %d tokens (budget %d), sent as is", tokens, budget)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show how an analysis prompt compacts under a token budget.")
+    parser.add_argument("analysis", help="analysis JSON file (as returned by /api/analyze)")
+    parser.add_argument("--budget", type=int, default=PROMPT_TOKEN_BUDGET)
+    parser.add_argument("--instructions", default="", help="user instructions to include")
+    parser.add_argument("--print", action="store_true", help="print the final prompt")
+    args = parser.parse_args()
+
+    import app  # the renderer lives with the routes
+
+    with open(args.analysis, encoding="utf-8") as f:
+        analysis = Analysis.from_dict(json.load(f))
+    prompt, report = app.budgeted_generation_prompt(analysis, args.instructions, args.budget)
+    print(f"tokens before: {report['tokens_before']}  budget: {report['budget'] or 'unlimited'}")
+    for step in report["steps"]:
+        print(f"  {step['step']:<16} {step['tokens']:>7}")
+    print(f"tokens after:  {report['tokens_after']}{'  (still over budget)' if report.get('over_budget') else ''}")
+    if args.print:
+        print()
+        print(prompt)
+
+
+if __name__ == "__main__":
+    main()
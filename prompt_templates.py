@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------------
+# Prompt Templates — the generation, refinement and standalone prompts from
+# prompts.py are compiled once into a format string ({{slot}} -> named field,
+# literal braces escaped), so rendering is a single str.format_map call.
+#
+# Rendered prompts are memoized in a bounded LRU keyed by the template's
+# version plus the caller's key (normalized-analysis digest and user
+# instructions). Template.version hashes the template source (and included
+# sub-templates), so it changes whenever the prompt text does and can be used
+# as a cache key by anything storing model output derived from a prompt.
+#
+# PROMPT_CACHE_SIZE  max rendered prompts kept (default 256; 0 disables)
+# ---------------------------------------------------------------------------
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import prompts
+from metrics import Counter
+
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "256"))
+
+_SLOT_RE = re.compile(r"\{\{(\w+)\}\}")
+
+CACHE_LOOKUPS = Counter(
+    "tryon_prompt_cache_lookups_total", "Rendered-prompt memo lookups, by template and result (hit/miss).",
+    ("template", "result"),
+)
+
+
+class Template:
+    """A prompt with {{slot}} placeholders, compiled once."""
+
+    __slots__ = ("name", "source", "slots", "version", "_format")
+
+    def __init__(self, name: str, source: str, includes: tuple = ()):
+        self.name = name
+        self.source = source
+        parts = _SLOT_RE.split(source)
+        self.slots = tuple(parts[1::2])
+        compiled = []
+        for i, part in enumerate(parts):
+            compiled.append("{" + part + "}" if i % 2 else part.replace("{", "{{").replace("}", "}}"))
+        self._format = "".join(compiled).format_map
+        digest = hashlib.sha256(source.encode("utf-8"))
+        for included in includes:
+            digest.update(included.version.encode("ascii"))
+        self.version = f"{name}@{digest.hexdigest()[:12]}"
+
+    def render(self, **values) -> str:
+        """Fill every slot; a missing value raises KeyError."""
+        return self._format(values)
+
+    def __repr__(self):
+        return f"<Template {self.version}>"
+
+
+class PromptMemo:
+    """Thread-safe bounded LRU of rendered prompts."""
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = PROMPT_CACHE_SIZE if maxsize is None else maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, template: Template, key: tuple, render):
+        """Return the prompt cached under (template.version, *key), calling
+        `render()` on a miss."""
+        if self.maxsize <= 0:
+            return render()
+        full_key = (template.version, *key)
+        with self._lock:
+            prompt = self._data.get(full_key)
+            if prompt is not None:
+                self._data.move_to_end(full_key)
+        if prompt is not None:
+            CACHE_LOOKUPS.inc(template=template.name, result="hit")
+            return prompt
+        CACHE_LOOKUPS.inc(template=template.name, result="miss")
+        prompt = render()
+        with self._lock:
+            self._data[full_key] = prompt
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return prompt
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+GENERATION_JEWELRY = Template("generation_jewelry", prompts.GENERATION_JEWELRY_TEMPLATE)
+GENERATION_JEWELRY_COMPACT = Template("generation_jewelry_compact", prompts.GENERATION_JEWELRY_COMPACT_TEMPLATE)
+GENERATION = Template("generation", prompts.GENERATION_TEMPLATE,
+                      includes=(GENERATION_JEWELRY, GENERATION_JEWELRY_COMPACT))
+REFINEMENT = Template("refinement", prompts.REFINEMENT_TEMPLATE)
+STANDALONE_CUSTOM = Template("standalone_custom", prompts.STANDALONE_CUSTOM_TEMPLATE)
+STANDALONE_FLATLAY = Template("standalone_flatlay", prompts.STANDALONE_FLATLAY_TEMPLATE)
+
+memo = PromptMemo()
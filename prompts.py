@@ -3,6 +3,11 @@
 # Extracted from app.py for cleaner code organization
 # ---------------------------------------------------------------------------
 
+import contextvars
+import hashlib
+import json
+import os
+
 VISION_PROMPT = """You are an ELITE visual analyst with pixel-level precision in fashion, textiles,
 jewelry, color science, and garment construction. Your output will be fed DIRECTLY into an
 AI image-generation model to PERFECTLY RECREATE this exact clothing, jewelry, and styling
@@ -665,3 +670,301 @@ Be EXTREMELY detailed. Every pattern, every color, every element.
 If you can see it, describe it. Nothing should be left out."""
 
 
+
+
+# ---------------------------------------------------------------------------
+# Generation / refinement / standalone prompt templates.
+# {{slot}} marks a per-request value; see prompt_templates.py.
+# ---------------------------------------------------------------------------
+
+GENERATION_TEMPLATE = """YOU MUST COPY THE EXACT OUTFIT FROM IMAGE 1 ONTO THE PERSON IN IMAGE 2.
+Use BOTH the source image AND the text details below to achieve 100% accuracy.
+
+═══ #1 RULE: IMAGE 1 + TEXT DETAILS = YOUR REFERENCE ═══
+ZOOM INTO IMAGE 1 and CROSS-CHECK with the text details below:
+• Every color, pattern, embroidery must EXACTLY match IMAGE 1
+• Every jewelry piece must match IMAGE 1 — correct stones, correct colors, correct design
+• If the text says GREEN stones → verify in IMAGE 1 → output GREEN stones
+• If IMAGE 1 shows dense embroidery → output must show SAME density. Do NOT simplify!
+{{user_block}}
+
+═══ DRESS DETAILS (verified from source image) ═══
+Outfit: {{dress}}
+Primary Color: {{primary}}
+{{dress_details}}
+
+═══ DRESS REPRODUCTION CHECKLIST (MUST get EVERY item right) ═══
+{{dress_checklist}}
+{{jewelry_details}}
+
+═══ JEWELRY REPRODUCTION CHECKLIST ═══
+{{jewelry_checklist}}
+{{dupatta_block}}
+
+═══ ABSOLUTE RULES — NEVER VIOLATE ═══
+1. FACE/BODY/HAIR/SKIN from IMAGE 2 → 100% UNCHANGED — do NOT alter the person
+2. CLOTHES + JEWELRY from IMAGE 1 → 100% COPIED — every detail, every color, every stone
+3. Background from IMAGE 2 (unless user says otherwise)
+4. Dress must look naturally worn — proper fit, realistic draping, natural shadows
+5. Output SINGLE photorealistic image — NEVER a collage, NEVER two people, NEVER side-by-side
+6. EMBROIDERY: Match the EXACT density and pattern from IMAGE 1. Do NOT simplify to plain fabric
+7. JEWELRY STONES: Match EXACT colors — Green=green, Red=red, Blue=blue. NEVER default to white
+8. JEWELRY SIZE: Each jewelry piece MUST be the EXACT SAME SIZE/SCALE as in IMAGE 1.
+   Big necklace → big necklace. Long earrings → long earrings. Heavy bangles → heavy bangles.
+   Do NOT shrink, enlarge, or simplify ANY jewelry piece. Match proportions EXACTLY.
+9. BORDERS/TRIM: Match EXACT width, design, and colors from IMAGE 1
+10. Every detail matters — tassels, latkans, scalloped edges, piping, dupatta borders — ALL must match
+{{user_rule}}"""
+
+GENERATION_JEWELRY_TEMPLATE = """
+
+═══ EXACT JEWELRY — PIECE BY PIECE (MUST MATCH IMAGE 1) ═══
+{{pieces}}
+🚨 These are analyzed from the ACTUAL source image. Reproduce EACH piece with these EXACT designs, colors, stone types. Do NOT default to white/clear.
+⚠️ JEWELRY SIZE RULE: Every jewelry piece MUST be the EXACT SAME SIZE as in IMAGE 1. Do NOT make jewelry smaller or larger. If the necklace is big and heavy in IMAGE 1, it must be big and heavy in the output. If earrings are long chandeliers, output long chandeliers — NOT small studs. MATCH THE SCALE EXACTLY."""
+
+# Used when the prompt is compacted to a token budget: the size/colour rules
+# repeated here are already in ABSOLUTE RULES 7-8.
+GENERATION_JEWELRY_COMPACT_TEMPLATE = """
+
+═══ EXACT JEWELRY — PIECE BY PIECE (MUST MATCH IMAGE 1) ═══
+{{pieces}}"""
+
+REFINEMENT_TEMPLATE = """REFINEMENT — Your previous attempt (IMAGE 3) had issues. Fix them.
+
+Look at the SOURCE OUTFIT (IMAGE 1) very carefully. Now compare it to your
+PREVIOUS ATTEMPT (IMAGE 3). Fix THESE specific differences:
+
+═══ ISSUES FOUND — FIX EACH ONE ═══
+{{fixes}}
+{{user_block}}
+
+═══ OUTFIT REFERENCE ═══
+Type: {{dress_type}}
+Primary Color: {{primary_color}}
+{{key_features}}
+
+═══ HOW TO FIX ═══
+1. ZOOM INTO each problem area in the SOURCE image (IMAGE 1)
+2. Compare that exact area in your PREVIOUS ATTEMPT (IMAGE 3)
+3. Edit your previous attempt to match the source — region by region
+4. EMBROIDERY: If the source shows dense, heavy embroidery — match that EXACT density.
+   Do NOT simplify to light/sparse embroidery.
+5. JEWELRY: If the source shows specific jewelry — replicate EACH piece exactly.
+   Match the metal color, stone count, chain style, and size.
+   JEWELRY MUST BE THE EXACT SAME SIZE. Do NOT shrink or enlarge any piece.
+   Big necklace = big necklace. Long earrings = long earrings. Match proportions EXACTLY.
+6. COLORS: Match the EXACT shade from the source. Not similar — IDENTICAL.
+7. Keep the PERSON (IMAGE 2) unchanged — face, skin, hair, body, pose, background.
+8. Output must be photorealistic with natural fit and proper shadows."""
+
+STANDALONE_CUSTOM_TEMPLATE = """{{user_instructions}}
+
+═══ OUTFIT TO REPRODUCE ═══
+{{outfit_details}}
+═══ END OUTFIT DETAILS ═══
+
+Use the attached photo as visual reference. Reproduce every detail with 100% accuracy."""
+
+STANDALONE_FLATLAY_TEMPLATE = """Create a flat-lay product photo of this outfit.
+
+═══ OUTFIT TO REPRODUCE ═══
+{{outfit_details}}
+═══ END OUTFIT DETAILS ═══
+
+RULES:
+- NO person, NO body, NO mannequin — ONLY the garments and jewelry
+- Lay all items flat on a white surface: dress/lehenga, blouse, dupatta, jewelry
+- Top-down / bird's eye view
+- Every detail above must match 100%: embroidery, colors, patterns, jewelry
+- Professional e-commerce product photography
+- Use the attached photo as visual reference for exact details"""
+
+
+# ---------------------------------------------------------------------------
+# Compact variants — same output contract for the fields the pipeline reads
+# (analysis_model.Analysis, the checklists, the standalone prompt), without
+# the step-by-step protocol and repeated rule blocks of the full prompts.
+# ---------------------------------------------------------------------------
+
+VISION_PROMPT_COMPACT = """You are an expert fashion and jewelry analyst. Your JSON will be used by an
+image-generation model to recreate this exact outfit and jewelry on another person.
+
+Rules:
+- Every color gets a precise shade name AND hex code, e.g. "Deep burgundy wine (#722F37)".
+  Sample the primary color from the largest evenly lit area of the base fabric.
+- Count exactly; never write "some", "several" or "many". Estimate as "approximately N".
+- Describe only what is visible; prefix uncertain details with "appears to be".
+- Give positions ("left shoulder", "along hemline") and sizes in cm.
+- Jewelry stones: zoom in and report the color you actually see. Green, red and mixed
+  kundan are common; only write white/clear if the stones are genuinely colorless.
+- Describe each garment zone (sleeves, bodice, skirt upper, skirt lower) separately —
+  embroidery patterns often differ between zones.
+
+Return ONLY a JSON object (no markdown), null for anything not present:
+{
+  "dress_type": "Garment type and sub-type",
+  "primary_color": "Shade name + hex",
+  "primary_color_hex": "#RRGGBB",
+  "secondary_colors": [{"name": "Color", "hex": "#RRGGBB", "location": "Where"}],
+  "fabric": "Type, weight, sheen, transparency",
+  "neckline": "Exact type (V = single point, sweetheart = two curves), depth, border",
+  "sleeves": "Type, length, cuff, sleeve embroidery pattern",
+  "bodice": "Fit and bodice hem shape",
+  "skirt_waistband": "Decorative band at the skirt top, or 'none'",
+  "skirt_lower": "Flare, fullness, layers",
+  "embroidery": "Zone by zone: pattern, stitch type, thread colors + hex, coverage %",
+  "border_design": "Each border band: width in cm, design, colors + hex",
+  "embellishments": "Beads, sequins, stones, mirror work, lace — counts, colors + hex, placement",
+  "latkan_tassels": "Count, position, full length, tiers, materials, or 'none'",
+  "special_design_features": "Piping, trims, scalloped edges, cutwork, ties, dupatta pin",
+  "dupatta_draping": "Path: start point -> across the body -> end point",
+  "dupatta_details": "Fabric, color + hex, border width in cm, butis",
+  "jewelry_pieces": [
+    {
+      "type": "Exact type",
+      "design_pattern": "How the elements are arranged",
+      "material_color_hex": "#RRGGBB",
+      "stones": "Per stone color: count, type, cut, observed color + hex, size in mm",
+      "pearls": "Count, size, color + hex, arrangement",
+      "enamel_meenakari": "Colors + hex, placement",
+      "dangling_elements": "What hangs, count, length, color + hex",
+      "dimensions": "Length x width in cm",
+      "visual_weight": "Light / medium / heavy / statement",
+      "description": "One sentence covering design, colors and stones"
+    }
+  ],
+  "dress_reproduction_checklist": ["Numbered top 10 dress features to get right"],
+  "jewelry_reproduction_checklist": ["Numbered top 8 jewelry features to get right"],
+  "hair_styling": "Parting, style, accessories",
+  "bindi": "Shape, size, color + hex, or 'no bindi visible'"
+}
+Use a separate jewelry_pieces entry for every piece, including each ring and any nose stud."""
+
+
+VERIFICATION_PROMPT_COMPACT = """Compare the CLOTHING and JEWELRY in two images.
+IMAGE 1 = SOURCE (the truth). IMAGE 2 = GENERATED (should match IMAGE 1).
+
+Check colors (give hex for mismatches), embroidery and beadwork density, pattern, neckline,
+sleeves, silhouette, hemline, fabric, borders, every jewelry piece (metal, stones, size,
+placement) and special features. Ignore the person, background, lighting and pose.
+
+Return ONLY JSON:
+{"match_score": 0-100, "overall_assessment": "one line",
+ "differences": [{"feature": "...", "severity": "CRITICAL or MINOR",
+                  "source_detail": "...", "generated_detail": "...", "fix_instruction": "specific fix"}]}
+Perfect match: {"match_score": 100, "overall_assessment": "Perfect match", "differences": []}"""
+
+
+VISION_EXTRACT_PROMPT_COMPACT = """Describe the outfit and jewelry in this image so an image model can recreate them.
+
+OUTFIT: garment type; exact colors with descriptive shade names; fabric; neckline, sleeves
+and fit of the top; skirt flare and layers; embroidery (work type, motifs, size, density,
+placement, thread colors); borders; dupatta (color, border, draping); tassels, latkans,
+scalloped edges, mirror or sequin work.
+
+JEWELRY, each piece separately: type, metal, stones and their colors, design, drops.
+
+Be specific and complete; skip nothing visible."""
+
+
+# Second, targeted analysis pass — asks only for the fields the first pass
+# left missing or vague (analysis_followup.py fills in {fields}).
+ANALYSIS_FOLLOWUP_PROMPT = """You already analyzed the outfit in this image. These fields came back missing or too vague:
+{fields}
+
+Look at the image again and answer ONLY these fields, as specifically as a full analysis: exact colors
+with hex codes, motifs, zones, sizes, stone colors. For a path like jewelry_pieces[necklace].stones,
+return {"jewelry_pieces": [{"type": "necklace", "stones": "..."}]}. If something truly cannot be seen,
+say what hides it.
+
+Return ONLY a JSON object with these fields. No markdown fences."""
+
+
+# Full-resolution crop of a large photo (tiling.py) — only the fine detail
+# the downsampled overview loses.
+TILE_DETAIL_PROMPT = """This is a full-resolution crop of a larger outfit photo. Describe ONLY the fine detail
+visible in this crop:
+- embroidery / zari: motifs, motif size, density, thread colors with hex codes
+- borders: width, pattern, colors with hex codes
+- embellishments: sequins, mirrors, stones, beads — type, size, colors with hex codes
+- jewelry: each piece separately — type, metal color, stone count, stone colors with hex codes, size
+
+Return ONLY a JSON object with the fields that apply, out of "embroidery", "border_design",
+"embellishments" and "jewelry_pieces" (a list of {"type", "material_color_hex", "stones",
+"design_pattern", "dimensions"}). Leave out what this crop does not show. No markdown fences."""
+
+
+# ---------------------------------------------------------------------------
+# Prompt registry — a full and a compact variant per model stage.
+#
+# The variant comes from the request (`prompt_variant` form field or
+# X-Prompt-Variant header, bound with use_variant()), else from config:
+#   PROMPT_VARIANT    default for every stage (full | compact; default full)
+#   PROMPT_VARIANTS   per-stage overrides, JSON: {"verification": "compact"}
+# Prompt.name is recorded with token usage, so the usage ledger compares
+# variants directly; Prompt.version changes whenever the text does.
+# ---------------------------------------------------------------------------
+
+VARIANTS = ("full", "compact")
+PROMPT_VARIANT = os.getenv("PROMPT_VARIANT", "full").lower()
+PROMPT_VARIANTS = json.loads(os.getenv("PROMPT_VARIANTS") or "{}")
+
+_request_variant = contextvars.ContextVar("prompt_variant", default=None)
+
+
+class Prompt:
+    __slots__ = ("stage", "variant", "name", "text", "version")
+
+    def __init__(self, stage: str, variant: str, name: str, text: str):
+        self.stage = stage
+        self.variant = variant
+        self.name = name
+        self.text = text
+        self.version = f"{name}@{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}"
+
+    def __repr__(self):
+        return f"<Prompt {self.version}>"
+
+
+REGISTRY = {
+    "analysis": {
+        "full": Prompt("analysis", "full", "VISION_PROMPT", VISION_PROMPT),
+        "compact": Prompt("analysis", "compact", "VISION_PROMPT_COMPACT", VISION_PROMPT_COMPACT),
+    },
+    "verification": {
+        "full": Prompt("verification", "full", "VERIFICATION_PROMPT", VERIFICATION_PROMPT),
+        "compact": Prompt("verification", "compact", "VERIFICATION_PROMPT_COMPACT", VERIFICATION_PROMPT_COMPACT),
+    },
+    "extraction": {
+        "full": Prompt("extraction", "full", "VISION_EXTRACT_PROMPT", VISION_EXTRACT_PROMPT),
+        "compact": Prompt("extraction", "compact", "VISION_EXTRACT_PROMPT_COMPACT", VISION_EXTRACT_PROMPT_COMPACT),
+    },
+}
+# The follow-up and tile prompts are short already; both variants use the same text.
+_followup = Prompt("followup", "full", "ANALYSIS_FOLLOWUP_PROMPT", ANALYSIS_FOLLOWUP_PROMPT)
+REGISTRY["followup"] = {"full": _followup, "compact": _followup}
+_tile = Prompt("tile", "full", "TILE_DETAIL_PROMPT", TILE_DETAIL_PROMPT)
+REGISTRY["tile"] = {"full": _tile, "compact": _tile}
+
+for _variant in [PROMPT_VARIANT, *PROMPT_VARIANTS.values()]:
+    if _variant not in VARIANTS:
+        raise ValueError(f"Unknown prompt variant {_variant!r} (expected one of {', '.join(VARIANTS)})")
+
+
+def use_variant(variant: str):
+    """Select `variant` for every stage in the current context; returns a
+    token for reset_variant(). Raises ValueError for unknown variants."""
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown prompt variant {variant!r} (expected one of {', '.join(VARIANTS)})")
+    return _request_variant.set(variant)
+
+
+def reset_variant(token):
+    _request_variant.reset(token)
+
+
+def get_prompt(stage: str, variant: str = None) -> Prompt:
+    """The prompt for `stage`: explicit variant, else the request's, else config."""
+    variant = variant or _request_variant.get() or PROMPT_VARIANTS.get(stage, PROMPT_VARIANT)
+    return REGISTRY[stage][variant]
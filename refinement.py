@@ -0,0 +1,173 @@
+# ---------------------------------------------------------------------------
+# Refinement Loop — optional correction rounds after verification.
+#
+# When verification scores a generated image below REFINE_SCORE_THRESHOLD,
+# its CRITICAL differences (only those; MINOR ones are left alone) are sent
+# back to the image model together with the previous attempt, and the
+# corrected image is verified again. A round starts only if the request
+# still has time for a generation plus a verification (at least as long as
+# the previous round took) and, with REFINE_TOKEN_BUDGET set, if the tokens
+# spent so far plus the previous round's tokens stay within it. A round
+# that scores lower than the image it corrected is discarded and ends the
+# loop.
+#
+# Each round is reported in `corrections_applied` (features and fixes sent,
+# score before/after, latency, tokens) and counted in the metrics below, so
+# the threshold and round count can be tuned against what rounds gain.
+#
+# REFINE_ROUNDS           rounds per generation by default (default 0 = off;
+#                         a request can ask for up to REFINE_MAX_ROUNDS)
+# REFINE_MAX_ROUNDS       cap on rounds per request (default 2)
+# REFINE_SCORE_THRESHOLD  scores at or above this are not refined (default 90)
+# REFINE_TOKEN_BUDGET     total tokens a request may have used for another
+#                         round to start (default 0 = unlimited)
+# ---------------------------------------------------------------------------
+
+import os
+import time
+
+import logs
+from deadline import STAGE_MIN_SECONDS, Deadline
+from metrics import Counter, Histogram
+
+REFINE_ROUNDS = int(os.getenv("REFINE_ROUNDS", "0"))
+REFINE_MAX_ROUNDS = int(os.getenv("REFINE_MAX_ROUNDS", "2"))
+REFINE_SCORE_THRESHOLD = int(os.getenv("REFINE_SCORE_THRESHOLD", "90"))
+REFINE_TOKEN_BUDGET = int(os.getenv("REFINE_TOKEN_BUDGET", "0"))
+
+log = logs.get_logger("refine")
+
+ROUNDS = Counter(
+    "tryon_refine_rounds_total", "Refinement rounds, by outcome "
+    "(improved/unchanged/regressed/unscored/failed).", ("outcome",),
+)
+STOPS = Counter(
+    "tryon_refine_stops_total", "Why refinement stopped "
+    "(threshold/no_critical/max_rounds/deadline/tokens/regressed/failed/unscored).", ("reason",),
+)
+SCORE_DELTA = Histogram(
+    "tryon_refine_score_delta", "Verification score change per scored refinement round.",
+    buckets=(-20, -10, -5, 0, 5, 10, 20, 40),
+)
+ROUND_SECONDS = Histogram(
+    "tryon_refine_round_seconds", "Wall time of a refinement round (generation + verification).",
+    buckets=(5, 10, 15, 20, 30, 45, 60, 90),
+)
+
+
+def rounds_for(requested) -> int:
+    """Rounds for a request asking for `requested` (None/'' = REFINE_ROUNDS)."""
+    try:
+        n = int(requested) if requested not in (None, "") else REFINE_ROUNDS
+    except (TypeError, ValueError):
+        n = REFINE_ROUNDS
+    return max(0, min(n, REFINE_MAX_ROUNDS))
+
+
+def critical_differences(verification: dict) -> list:
+    return [d for d in verification.get("differences") or []
+            if str(d.get("severity", "")).upper() == "CRITICAL"]
+
+
+def _tokens(records: list) -> int:
+    return sum(rec.get("total_tokens", 0) for rec in records)
+
+
+def _first_round_tokens(records: list) -> int:
+    """Tokens of the most recent generation and verification calls — what a
+    round (one of each) is expected to cost before any round has run."""
+    latest = {}
+    for rec in records:
+        stage = rec["stage"].split("_")[0]
+        if stage in ("generation", "verification"):
+            latest[stage] = rec.get("total_tokens", 0)
+    return sum(latest.values())
+
+
+def run(image: bytes, text: str, verification: dict, refine, verify, deadline: Deadline,
+        rounds: int, threshold: int = None) -> dict:
+    """Refine `image` for up to `rounds` rounds while it scores below `threshold`.
+
+    refine(image_bytes, critical_differences, deadline) -> (text, image_bytes or None)
+    verify(image_bytes, deadline) -> verification dict (match_score, differences)
+
+    Returns {image_bytes, text, verification_score, corrections_applied}
+    for the best image seen.
+    """
+    threshold = REFINE_SCORE_THRESHOLD if threshold is None else threshold
+    score = verification.get("match_score", -1)
+    corrections = []
+    expected_s = STAGE_MIN_SECONDS["generation"] + STAGE_MIN_SECONDS["verification"]
+    expected_tokens = _first_round_tokens(deadline.usage)
+    reason = "max_rounds"
+
+    for round_no in range(1, rounds + 1):
+        critical = critical_differences(verification)
+        if score < 0:
+            reason = "unscored"
+            break
+        if score >= threshold:
+            reason = "threshold"
+            break
+        if not critical:
+            reason = "no_critical"
+            break
+        if deadline.cancelled or deadline.remaining() < expected_s:
+            reason = "deadline"
+            deadline.skip(f"refinement_{round_no}")
+            break
+        if REFINE_TOKEN_BUDGET and _tokens(deadline.usage) + expected_tokens > REFINE_TOKEN_BUDGET:
+            reason = "tokens"
+            deadline.skip(f"refinement_{round_no}", reason="tokens")
+            break
+
+        log.info("Round %d: score %s, fixing %d critical difference(s)", round_no, score, len(critical),
+                 extra={"round": round_no, "score": score, "critical": len(critical)})
+        started = time.monotonic()
+        calls_before = len(deadline.usage)
+        entry = {
+            "round": round_no,
+            "score_before": score,
+            "features": [d.get("feature", "unknown") for d in critical],
+            "fixes": [d.get("fix_instruction", "") for d in critical],
+        }
+        corrections.append(entry)
+        try:
+            new_text, new_image = refine(image, critical, deadline)
+        except Exception as e:
+            log.warning("Round %d failed: %s", round_no, e, extra={"round": round_no})
+            new_image, entry["error"] = None, str(e)[:200]
+        new_verification = verify(new_image, deadline) if new_image is not None else {}
+        new_score = new_verification.get("match_score", -1)
+
+        entry["latency_s"] = round(time.monotonic() - started, 3)
+        entry["tokens"] = _tokens(deadline.usage[calls_before:])
+        entry["score_after"] = new_score
+        ROUND_SECONDS.observe(entry["latency_s"])
+        expected_s = max(expected_s, entry["latency_s"])
+        expected_tokens = entry["tokens"] or expected_tokens
+
+        if new_image is None:
+            outcome = reason = "failed"
+        elif new_score < 0:
+            outcome = reason = "unscored"
+        else:
+            entry["score_delta"] = new_score - score
+            SCORE_DELTA.observe(entry["score_delta"])
+            outcome = ("improved" if new_score > score else "unchanged" if new_score == score else "regressed")
+        ROUNDS.inc(outcome=outcome)
+        entry["kept"] = outcome in ("improved", "unchanged")
+        log.info("Round %d: %s → %s (%s, %.1fs)", round_no, score, new_score, outcome, entry["latency_s"],
+                 extra={"round": round_no, "score_before": score, "score_after": new_score, "outcome": outcome})
+        if not entry["kept"]:
+            if outcome == "regressed":
+                reason = "regressed"
+            break
+        image, text, verification, score = new_image, new_text or text, new_verification, new_score
+    else:
+        if rounds:
+            reason = "threshold" if score >= threshold else "max_rounds"
+
+    if rounds:
+        STOPS.inc(reason=reason)
+    return {"image_bytes": image, "text": text, "verification_score": score, "corrections_applied": corrections}
@@ -0,0 +1,453 @@
+# ---------------------------------------------------------------------------
+# Shared Cache — one cache tier for every gunicorn worker (and restart), so
+# hit rates do not drop as workers are added.
+#
+# Backends, chosen by SHARED_CACHE_URL:
+#   sqlite:<path>             local-disk SQLite in WAL mode, shared by all
+#                             workers on the host; LRU-evicted to SHARED_CACHE_MAX_MB
+#   redis://host:port[/db]    any Redis-protocol server (a minimal RESP client,
+#                             no extra dependency); size bounded by the server's
+#                             maxmemory policy (use allkeys-lru)
+#   (empty)                   disabled: get_or_compute() always computes
+#
+# get_or_compute() is atomic across workers: the first caller takes a
+# short-lived lock on the key and computes, the others wait for its value
+# (up to their own wait budget, or until cancelled) instead of repeating the
+# model call.
+# Hit/miss/compute/wait counts are kept per namespace in the backend, so
+# stats() covers all workers; they are flushed every few seconds.
+#
+# SHARED_CACHE_URL     backend (default sqlite:data/cache.sqlite3)
+# SHARED_CACHE_MAX_MB  SQLite size bound (default 256)
+# SHARED_CACHE_TTL     seconds entries live (default 604800 = 7 days)
+# ---------------------------------------------------------------------------
+
+import atexit
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import logs
+from metrics import Counter
+
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "sqlite:" + os.path.join("data", "cache.sqlite3"))
+SHARED_CACHE_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", "256"))
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", str(7 * 24 * 3600)))
+
+log = logs.get_logger("cache")
+
+LOCK_SECONDS = 120.0
+_POLL_SECONDS = 0.1
+_STATS_FLUSH_SECONDS = 5.0
+
+CACHE_OPS = Counter(
+    "tryon_shared_cache_ops_total", "Shared cache operations in this worker, by namespace and result "
+    "(hit/miss/compute/wait/error).", ("namespace", "result"),
+)
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return b"b" + value
+    return b"j" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def _decode(data: bytes):
+    return data[1:] if data[:1] == b"b" else json.loads(data[1:].decode("utf-8"))
+
+
+class SharedCache:
+    """Backend-independent part: get_or_compute and buffered stats."""
+
+    def __init__(self):
+        self.owner = uuid.uuid4().hex
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._stats_flushed = time.monotonic()
+
+    # Backends implement these.
+    def _get(self, ns: str, key: str) -> bytes | None: ...
+    def _set(self, ns: str, key: str, data: bytes, ttl: float): ...
+    def _lock(self, ns: str, key: str, seconds: float) -> bool: ...
+    def _unlock(self, ns: str, key: str): ...
+    def _flush_stats(self, deltas: dict): ...
+    def _read_stats(self) -> dict: ...
+
+    def _count(self, ns: str, result: str):
+        CACHE_OPS.inc(namespace=ns, result=result)
+        with self._stats_lock:
+            self._stats[(ns, result)] = self._stats.get((ns, result), 0) + 1
+            if time.monotonic() - self._stats_flushed < _STATS_FLUSH_SECONDS:
+                return
+        self.flush()
+
+    def get(self, ns: str, key: str):
+        """Cached value or None."""
+        try:
+            data = self._get(ns, key)
+        except Exception as e:
+            self._count(ns, "error")
+            log.warning("Cache get %s failed: %s", ns, e)
+            return None
+        self._count(ns, "miss" if data is None else "hit")
+        return None if data is None else _decode(data)
+
+    def set(self, ns: str, key: str, value, ttl: float = None):
+        try:
+            self._set(ns, key, _encode(value), ttl or SHARED_CACHE_TTL)
+        except Exception as e:
+            self._count(ns, "error")
+            log.warning("Cache set %s failed: %s", ns, e)
+
+    def get_or_compute(self, ns: str, key: str, compute, ttl: float = None, wait_timeout: float = 30.0,
+                       cancelled=None):
+        """Cached value, else `compute()` stored under the key. Only one worker
+        computes a key at a time; others wait up to `wait_timeout` seconds for
+        its value and then compute themselves. Exceptions are not cached.
+        A waiter also stops as soon as `cancelled()` is true, and calls
+        `compute()` at once (which should raise for a cancelled request)."""
+        value = self.get(ns, key)
+        if value is not None:
+            return value
+        give_up = time.monotonic() + wait_timeout
+        waited = False
+        while True:
+            try:
+                locked = self._lock(ns, key, LOCK_SECONDS)
+            except Exception as e:
+                log.warning("Cache lock %s failed: %s", ns, e)
+                locked = None
+            if locked or locked is None or time.monotonic() >= give_up:
+                break
+            if cancelled is not None and cancelled():
+                break
+            if not waited:
+                self._count(ns, "wait")
+                waited = True
+            time.sleep(_POLL_SECONDS)
+            data = self._get_quiet(ns, key)
+            if data is not None:
+                self._count(ns, "hit")
+                return _decode(data)
+        try:
+            if locked and waited:
+                data = self._get_quiet(ns, key)
+                if data is not None:
+                    return _decode(data)
+            self._count(ns, "compute")
+            value = compute()
+            if value is not None:
+                self.set(ns, key, value, ttl)
+            return value
+        finally:
+            if locked:
+                try:
+                    self._unlock(ns, key)
+                except Exception as e:
+                    log.warning("Cache unlock %s failed: %s", ns, e)
+
+    def _get_quiet(self, ns: str, key: str) -> bytes | None:
+        try:
+            return self._get(ns, key)
+        except Exception:
+            return None
+
+    def flush(self):
+        """Write this worker's pending counters to the backend."""
+        with self._stats_lock:
+            deltas, self._stats = self._stats, {}
+            self._stats_flushed = time.monotonic()
+        if deltas:
+            try:
+                self._flush_stats(deltas)
+            except Exception as e:
+                log.warning("Cache stats flush failed: %s", e)
+
+    def stats(self) -> dict:
+        """namespace -> counters summed over all workers (plus entries/bytes
+        where the backend can report them)."""
+        self.flush()
+        return self._read_stats()
+
+
+# ---------------------------------------------------------------------------
+# SQLite backend
+# ---------------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns          TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    value       BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    expires_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS locks (
+    ns         TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    ns     TEXT NOT NULL,
+    name   TEXT NOT NULL,
+    value  INTEGER NOT NULL,
+    PRIMARY KEY (ns, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO size VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_size_ins AFTER INSERT ON entries
+    BEGIN UPDATE size SET bytes = bytes + NEW.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS entries_size_del AFTER DELETE ON entries
+    BEGIN UPDATE size SET bytes = bytes - OLD.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS entries_size_upd AFTER UPDATE OF size ON entries
+    BEGIN UPDATE size SET bytes = bytes - OLD.size + NEW.size WHERE id = 0; END;
+"""
+
+# Reads refresh an entry's LRU position at most this often (it costs a write).
+_TOUCH_SECONDS = 60.0
+# Eviction frees space down to this share of the size bound.
+_LOW_WATER = 0.9
+
+
+class SQLiteCache(SharedCache):
+    """Local-disk cache shared by every process on the host."""
+
+    def __init__(self, path: str, max_bytes: int):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, ns, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM entries WHERE ns = ? AND key = ?",
+                           (ns, key)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            with conn:
+                conn.execute("DELETE FROM entries WHERE ns = ? AND key = ? AND expires_at < ?", (ns, key, now))
+            return None
+        if now - row[2] > _TOUCH_SECONDS:
+            with conn:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE ns = ? AND key = ?", (now, ns, key))
+        return row[0]
+
+    def _set(self, ns, key, data, ttl):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO entries (ns, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+                " expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                (ns, key, data, len(data), now + ttl, now),
+            )
+            evicted = 0
+            total = conn.execute("SELECT bytes FROM size WHERE id = 0").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop the least recently used prefix that brings the cache
+                # down to the low-water mark, so eviction runs rarely.
+                evicted = conn.execute(
+                    "DELETE FROM entries WHERE (ns, key) IN (SELECT ns, key FROM ("
+                    "  SELECT ns, key, size, sum(size) OVER (ORDER BY accessed_at ROWS UNBOUNDED PRECEDING) AS running"
+                    "  FROM entries WHERE NOT (ns = ? AND key = ?)) WHERE running - size < ?)",
+                    (ns, key, total - int(self.max_bytes * _LOW_WATER)),
+                ).rowcount
+        if evicted:
+            CACHE_OPS.inc(evicted, namespace=ns, result="evict")
+
+    def _lock(self, ns, key, seconds):
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "INSERT INTO locks (ns, key, owner, expires_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (ns, key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE locks.expires_at < ?",
+                (ns, key, self.owner, now + seconds, now),
+            ).rowcount == 1
+
+    def _unlock(self, ns, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM locks WHERE ns = ? AND key = ? AND owner = ?", (ns, key, self.owner))
+
+    def _flush_stats(self, deltas):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO stats (ns, name, value) VALUES (?, ?, ?)"
+                " ON CONFLICT (ns, name) DO UPDATE SET value = value + excluded.value",
+                [(ns, name, n) for (ns, name), n in deltas.items()],
+            )
+
+    def _read_stats(self):
+        conn = self._connect()
+        stats = {}
+        for ns, entries, size in conn.execute("SELECT ns, count(*), sum(size) FROM entries GROUP BY ns"):
+            stats[ns] = {"entries": entries, "bytes": size}
+        for ns, name, value in conn.execute("SELECT ns, name, value FROM stats"):
+            stats.setdefault(ns, {})[name] = value
+        return stats
+
+
+# ---------------------------------------------------------------------------
+# Redis-protocol backend
+# ---------------------------------------------------------------------------
+
+class RedisError(Exception):
+    pass
+
+
+_UNLOCK_SCRIPT = 'if redis.call("GET", KEYS[1]) == ARGV[1] then return redis.call("DEL", KEYS[1]) end return 0'
+
+
+class RedisCache(SharedCache):
+    """Minimal RESP2 client: GET, SET (PX/NX), DEL, EVAL, HINCRBY, HGETALL, SMEMBERS.
+    One connection per thread, reopened after any I/O error."""
+
+    def __init__(self, url: str, prefix: str = "tryon:cache:"):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _sock(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=5)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _command(self, *args):
+        sock, reader = self._sock()
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock.sendall(b"".join(out))
+            return self._reply(reader)
+        except (OSError, EOFError):
+            self._local.conn = None
+            sock.close()
+            raise
+
+    def _reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise EOFError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = reader.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._reply(reader) for _ in range(count)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def _k(self, ns, key) -> str:
+        return f"{self.prefix}{ns}:{key}"
+
+    def _get(self, ns, key):
+        return self._command("GET", self._k(ns, key))
+
+    def _set(self, ns, key, data, ttl):
+        self._command("SET", self._k(ns, key), data, "PX", int(ttl * 1000))
+
+    def _lock(self, ns, key, seconds):
+        return self._command("SET", self._k(ns, key) + ":lock", self.owner, "NX", "PX", int(seconds * 1000)) == "OK"
+
+    def _unlock(self, ns, key):
+        # Compare-and-delete in one step: a separate GET then DEL could delete
+        # a lock that expired in between and was taken by another worker.
+        self._command("EVAL", _UNLOCK_SCRIPT, "1", self._k(ns, key) + ":lock", self.owner)
+
+    def _flush_stats(self, deltas):
+        for (ns, name), n in deltas.items():
+            self._command("SADD", self.prefix + "namespaces", ns)
+            self._command("HINCRBY", f"{self.prefix}stats:{ns}", name, n)
+
+    def _read_stats(self):
+        stats = {}
+        for ns in self._command("SMEMBERS", self.prefix + "namespaces") or ():
+            ns = ns.decode()
+            flat = self._command("HGETALL", f"{self.prefix}stats:{ns}") or []
+            stats[ns] = {flat[i].decode(): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+        return stats
+
+
+# ---------------------------------------------------------------------------
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def from_url(url: str) -> SharedCache | None:
+    if not url:
+        return None
+    if url.startswith("redis://"):
+        return RedisCache(url)
+    if url.startswith("sqlite:"):
+        return SQLiteCache(url[len("sqlite:"):], int(SHARED_CACHE_MAX_MB * 1024 * 1024))
+    raise ValueError(f"Unsupported SHARED_CACHE_URL: {url}")
+
+
+def get_cache() -> SharedCache | None:
+    """The process-wide cache, or None when SHARED_CACHE_URL is empty."""
+    global _cache
+    if _cache is None and SHARED_CACHE_URL:
+        with _cache_lock:
+            if _cache is None:
+                _cache = from_url(SHARED_CACHE_URL)
+                atexit.register(_cache.flush)
+                log.info("Shared cache: %s", SHARED_CACHE_URL.split("@")[-1])
+    return _cache
+
+
+def get_or_compute(ns: str, key: str, compute, ttl: float = None, wait_timeout: float = 30.0,
+                   cancelled=None):
+    """get_or_compute() on the shared cache; just compute() when it is disabled."""
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(ns, key, compute, ttl, wait_timeout, cancelled)
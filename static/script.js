@@ -8,6 +8,8 @@ let sourceImageFile = null;
 let targetImageFile = null;
 let sourceImageDataUrl = null;
 let analysisData = null;  // Stores the extracted JSON from vision analysis
+let analyzeRequest = null;   // { id, controller } of the in-flight analysis
+let generateRequest = null;  // { id, controller } of the in-flight generation
 
 // DOM Elements
 const sourceUpload = document.getElementById('source-upload');
@@ -22,6 +24,27 @@ const statusBar = document.getElementById('status-bar');
 const statusText = document.getElementById('status-text');
 const genText = document.getElementById('generation-text');
 
+// ---------------------------------------------------------------
+// Request Cancellation — tell the server to stop work no one will read
+// ---------------------------------------------------------------
+
+function startRequest() {
+    const id = (crypto.randomUUID && crypto.randomUUID()) ||
+        `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    return { id, controller: new AbortController() };
+}
+
+function cancelRequest(req) {
+    if (!req) return;
+    req.controller.abort();
+    navigator.sendBeacon(`/api/cancel/${req.id}`);
+}
+
+window.addEventListener('pagehide', () => {
+    cancelRequest(analyzeRequest);
+    cancelRequest(generateRequest);
+});
+
 // ---------------------------------------------------------------
 // Upload Zone Handlers
 // ---------------------------------------------------------------
@@ -184,36 +207,56 @@ async function analyzeSource() {
     showStatus('info', '🔍 Analyzing outfit — extracting dress & jewelry details...');
     generateBtn.disabled = true;
 
+    // A new source image supersedes any analysis still running
+    cancelRequest(analyzeRequest);
+    const req = analyzeRequest = startRequest();
+
     const formData = new FormData();
     formData.append('image', sourceImageFile);
+    formData.append('request_id', req.id);
+    formData.append('stream', '1');
 
     try {
         const resp = await fetch('/api/analyze', {
             method: 'POST',
             body: formData,
+            signal: req.controller.signal,
         });
 
-        const data = await resp.json();
-
-        if (!resp.ok || data.error) {
-            throw new Error(data.error || 'Analysis failed');
-        }
-
-        // Store analysis data
-        analysisData = data.details;
+        // Weak fields trigger a follow-up: the first pass arrives as the first
+        // NDJSON line, the followed-up analysis as the second.
+        let first = true;
+        await readJsonMessages(resp, data => {
+            if (!resp.ok || data.error) {
+                throw new Error(data.error || 'Analysis failed');
+            }
 
-        // Display JSON beautifully
-        jsonContent.textContent = JSON.stringify(analysisData, null, 2);
-        analysisStatus.textContent = '✅ Done';
-        analysisStatus.className = 'analysis-status done';
+            // Store analysis data
+            analysisData = data.details;
+
+            // Display JSON beautifully
+            jsonContent.textContent = JSON.stringify(analysisData, null, 2);
+            if (data.followup === 'pending') {
+                analysisStatus.textContent = `✅ Done — checking ${data.weak_fields.length} vague field(s)...`;
+            } else if (data.filled && data.filled.length > 0) {
+                analysisStatus.textContent = `✅ Done — ${data.filled.length} field(s) filled in`;
+            } else {
+                analysisStatus.textContent = '✅ Done';
+            }
+            analysisStatus.className = 'analysis-status done';
 
-        completePipelineStep('pipe-analyze');
-        checkReady();
+            if (first) {
+                first = false;
+                completePipelineStep('pipe-analyze');
+                checkReady();
 
-        // Scroll to analysis
-        analysisSection.scrollIntoView({ behavior: 'smooth', block: 'center' });
+                // Scroll to analysis
+                analysisSection.scrollIntoView({ behavior: 'smooth', block: 'center' });
+            }
+        });
 
     } catch (err) {
+        if (err.name === 'AbortError') return;  // superseded by a newer upload
         jsonContent.textContent = `❌ Analysis failed: ${err.message}\n\nYou can still try generating — click Generate.`;
         analysisStatus.textContent = '❌ Failed';
         analysisStatus.className = 'analysis-status failed';
@@ -225,7 +268,29 @@ async function analyzeSource() {
             generateBtn.disabled = false;
         }
         resetPipeline();
+    } finally {
+        if (analyzeRequest === req) analyzeRequest = null;
+    }
+}
+
+// Calls onMessage for a JSON body, or for each line of an NDJSON stream.
+async function readJsonMessages(resp, onMessage) {
+    if (!(resp.headers.get('Content-Type') || '').includes('ndjson')) {
+        onMessage(await resp.json());
+        return;
+    }
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => onMessage(JSON.parse(line)));
+        if (done) break;
     }
+    if (buffered.trim()) onMessage(JSON.parse(buffered));
 }
 
 // ---------------------------------------------------------------
@@ -235,6 +300,10 @@ async function analyzeSource() {
 generateBtn.addEventListener('click', async () => {
     if (!sourceImageFile) return;
 
+    // Re-clicking Generate supersedes the previous generation
+    cancelRequest(generateRequest);
+    const req = generateRequest = startRequest();
+
     const hasTarget = !!targetImageFile;
     const modeLabel = hasTarget ? 'copying outfit onto target' : 'reproducing dress from source';
 
@@ -265,15 +334,17 @@ generateBtn.addEventListener('click', async () => {
         formData.append('target_image', targetImageFile);
     }
     formData.append('user_instructions', userInstructions);
+    formData.append('request_id', req.id);
 
     // Send analysis JSON if available
     if (analysisData) {
         formData.append('analysis_json', JSON.stringify(analysisData));
     }
 
+    let statusUpdater = null;
     try {
         // Update status during the long wait
-        const statusUpdater = setInterval(() => {
+        statusUpdater = setInterval(() => {
             const current = statusText.textContent;
             if (current.includes('Generating')) {
                 showStatus('info', '🔍 Verifying dress details against source...');
@@ -287,6 +358,7 @@ generateBtn.addEventListener('click', async () => {
         const resp = await fetch('/api/generate-direct', {
             method: 'POST',
             body: formData,
+            signal: req.controller.signal,
         });
 
         clearInterval(statusUpdater);
@@ -347,6 +419,7 @@ generateBtn.addEventListener('click', async () => {
         }, 3000);
 
     } catch (err) {
+        if (err.name === 'AbortError') return;  // superseded by a newer click
         showStatus('error', `Generation failed: ${err.message}`);
         generatedDisplay.innerHTML = `
             <div class="output-placeholder">
@@ -360,8 +433,12 @@ generateBtn.addEventListener('click', async () => {
         }
         console.error(err);
     } finally {
-        generateBtn.disabled = false;
-        generateBtn.classList.remove('loading');
+        clearInterval(statusUpdater);
+        if (generateRequest === req) {
+            generateRequest = null;
+            generateBtn.disabled = false;
+            generateBtn.classList.remove('loading');
+        }
     }
 });
 
@@ -414,6 +491,9 @@ function showCorrectionsLog(corrections, finalScore) {
             <div class="round-header">
                 <span class="round-badge">Round ${round.round}</span>
                 <span class="round-score">Score before: ${round.score_before}%</span>
+                ${round.score_after >= 0
+                    ? `<span class="round-score">After: ${round.score_after}%${round.kept ? '' : ' (discarded)'} · ${round.latency_s}s</span>`
+                    : ''}
             </div>
             <div class="round-fixes">`;
 
@@ -0,0 +1,295 @@
+# ---------------------------------------------------------------------------
+# Tiled Analysis — fine detail from high-resolution photos without sending
+# the full image.
+#
+# The model sees a large upload downsampled, so zari work and stone counts
+# are lost, while sending it whole is slow. In tiled mode the source is cut
+# (Pillow) into a low-res overview plus a few full-resolution crops:
+#   detail  crops where a cheap local detail map (gradient energy of a
+#           small grayscale copy) is densest, picked greedily so each crop
+#           adds detail the earlier ones do not cover
+#   grid    an even grid over the whole image
+# The overview gets the normal analysis, every crop a short detail prompt,
+# all concurrently; crop answers are fused into the overview's analysis the
+# way extra views are (multi_view.fuse, labelled by their position). The
+# report has per-part latency and tokens, and with a full-image comparison
+# requested, the same for a normal analysis of the untouched upload.
+#
+# TILED_ANALYSIS    1 = tile every /api/analyze upload (default 0; a request
+#                   can ask with `tiled=1`)
+# TILE_MODE         detail | grid (default detail)
+# TILE_COUNT        high-res crops per image (default 4)
+# TILE_SIZE_PX      crop side in source pixels, also the largest side a crop
+#                   is sent at (default 1024)
+# TILE_OVERVIEW_PX  largest side of the overview (default 1024); sources not
+#                   clearly larger than this are analyzed normally
+#
+#   python tiling.py photo.jpg --out tiles/     # preview the crops
+# ---------------------------------------------------------------------------
+
+import argparse
+import contextvars
+import io
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import logs
+import multi_view
+from analysis_model import Analysis, completeness
+from deadline import Deadline
+from lazy_imports import LazyModule
+from metrics import Counter
+
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+
+TILED_ANALYSIS = os.getenv("TILED_ANALYSIS", "0") == "1"
+TILE_MODE = os.getenv("TILE_MODE", "detail").lower()
+TILE_COUNT = int(os.getenv("TILE_COUNT", "4"))
+TILE_SIZE_PX = int(os.getenv("TILE_SIZE_PX", "1024"))
+TILE_OVERVIEW_PX = int(os.getenv("TILE_OVERVIEW_PX", "1024"))
+
+MODES = ("detail", "grid")
+
+# Sources up to this factor above the overview size are not worth tiling.
+_MIN_UPSCALE = 1.25
+# Width of the detail map; the most of its area a crop may share with an
+# earlier one; crops adding less than this share of the first crop's detail
+# are not worth a call.
+_MAP_PX = 768
+_MAX_OVERLAP = 1 / 3
+_MIN_SHARE = 0.15
+_JPEG_QUALITY = 90
+_POLL_SECONDS = 0.25
+
+log = logs.get_logger("tiling")
+
+TILED = Counter("tryon_tiled_analyses_total", "Tiled analyses, by outcome (tiled/too_small/failed).", ("outcome",))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TILE_THREADS", "16")), thread_name_prefix="tile")
+
+
+def _jpeg(img, max_side: int) -> bytes:
+    img = img.convert("RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=_JPEG_QUALITY)
+    return out.getvalue()
+
+
+def _detail_boxes(img, count: int, side: int) -> list[tuple]:
+    """Up to `count` side x side boxes (source pixels) over the densest detail."""
+    width, height = img.size
+    scale = _MAP_PX / width
+    small = img.convert("L").resize((_MAP_PX, max(1, round(height * scale))), Image.BILINEAR)
+    gray = np.asarray(small, dtype=np.float32)
+    energy = np.zeros_like(gray)
+    energy[1:-1, 1:-1] = np.hypot(gray[1:-1, 2:] - gray[1:-1, :-2], gray[2:, 1:-1] - gray[:-2, 1:-1])
+    win = max(1, min(round(side * scale), *gray.shape))
+    picked = []
+    first = None
+    allowed = None
+    for _ in range(count):
+        # Window sums for every position from an integral image.
+        integral = np.pad(energy, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+        sums = integral[win:, win:] - integral[:-win, win:] - integral[win:, :-win] + integral[:-win, :-win]
+        if allowed is None:
+            ys, xs = np.indices(sums.shape)
+            allowed = np.ones(sums.shape, dtype=bool)
+        sums = np.where(allowed, sums, -1.0)
+        y, x = np.unravel_index(int(sums.argmax()), sums.shape)
+        score = float(sums[y, x])
+        first = first or score
+        if score <= 0 or score < _MIN_SHARE * first:
+            break
+        picked.append((int(x), int(y)))
+        # Detail already covered does not count again, so crops spread out.
+        energy[y:y + win, x:x + win] = 0
+        shared = np.clip(win - np.abs(xs - x), 0, None) * np.clip(win - np.abs(ys - y), 0, None)
+        allowed &= shared <= _MAX_OVERLAP * win * win
+    boxes = []
+    for x, y in picked:
+        left = min(round(x / scale), width - side)
+        top = min(round(y / scale), height - side)
+        boxes.append((max(0, left), max(0, top), max(0, left) + side, max(0, top) + side))
+    return boxes
+
+
+def _grid_boxes(img, count: int) -> list[tuple]:
+    width, height = img.size
+    cols = max(1, round(math.sqrt(count * width / height)))
+    rows = max(1, math.ceil(count / cols))
+    return [(c * width // cols, r * height // rows, (c + 1) * width // cols, (r + 1) * height // rows)
+            for r in range(rows) for c in range(cols)]
+
+
+def _position(box: tuple, size: tuple) -> str:
+    """'upper left', 'center', ... for the middle of `box`."""
+    cx = (box[0] + box[2]) / 2 / size[0]
+    cy = (box[1] + box[3]) / 2 / size[1]
+    vertical = "upper" if cy < 1 / 3 else "lower" if cy > 2 / 3 else ""
+    horizontal = "left" if cx < 1 / 3 else "right" if cx > 2 / 3 else ""
+    return f"{vertical} {horizontal}".strip() or "center"
+
+
+def make_tiles(image_bytes: bytes, mode: str = None, count: int = None) -> dict:
+    """Cut an image into {source_px, overview, overview_px, tiles: [{box, label, image_bytes}]}.
+    `tiles` is empty when the source is too small to gain from tiling."""
+    mode = mode or TILE_MODE
+    count = TILE_COUNT if count is None else count
+    if mode not in MODES:
+        raise ValueError(f"Unknown tile mode {mode!r} (expected one of {', '.join(MODES)})")
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    overview = _jpeg(img, TILE_OVERVIEW_PX)
+    result = {"source_px": list(img.size), "overview": overview,
+              "overview_px": list(Image.open(io.BytesIO(overview)).size), "tiles": []}
+    if max(img.size) < TILE_OVERVIEW_PX * _MIN_UPSCALE or count < 1:
+        return result
+    side = min(TILE_SIZE_PX, *img.size)
+    boxes = _detail_boxes(img, count, side) if mode == "detail" else _grid_boxes(img, count)
+    for i, box in enumerate(boxes, 1):
+        result["tiles"].append({
+            "box": list(box),
+            "label": f"crop {i}, {_position(box, img.size)}",
+            "image_bytes": _jpeg(img.crop(box), TILE_SIZE_PX),
+        })
+    return result
+
+
+def _tokens(deadline: Deadline) -> int:
+    return sum(rec.get("total_tokens", 0) for rec in deadline.usage)
+
+
+def _timed(fn, *args):
+    started = time.monotonic()
+    return fn(*args), time.monotonic() - started
+
+
+def analyze(image_bytes: bytes, mime_type: str, analyze_overview, analyze_tile, merge, deadline: Deadline,
+            mode: str = None, count: int = None, compare_full=None) -> tuple[dict, dict] | None:
+    """Tiled analysis of `image_bytes`: (analysis dict, report), or None when
+    the image is too small to tile (analyze it normally).
+
+    analyze_overview(image_bytes, mime_type, deadline) -> analysis dict
+    analyze_tile(image_bytes, deadline) -> detail dict
+    merge(base_dict, updates_dict) -> merged dict (app._deep_merge)
+    compare_full(image_bytes, mime_type, deadline) -> analysis dict, run
+        concurrently on the untouched upload for the report (optional)
+    """
+    started = time.monotonic()
+    try:
+        plan = make_tiles(image_bytes, mode, count)
+    except Exception as e:
+        log.warning("Cannot tile image: %s", e)
+        TILED.inc(outcome="failed")
+        return None
+    if not plan["tiles"]:
+        TILED.inc(outcome="too_small")
+        return None
+    cut_s = time.monotonic() - started
+
+    # One child deadline per part, so each part's tokens can be reported.
+    parts = [("overview", analyze_overview, (plan["overview"], "image/jpeg"))]
+    parts += [(tile["label"], analyze_tile, (tile["image_bytes"],)) for tile in plan["tiles"]]
+    if compare_full is not None:
+        parts.append(("full", compare_full, (image_bytes, mime_type)))
+    children = [deadline.child() for _ in parts]
+    # Carry the request context (log request ID, prompt variant) into the workers.
+    futures = {_executor.submit(contextvars.copy_context().run, _timed, fn, *args, child): i
+               for i, ((_, fn, args), child) in enumerate(zip(parts, children))}
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if deadline.cancelled:
+            for child in children:
+                child.abandon()
+            break
+
+    outcomes = [None] * len(parts)
+    for future, i in futures.items():
+        try:
+            outcomes[i] = future.result()
+        except Exception as e:
+            outcomes[i] = e
+    for child in children:
+        deadline.absorb(child)
+        deadline.skipped_stages.extend(s for s in child.skipped_stages
+                                       if s["reason"] not in ("cancelled", "abandoned"))
+    if isinstance(outcomes[0], Exception):
+        TILED.inc(outcome="failed")
+        raise outcomes[0]
+
+    overview, overview_s = outcomes[0]
+    views = [("overview", Analysis.from_dict(overview))]
+    tile_reports = []
+    for tile, child, outcome in zip(plan["tiles"], children[1:], outcomes[1:]):
+        report = {"label": tile["label"], "box": tile["box"], "bytes": len(tile["image_bytes"]),
+                  "tokens": _tokens(child)}
+        if isinstance(outcome, Exception):
+            report["error"] = str(outcome)[:200]
+        else:
+            detail, report["latency_s"] = outcome[0], round(outcome[1], 3)
+            if isinstance(detail, dict):
+                views.append((tile["label"], Analysis.from_dict(detail)))
+        tile_reports.append(report)
+    fused = Analysis.from_dict(multi_view.fuse(views, merge))
+
+    tiled_parts = outcomes[:1 + len(plan["tiles"])]
+    report = {
+        "mode": mode or TILE_MODE,
+        "source_px": plan["source_px"],
+        "overview_px": plan["overview_px"],
+        "cut_s": round(cut_s, 3),
+        "latency_s": round(cut_s + max(o[1] for o in tiled_parts if not isinstance(o, Exception)), 3),
+        "tokens": sum(_tokens(child) for child in children[:len(tiled_parts)]),
+        "bytes": len(plan["overview"]) + sum(t["bytes"] for t in tile_reports),
+        "overview": {"latency_s": round(overview_s, 3), "tokens": _tokens(children[0])},
+        "tiles": tile_reports,
+        "completeness": {"overview": completeness(views[0][1]), "tiled": completeness(fused)},
+    }
+    if compare_full is not None:
+        full = outcomes[-1]
+        report["full_image"] = {"bytes": len(image_bytes), "tokens": _tokens(children[-1])}
+        if isinstance(full, Exception):
+            report["full_image"]["error"] = str(full)[:200]
+        else:
+            report["full_image"]["latency_s"] = round(full[1], 3)
+            report["completeness"]["full_image"] = completeness(Analysis.from_dict(full[0]))
+    TILED.inc(outcome="tiled")
+    log.info("Tiled analysis: %d crop(s), %.2fs, %d tokens", len(plan["tiles"]), report["latency_s"],
+             report["tokens"], extra={"tiles": len(plan["tiles"]), "tokens": report["tokens"]})
+    return fused.to_dict(), report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview the overview and crops tiled analysis would send.")
+    parser.add_argument("image")
+    parser.add_argument("--out", default="tiles", help="directory for overview.jpg and the crops")
+    parser.add_argument("--mode", choices=MODES, default=TILE_MODE)
+    parser.add_argument("--count", type=int, default=TILE_COUNT)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    started = time.perf_counter()
+    plan = make_tiles(data, args.mode, args.count)
+    elapsed = time.perf_counter() - started
+    os.makedirs(args.out, exist_ok=True)
+    with open(os.path.join(args.out, "overview.jpg"), "wb") as f:
+        f.write(plan["overview"])
+    print(f"source {plan['source_px']}, overview {plan['overview_px']} ({len(plan['overview'])} bytes), "
+          f"cut in {elapsed * 1000:.0f} ms")
+    for i, tile in enumerate(plan["tiles"], 1):
+        with open(os.path.join(args.out, f"tile{i}.jpg"), "wb") as f:
+            f.write(tile["image_bytes"])
+        print(f"  tile{i}.jpg  {tile['box']}  {tile['label']}  {len(tile['image_bytes'])} bytes")
+    if not plan["tiles"]:
+        print("  (source too small to tile — analyzed normally)")
+
+
+if __name__ == "__main__":
+    main()
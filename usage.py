@@ -0,0 +1,175 @@
+# ---------------------------------------------------------------------------
+# Token Usage & Cost — captures `usage_metadata` from every Gemini call,
+# totals it per request, exports it as metrics and appends it to a ledger.
+#
+# Offline summary of the ledger:
+#     python usage.py                       # by stage
+#     python usage.py --by prompt           # stage | model | prompt | route
+#     python usage.py data/usage_ledger.jsonl --since 2026-03-01
+# ---------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+import logs
+from metrics import Counter, route_label
+
+LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", os.path.join("data", "usage_ledger.jsonl"))
+
+# USD per 1M tokens (input, output). Approximate list prices — override with
+# USAGE_PRICES_JSON='{"model": [input, output], ...}'.
+PRICES_PER_MILLION = {
+    "gemini-3-flash-preview": (0.50, 3.00),
+    "gemini-2.5-flash-image": (0.30, 30.00),
+    "gemini-3-pro-image-preview": (2.00, 120.00),
+}
+PRICES_PER_MILLION.update({k: tuple(v) for k, v in json.loads(os.getenv("USAGE_PRICES_JSON", "{}")).items()})
+
+TOKENS = Counter(
+    "tryon_tokens_total", "Gemini tokens by stage, model and kind (input/output/thoughts).",
+    ("route", "stage", "model", "kind"),
+)
+COST = Counter(
+    "tryon_cost_usd_total", "Estimated Gemini cost in USD.",
+    ("route", "stage", "model"),
+)
+
+_ledger_lock = threading.Lock()
+log = logs.get_logger("usage")
+
+
+def record(stage: str, model: str, response, prompt_name: str = "") -> dict | None:
+    """Build a usage record from a response and count it in the metrics."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return None
+    input_tokens = meta.prompt_token_count or 0
+    output_tokens = meta.candidates_token_count or 0
+    thoughts_tokens = meta.thoughts_token_count or 0
+    input_price, output_price = PRICES_PER_MILLION.get(model, (0.0, 0.0))
+    # Thinking tokens are billed as output.
+    cost = (input_tokens * input_price + (output_tokens + thoughts_tokens) * output_price) / 1_000_000
+    rec = {
+        "stage": stage,
+        "model": model,
+        "prompt": prompt_name,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "thoughts_tokens": thoughts_tokens,
+        "total_tokens": meta.total_token_count or (input_tokens + output_tokens + thoughts_tokens),
+        "cost_usd": round(cost, 6),
+    }
+    route = route_label()
+    TOKENS.inc(input_tokens, route=route, stage=stage, model=model, kind="input")
+    TOKENS.inc(output_tokens, route=route, stage=stage, model=model, kind="output")
+    if thoughts_tokens:
+        TOKENS.inc(thoughts_tokens, route=route, stage=stage, model=model, kind="thoughts")
+    COST.inc(cost, route=route, stage=stage, model=model)
+    return rec
+
+
+def summarize(records: list) -> dict:
+    """Per-stage and overall totals for one request's usage records."""
+    by_stage = defaultdict(lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                    "thoughts_tokens": 0, "total_tokens": 0, "cost_usd": 0.0})
+    for rec in records:
+        totals = by_stage[rec["stage"]]
+        totals["calls"] += 1
+        for key in ("input_tokens", "output_tokens", "thoughts_tokens", "total_tokens", "cost_usd"):
+            totals[key] += rec[key]
+    overall = {key: sum(t[key] for t in by_stage.values())
+               for key in ("calls", "input_tokens", "output_tokens", "thoughts_tokens", "total_tokens", "cost_usd")}
+    overall["cost_usd"] = round(overall["cost_usd"], 6)
+    for totals in by_stage.values():
+        totals["cost_usd"] = round(totals["cost_usd"], 6)
+    return {"total": overall, "by_stage": dict(by_stage), "calls": records}
+
+
+def append_to_ledger(request_id: str, route: str, records: list, path: str = None):
+    """Append one line per request to the JSONL ledger (no-op if disabled)."""
+    path = LEDGER_PATH if path is None else path
+    if not path or not records:
+        return
+    line = json.dumps({
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "request_id": request_id,
+        "route": route,
+        "calls": records,
+    }, ensure_ascii=False)
+    try:
+        with _ledger_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        log.warning("Could not write ledger %s: %s", path, e)
+
+
+# ---------------------------------------------------------------------------
+# Offline summarizer
+# ---------------------------------------------------------------------------
+
+def _read_ledger(path: str, since: str = None):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if since and entry.get("ts", "") < since:
+                continue
+            yield entry
+
+
+def summarize_ledger(path: str, by: str = "stage", since: str = None) -> list[dict]:
+    """Aggregate ledger calls by stage, model, prompt or route, costliest first."""
+    groups = defaultdict(lambda: {"calls": 0, "requests": set(), "input_tokens": 0,
+                                  "output_tokens": 0, "thoughts_tokens": 0, "cost_usd": 0.0})
+    for entry in _read_ledger(path, since):
+        for call in entry["calls"]:
+            key = entry.get("route", "") if by == "route" else call.get(by, "")
+            group = groups[key or "(none)"]
+            group["calls"] += 1
+            group["requests"].add(entry.get("request_id"))
+            for field in ("input_tokens", "output_tokens", "thoughts_tokens", "cost_usd"):
+                group[field] += call.get(field, 0)
+    rows = []
+    for key, group in groups.items():
+        rows.append({
+            by: key,
+            "calls": group["calls"],
+            "requests": len(group["requests"]),
+            "input_tokens": group["input_tokens"],
+            "output_tokens": group["output_tokens"],
+            "thoughts_tokens": group["thoughts_tokens"],
+            "avg_input_tokens": round(group["input_tokens"] / group["calls"]),
+            "cost_usd": round(group["cost_usd"], 4),
+        })
+    return sorted(rows, key=lambda r: r["cost_usd"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the token usage ledger.")
+    parser.add_argument("ledger", nargs="?", default=LEDGER_PATH)
+    parser.add_argument("--by", choices=["stage", "model", "prompt", "route"], default="stage")
+    parser.add_argument("--since", help="Only entries at or after this ISO timestamp/date")
+    parser.add_argument("--json", action="store_true", help="Print rows as JSON")
+    args = parser.parse_args()
+
+    rows = summarize_ledger(args.ledger, args.by, args.since)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    total_cost = sum(r["cost_usd"] for r in rows) or 1.0
+    print(f"{args.by:<28} {'calls':>7} {'avg in':>9} {'input':>11} {'output':>10} {'cost $':>10} {'share':>6}")
+    for r in rows:
+        print(f"{str(r[args.by])[:28]:<28} {r['calls']:>7} {r['avg_input_tokens']:>9} {r['input_tokens']:>11} "
+              f"{r['output_tokens'] + r['thoughts_tokens']:>10} {r['cost_usd']:>10.4f} {100 * r['cost_usd'] / total_cost:>5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# ---------------------------------------------------------------------------
+# Visual Index — local near-duplicate lookup for source images, so a Gemini
+# call can be skipped when an (almost) identical outfit was analyzed before.
+#
+# Each image gets a 192-float descriptor computed with Pillow + NumPy on a
+# 64x64 thumbnail:
+#   128  HSV color histogram (8 hue x 4 saturation x 4 value bins)
+#    64  edge/texture signature: gradient energy in 4 orientations over a
+#        4x4 grid of the grayscale image
+# Each part is L2-normalized and weighted, and the whole vector normalized,
+# so similarity is a dot product (cosine, 1.0 = identical).
+#
+# Descriptors are rows of a float32 matrix memory-mapped from
+# VISUAL_INDEX_PATH; row order (and the image hash of each row) is kept in
+# the analysis store's image_descriptors table, which every worker tails the
+# same way the color index does. Search is a blocked matrix-vector product
+# over the mapped rows plus argpartition for the top k.
+#
+# VISUAL_INDEX_PATH       float32 matrix file (default data/visual_index.f32; empty disables)
+# VISUAL_REUSE_THRESHOLD  similarity at which /api/analyze suggests reusing a
+#                         stored analysis (default 0.97)
+# ---------------------------------------------------------------------------
+
+import io
+import os
+import threading
+
+import logs
+from lazy_imports import LazyModule
+
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+
+VISUAL_INDEX_PATH = os.getenv("VISUAL_INDEX_PATH", os.path.join("data", "visual_index.f32"))
+VISUAL_REUSE_THRESHOLD = float(os.getenv("VISUAL_REUSE_THRESHOLD", "0.97"))
+
+log = logs.get_logger("visual_index")
+
+THUMB = 64
+HIST_BINS = (8, 4, 4)
+EDGE_GRID = 4
+EDGE_ORIENTATIONS = 4
+DIM = HIST_BINS[0] * HIST_BINS[1] * HIST_BINS[2] + EDGE_GRID * EDGE_GRID * EDGE_ORIENTATIONS
+HIST_WEIGHT, EDGE_WEIGHT = 0.75, 0.25
+
+# Rows per matrix-vector block, so memory stays bounded on large indexes.
+_BLOCK_ROWS = 65536
+_GROW_ROWS = 4096
+
+
+def _unit(v):
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def descriptor(image_bytes: bytes):
+    """float32[DIM] unit vector describing the color and texture of an image."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("RGB", (THUMB * 2, THUMB * 2))
+    img = img.convert("RGB").resize((THUMB, THUMB), Image.BILINEAR)
+
+    hsv = np.asarray(img.convert("HSV"), dtype=np.uint16)
+    h = hsv[..., 0] * HIST_BINS[0] >> 8
+    s = hsv[..., 1] * HIST_BINS[1] >> 8
+    v = hsv[..., 2] * HIST_BINS[2] >> 8
+    hist = np.bincount(((h * HIST_BINS[1] + s) * HIST_BINS[2] + v).ravel(),
+                       minlength=HIST_BINS[0] * HIST_BINS[1] * HIST_BINS[2]).astype(np.float32)
+
+    gray = np.asarray(img.convert("L"), dtype=np.float32)
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    magnitude = np.hypot(gx, gy)
+    orientation = ((np.arctan2(gy, gx) % np.pi) / np.pi * EDGE_ORIENTATIONS).astype(np.int64) % EDGE_ORIENTATIONS
+    cell = THUMB // EDGE_GRID
+    rows = np.arange(THUMB)[:, None] // cell
+    cols = np.arange(THUMB)[None, :] // cell
+    bins = ((rows * EDGE_GRID + cols) * EDGE_ORIENTATIONS + orientation).ravel()
+    edges = np.bincount(bins, weights=magnitude.ravel(), minlength=EDGE_GRID * EDGE_GRID * EDGE_ORIENTATIONS)
+
+    vec = np.concatenate([HIST_WEIGHT * _unit(np.sqrt(hist)), EDGE_WEIGHT * _unit(edges.astype(np.float32))])
+    return _unit(vec).astype(np.float32)
+
+
+class VisualIndex:
+    """Memory-mapped descriptor matrix with cosine top-k search."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._keys = []
+        self._rows = {}
+        self._matrix = None
+        self._lock = threading.RLock()
+        self.synced_id = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "wb").close()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _map(self, rows: int):
+        """(Re)map the file so at least `rows` rows are addressable."""
+        capacity = os.path.getsize(self.path) // (DIM * 4)
+        if self._matrix is not None and len(self._matrix) >= rows:
+            return self._matrix
+        if capacity < rows:
+            capacity = max(rows, capacity * 2, _GROW_ROWS)
+            with open(self.path, "r+b") as f:
+                f.truncate(capacity * DIM * 4)
+        self._matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, DIM))
+        return self._matrix
+
+    def add(self, store, image_hash: str, vec):
+        """Append (or overwrite) the descriptor of an image."""
+        row = store.descriptor_row(image_hash)
+        with self._lock:
+            matrix = self._map(row + 1)
+            matrix[row] = vec
+            matrix.flush()
+
+    def sync(self, store):
+        """Pull rows registered since the last sync."""
+        with self._lock:
+            for row_id, image_hash in store.descriptors_since(self.synced_id):
+                row = row_id - 1
+                self._rows[image_hash] = row
+                self._keys.extend([None] * (row + 1 - len(self._keys)))
+                self._keys[row] = image_hash
+                self.synced_id = row_id
+
+    def vector(self, image_hash: str):
+        with self._lock:
+            row = self._rows.get(image_hash)
+            return None if row is None else np.array(self._map(row + 1)[row])
+
+    def search(self, vec, k: int = 10, exclude: str = None) -> list[tuple[str, float]]:
+        """Top `k` (image_hash, similarity) by dot product, best first."""
+        with self._lock:
+            n = len(self._keys)
+            if n == 0:
+                return []
+            matrix = self._map(n)
+            scores = np.empty(n, dtype=np.float32)
+            for start in range(0, n, _BLOCK_ROWS):
+                stop = min(n, start + _BLOCK_ROWS)
+                np.dot(matrix[start:stop], vec, out=scores[start:stop])
+            keys = self._keys
+        take = min(k + 1, n)
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top])]
+        results = [(keys[i], float(scores[i])) for i in top if keys[i] and keys[i] != exclude]
+        return results[:k]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(store) -> VisualIndex | None:
+    """The process-wide index synced with `store`, or None when disabled."""
+    global _index
+    if not VISUAL_INDEX_PATH or store is None:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = VisualIndex(VISUAL_INDEX_PATH)
+    _index.sync(store)
+    return _index